@@ -5,7 +5,7 @@ echo   CREANDO INSTALADOR / EJECUTABLE PORTABLE
 echo ===================================================
 
 echo [paso 1/4] Instalando PyInstaller...
-pip install pyinstaller aiofiles uvicorn fastapi sqlalchemy psutil requests scapy pysnmp pyasn1 winotify jinja2 python-multipart pystray Pillow
+pip install pyinstaller aiofiles uvicorn fastapi "sqlalchemy[asyncio]" aiosqlite python-dotenv prometheus_client psutil requests "httpx[http2]" scapy pysnmp pyasn1 winotify jinja2 python-multipart pystray Pillow
 
 echo [paso 2/4] Construyendo Frontend (React)...
 cd frontend
@@ -37,6 +37,7 @@ pyinstaller --name "ControlRedCasaPro" ^
             --hidden-import="engineio.async_drivers.threading" ^
             --hidden-import="pysnmp.smi.mibs" ^
             --hidden-import="pysnmp.smi.mibs.instances" ^
+            --hidden-import="h2" ^
             --collect-all="pysnmp" ^
             server.py
 
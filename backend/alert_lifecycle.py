@@ -0,0 +1,147 @@
+"""
+Ciclo de vida de las alertas: abierta -> (escalada) -> reconocida / resuelta.
+
+- Cada alerta abierta se indexa por (dispositivo, condición). El evento que
+  la despeja (el dispositivo vuelve, la métrica baja del umbral...) la
+  resuelve y anota cuánto duró.
+- La escalada usa un montículo de plazos y un único hilo que duerme hasta
+  el siguiente vencimiento: miles de alertas abiertas no cuestan nada entre
+  plazos. Resolver o reconocer una alerta no toca el montículo; la entrada
+  se descarta cuando vence (borrado perezoso).
+"""
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_alert_rows(db, device_id: int, conditions: Iterable[str], now: Optional[datetime] = None) -> int:
+    """
+    Resuelve en la sesión del llamador las filas abiertas de alerts del
+    dispositivo con esas condiciones; devuelve cuántas.
+    """
+    from database import Alert
+
+    now = now or datetime.utcnow()
+    rows = db.query(Alert).filter(
+        Alert.device_id == device_id,
+        Alert.condition.in_(list(conditions)),
+        Alert.resolved_at.is_(None)
+    ).all()
+    for row in rows:
+        row.resolved_at = now
+        if row.timestamp:
+            row.duration_seconds = max((now - row.timestamp).total_seconds(), 0.0)
+    return len(rows)
+
+
+class AlertLifecycle:
+    """Alertas abiertas y temporizadores de escalada"""
+
+    def __init__(self, on_escalate: Callable):
+        self.on_escalate = on_escalate
+        # (device_id, condición) -> alertas abiertas
+        self.open: Dict[tuple, List] = {}
+        self._timers = []  # (vencimiento, seq, alerta, regla)
+        self._seq = itertools.count()
+        self._lock = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def track(self, alert, rule=None, resolvable: bool = True):
+        """
+        Registra una alerta abierta y, si la regla lo pide, su escalada. Solo
+        se indexan las alertas que algún evento puede resolver.
+        """
+        with self._lock:
+            if resolvable:
+                self.open.setdefault((alert.device_id, alert.condition), []).append(alert)
+            minutes = getattr(rule, 'escalate_after_minutes', None)
+            if minutes:
+                due = alert.timestamp.timestamp() + minutes * 60
+                heapq.heappush(self._timers, (due, next(self._seq), alert, rule))
+                self._ensure_thread()
+                self._lock.notify()
+
+    def resolve(self, device_id, conditions: Iterable, now: Optional[datetime] = None, rule_id=None) -> List:
+        """
+        Resuelve las alertas abiertas del dispositivo con esas condiciones
+        (solo las de rule_id si se indica); devuelve las resueltas.
+        """
+        now = now or datetime.utcnow()
+        resolved = []
+        with self._lock:
+            for condition in conditions:
+                key = (device_id, condition)
+                alerts = self.open.get(key)
+                if not alerts:
+                    continue
+                remaining = []
+                for alert in alerts:
+                    if rule_id is not None and alert.alert_metadata.get('rule_id') != rule_id:
+                        remaining.append(alert)
+                        continue
+                    alert.resolve(now)
+                    resolved.append(alert)
+                if remaining:
+                    self.open[key] = remaining
+                else:
+                    del self.open[key]
+        for alert in resolved:
+            logger.info(f"Alerta resuelta tras {alert.duration_seconds:.0f} s: {alert.message}")
+        return resolved
+
+    def acknowledge(self, device_id, condition, user: str = "system") -> int:
+        """Reconoce las alertas abiertas de (dispositivo, condición): dejan de escalar"""
+        count = 0
+        with self._lock:
+            for alert in self.open.get((device_id, condition), []):
+                if not alert.acknowledged:
+                    alert.acknowledge(user)
+                    count += 1
+        return count
+
+    def is_open(self, device_id, condition) -> bool:
+        return bool(self.open.get((device_id, condition)))
+
+    def open_count(self) -> int:
+        with self._lock:
+            return sum(len(alerts) for alerts in self.open.values())
+
+    def _ensure_thread(self):
+        # Se llama con el lock tomado
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._timer_loop, daemon=True, name="alert-escalation")
+            self._thread.start()
+
+    def _timer_loop(self):
+        while True:
+            with self._lock:
+                while self._running and (not self._timers or self._timers[0][0] > datetime.utcnow().timestamp()):
+                    timeout = self._timers[0][0] - datetime.utcnow().timestamp() if self._timers else None
+                    self._lock.wait(timeout)
+                if not self._running:
+                    return
+                _, _, alert, rule = heapq.heappop(self._timers)
+            if alert.resolved_at is not None or alert.acknowledged or alert.escalated:
+                continue
+            alert.escalated = True
+            try:
+                self.on_escalate(alert, rule)
+            except Exception as e:
+                logger.error(f"Error escalando alerta {alert.id}: {e}")
+
+    def pending_escalations(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, alert, _ in self._timers
+                       if alert.resolved_at is None and not alert.acknowledged and not alert.escalated)
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._lock.notify()
@@ -0,0 +1,180 @@
+"""
+Estado persistente de throttling / deduplicación de alertas.
+
+Cada combinación (regla, dispositivo, condición) tiene una huella
+(fingerprint) con la última vez que se notificó y cuántas repeticiones se
+han silenciado desde entonces. Así el throttling es por dispositivo (un
+equipo caído no silencia la misma alerta de los demás) y sobrevive a los
+reinicios sin recorrer la tabla alerts.
+
+- La tabla alert_throttle se lee entera la primera vez que hace falta, con
+  la sesión de solo lectura (se consulta desde dentro de la transacción del
+  colector, que ya tiene la conexión de escritura de SQLite).
+- Las escrituras se acumulan en memoria y un hilo las vuelca cada
+  CRC_THROTTLE_FLUSH_SECONDS; un cierre brusco pierde como mucho ese
+  intervalo.
+"""
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_FLUSH_SECONDS = float(os.getenv("CRC_THROTTLE_FLUSH_SECONDS", "5"))
+# Huellas sin disparos en este tiempo se borran (ningún throttle es tan largo)
+THROTTLE_RETENTION = timedelta(days=7)
+
+
+def fingerprint(rule_key, device_id: Optional[int], condition: str) -> str:
+    """Huella estable de (regla, dispositivo, condición)"""
+    raw = f"{rule_key}|{device_id if device_id is not None else '*'}|{condition}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+class ThrottleEntry:
+    __slots__ = ("rule_id", "device_id", "condition", "last_triggered", "duplicates")
+
+    def __init__(self, rule_id, device_id, condition, last_triggered=None, duplicates=0):
+        self.rule_id = rule_id
+        self.device_id = device_id
+        self.condition = condition
+        self.last_triggered = last_triggered
+        self.duplicates = duplicates or 0
+
+
+class ThrottleStore:
+    """
+    Huellas de alertas en memoria respaldadas por la tabla alert_throttle.
+    Sin session_factory funciona solo en memoria.
+    """
+
+    def __init__(self, session_factory=None, read_session_factory=None, flush_seconds: float = THROTTLE_FLUSH_SECONDS):
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory or session_factory
+        self.flush_seconds = flush_seconds
+        self.entries: Dict[str, ThrottleEntry] = {}
+        self._dirty = set()
+        self._loaded = session_factory is None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        from database import AlertThrottle
+
+        cutoff = datetime.utcnow() - THROTTLE_RETENTION
+        db = self.read_session_factory()
+        try:
+            rows = db.query(AlertThrottle).filter(AlertThrottle.last_triggered >= cutoff).all()
+            for row in rows:
+                # Lo registrado desde el arranque prevalece sobre lo leído
+                self.entries.setdefault(row.fingerprint, ThrottleEntry(
+                    row.rule_id, row.device_id, row.condition, row.last_triggered, row.duplicates
+                ))
+        except Exception as e:
+            logger.error(f"Error cargando el estado de throttling: {e}")
+        finally:
+            db.close()
+        self._loaded = True
+        logger.info(f"{len(self.entries)} huellas de throttling cargadas")
+
+    def allow(self, key: str, throttle_minutes: float, now: Optional[datetime] = None) -> bool:
+        """
+        True si la huella puede notificarse ya; si no, cuenta la repetición
+        como duplicado silenciado.
+        """
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+            if entry is None or entry.last_triggered is None:
+                return True
+            if now - entry.last_triggered >= timedelta(minutes=throttle_minutes or 0):
+                return True
+            entry.duplicates += 1
+            self._dirty.add(key)
+            return False
+
+    def record(self, key: str, rule_id, device_id, condition: str, now: Optional[datetime] = None) -> int:
+        """Registra un envío; devuelve los duplicados silenciados desde el anterior"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = ThrottleEntry(rule_id, device_id, condition)
+            duplicates = entry.duplicates
+            entry.last_triggered = now
+            entry.duplicates = 0
+            self._dirty.add(key)
+        self._start()
+        return duplicates
+
+    def last_triggered(self, key: str) -> Optional[datetime]:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+            return entry.last_triggered if entry else None
+
+    def _start(self):
+        if self.session_factory is None or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, daemon=True, name="alert-throttle")
+                self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> int:
+        """Guarda las huellas modificadas y purga las caducadas; devuelve cuántas se escribieron"""
+        if self.session_factory is None:
+            return 0
+        from database import AlertThrottle
+
+        with self._lock:
+            if not self._dirty:
+                return 0
+            cutoff = datetime.utcnow() - THROTTLE_RETENTION
+            expired = [key for key, entry in self.entries.items()
+                       if entry.last_triggered is not None and entry.last_triggered < cutoff]
+            for key in expired:
+                del self.entries[key]
+            pending = {
+                key: (entry.rule_id, entry.device_id, entry.condition, entry.last_triggered, entry.duplicates)
+                for key, entry in ((key, self.entries.get(key)) for key in self._dirty)
+                if entry is not None
+            }
+            self._dirty.clear()
+
+        db = self.session_factory()
+        try:
+            for key, (rule_id, device_id, condition, last_triggered, duplicates) in pending.items():
+                db.merge(AlertThrottle(
+                    fingerprint=key, rule_id=rule_id, device_id=device_id, condition=condition,
+                    last_triggered=last_triggered, duplicates=duplicates
+                ))
+            db.query(AlertThrottle).filter(AlertThrottle.last_triggered < cutoff).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error guardando el estado de throttling: {e}")
+            with self._lock:
+                # Se reintenta en el siguiente volcado
+                self._dirty.update(key for key in pending if key in self.entries)
+            return 0
+        finally:
+            db.close()
+        return len(pending)
+
+    def close(self):
+        """Para el hilo de volcado y guarda lo pendiente"""
+        self._stop.set()
+        self.flush()
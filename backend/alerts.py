@@ -8,13 +8,24 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import logging
 import json
-import smtplib
+import operator
+import os
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import requests
+
+from instrumentation import ALERT_DISPATCH, ALERTS_SUPPRESSED
+from notifications import NotificationDispatcher, PermanentNotificationError
+from metric_windows import WindowStore, is_valid_aggregation, percentile_of
+from alert_throttle import ThrottleStore, fingerprint
+from alert_lifecycle import AlertLifecycle
 
 logger = logging.getLogger(__name__)
 
+# Cada cuánto se comprueba si han cambiado las reglas en la tabla alert_rules
+RULES_RELOAD_SECONDS = float(os.getenv("CRC_RULES_RELOAD_SECONDS", "10"))
+
 
 class AlertLevel(str, Enum):
     """Niveles de severidad de alertas"""
@@ -42,6 +53,11 @@ class AlertCondition(str, Enum):
     PORT_CLOSED = "port_closed"
     PORT_OPENED = "port_opened"
     UNAUTHORIZED_DEVICE = "unauthorized_device"
+    # Eventos que envía el propio equipo de red (traps SNMP / syslog)
+    LINK_DOWN = "link_down"
+    LINK_UP = "link_up"
+    AUTH_FAILURE = "auth_failure"
+    DHCP_LEASE = "dhcp_lease"
 
 
 class Alert:
@@ -69,6 +85,19 @@ class Alert:
         self.acknowledged = False
         self.acknowledged_at = None
         self.acknowledged_by = None
+        self.resolved_at = None
+        self.duration_seconds = None
+        self.escalated = False
+
+    def acknowledge(self, user: str = "system"):
+        self.acknowledged = True
+        self.acknowledged_at = datetime.utcnow()
+        self.acknowledged_by = user
+
+    def resolve(self, now: Optional[datetime] = None):
+        """Cierra la alerta y anota cuánto ha durado"""
+        self.resolved_at = now or datetime.utcnow()
+        self.duration_seconds = max((self.resolved_at - self.timestamp).total_seconds(), 0.0)
 
     def to_dict(self):
         """Convierte la alerta a diccionario"""
@@ -84,8 +113,152 @@ class Alert:
             'timestamp': self.timestamp.isoformat(),
             'acknowledged': self.acknowledged,
             'acknowledged_at': self.acknowledged_at.isoformat() if self.acknowledged_at else None,
-            'acknowledged_by': self.acknowledged_by
+            'acknowledged_by': self.acknowledged_by,
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
+            'duration_seconds': self.duration_seconds,
+            'escalated': self.escalated
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Alert":
+        """Reconstruye una alerta serializada con to_dict (p.ej. desde dead-letter)"""
+        if data.get('digest'):
+            return AlertDigest.from_dict(data)
+        alert = cls(
+            level=AlertLevel(data['level']),
+            condition=AlertCondition(data['condition']),
+            message=data['message'],
+            device_id=data.get('device_id'),
+            device_name=data.get('device_name'),
+            device_ip=data.get('device_ip'),
+            alert_metadata=data.get('metadata')
+        )
+        alert.id = data.get('id')
+        if data.get('timestamp'):
+            alert.timestamp = datetime.fromisoformat(data['timestamp'])
+        return alert
+
+
+# Orden de severidad para el nivel de un resumen
+LEVEL_SEVERITY = {AlertLevel.DEBUG: 0, AlertLevel.INFO: 1, AlertLevel.WARNING: 2, AlertLevel.CRITICAL: 3}
+
+# Condiciones que no se notifican si el equipo aguas arriba está caído
+CORRELATED_CONDITIONS = {
+    AlertCondition.DEVICE_OFFLINE,
+    AlertCondition.HIGH_LATENCY,
+    AlertCondition.HIGH_PACKET_LOSS
+}
+
+
+class AlertDigest:
+    """Varias alertas de la misma condición y grupo enviadas en un solo mensaje"""
+
+    MAX_LINES = 30  # Telegram corta los mensajes a 4096 caracteres
+
+    def __init__(self, alerts: List[Alert]):
+        self.alerts = alerts
+        self.level = max((a.level for a in alerts), key=LEVEL_SEVERITY.get)
+        self.condition = alerts[0].condition
+        self.group_id = alerts[0].alert_metadata.get('group_id')
+        self.timestamp = alerts[-1].timestamp
+        self.message = self._summary()
+
+    def _summary(self) -> str:
+        n = len(self.alerts)
+        messages = {
+            AlertCondition.DEVICE_OFFLINE: f"🔴 {n} dispositivos OFFLINE",
+            AlertCondition.DEVICE_ONLINE: f"🟢 {n} dispositivos ONLINE",
+            AlertCondition.HIGH_LATENCY: f"⚠️ Latencia alta en {n} dispositivos",
+            AlertCondition.HIGH_PACKET_LOSS: f"⚠️ Pérdida de paquetes alta en {n} dispositivos",
+            AlertCondition.NEW_DEVICE: f"ℹ️ {n} dispositivos nuevos detectados",
+            AlertCondition.UNAUTHORIZED_DEVICE: f"🚨 {n} dispositivos NO autorizados",
+            AlertCondition.LINK_DOWN: f"🔌 {n} enlaces caídos",
+            AlertCondition.LINK_UP: f"🔌 {n} enlaces recuperados",
+            AlertCondition.AUTH_FAILURE: f"🔐 {n} fallos de autenticación",
+            AlertCondition.DHCP_LEASE: f"ℹ️ {n} concesiones DHCP"
         }
+        message = messages.get(self.condition, f"{n} alertas: {self.condition.value}")
+        if self.group_id:
+            message += f" (grupo {self.group_id})"
+        return message
+
+    def lines(self, bullet: str = "• ") -> List[str]:
+        """Una línea por dispositivo, recortada a MAX_LINES"""
+        lines = [f"{bullet}{a.device_name or 'N/A'} ({a.device_ip or 'N/A'})" for a in self.alerts[:self.MAX_LINES]]
+        if len(self.alerts) > self.MAX_LINES:
+            lines.append(f"… y {len(self.alerts) - self.MAX_LINES} más")
+        return lines
+
+    def to_dict(self):
+        return {
+            'digest': True,
+            'level': self.level.value,
+            'condition': self.condition.value,
+            'message': self.message,
+            'group_id': self.group_id,
+            'count': len(self.alerts),
+            'timestamp': self.timestamp.isoformat(),
+            'alerts': [a.to_dict() for a in self.alerts]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "AlertDigest":
+        return cls([Alert.from_dict(a) for a in data['alerts']])
+
+
+# Eventos de process_device_event -> condición
+EVENT_CONDITIONS = {
+    'offline': AlertCondition.DEVICE_OFFLINE,
+    'online': AlertCondition.DEVICE_ONLINE,
+    'new': AlertCondition.NEW_DEVICE,
+    'high_latency': AlertCondition.HIGH_LATENCY,
+    'high_packet_loss': AlertCondition.HIGH_PACKET_LOSS,
+    'unauthorized': AlertCondition.UNAUTHORIZED_DEVICE,
+    'link_down': AlertCondition.LINK_DOWN,
+    'link_up': AlertCondition.LINK_UP,
+    'auth_failure': AlertCondition.AUTH_FAILURE,
+    'dhcp_lease': AlertCondition.DHCP_LEASE
+}
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+# Umbral de las condiciones numéricas si la regla no define uno
+DEFAULT_THRESHOLDS = {
+    AlertCondition.HIGH_LATENCY: 100.0,  # ms
+    AlertCondition.HIGH_PACKET_LOSS: 5.0  # %
+}
+
+# Métrica que evalúa cada condición numérica si la regla no indica metric_name
+DEFAULT_METRICS = {
+    AlertCondition.HIGH_LATENCY: "ping_latency",
+    AlertCondition.HIGH_PACKET_LOSS: "ping_packet_loss"
+}
+
+# Evento que resuelve las alertas abiertas de otras condiciones
+CLEARING_CONDITIONS = {
+    AlertCondition.DEVICE_ONLINE: (AlertCondition.DEVICE_OFFLINE,),
+    AlertCondition.PORT_OPENED: (AlertCondition.PORT_CLOSED,),
+    AlertCondition.PORT_CLOSED: (AlertCondition.PORT_OPENED,),
+    AlertCondition.LINK_UP: (AlertCondition.LINK_DOWN,)
+}
+
+# Alertas que un evento posterior puede resolver (las de umbral, al dejar de cumplirse)
+RESOLVABLE_CONDITIONS = set(DEFAULT_THRESHOLDS) | {
+    condition for cleared in CLEARING_CONDITIONS.values() for condition in cleared
+}
+
+# Canales externos que se añaden al escalar una alerta no atendida
+ESCALATION_CHANNELS = (AlertChannel.EMAIL, AlertChannel.TELEGRAM, AlertChannel.WEBHOOK)
+
+# Cada cuánto se liberan las ventanas de métricas que ya no reciben muestras
+WINDOW_PRUNE_SECONDS = 300
 
 
 class AlertRule:
@@ -101,7 +274,11 @@ class AlertRule:
         device_id: Optional[int] = None,
         threshold: Optional[float] = None,
         throttle_minutes: int = 5,
-        escalate_after_minutes: Optional[int] = None
+        escalate_after_minutes: Optional[int] = None,
+        operator: str = '>',
+        aggregation: Optional[str] = None,
+        time_window: Optional[int] = None,
+        metric_name: Optional[str] = None
     ):
         self.id = None
         self.name = name
@@ -113,18 +290,70 @@ class AlertRule:
         self.threshold = threshold  # Para condiciones numéricas
         self.throttle_minutes = throttle_minutes
         self.escalate_after_minutes = escalate_after_minutes
+        self.operator = operator
+        self.aggregation = aggregation  # avg, min, max, sum, count o pNN sobre time_window
+        self.time_window = time_window  # Minutos
+        # Métrica evaluada en streaming (por defecto la de la condición)
+        self.metric_name = metric_name or DEFAULT_METRICS.get(condition)
         self.last_triggered = None
 
-    def can_trigger(self) -> bool:
-        """Verifica si la regla puede dispararse (throttling)"""
-        if not self.enabled:
+    @classmethod
+    def from_model(cls, row) -> "AlertRule":
+        """Convierte una fila de alert_rules (incluidos los campos legacy)"""
+        channels = row.channels or row.notification_channels or [AlertChannel.IN_APP.value]
+        rule = cls(
+            name=row.name,
+            condition=AlertCondition((row.condition or '').strip().lower()),
+            level=AlertLevel((row.level or row.alert_level or 'warning').strip().lower()),
+            channels=[AlertChannel(ch.strip().lower()) for ch in channels],
+            enabled=bool(row.enabled),
+            device_id=row.device_id,
+            threshold=row.threshold if row.threshold is not None else row.threshold_value,
+            throttle_minutes=row.throttle_minutes if row.throttle_minutes is not None else 5,
+            escalate_after_minutes=row.escalate_after_minutes,
+            operator=row.threshold_operator or '>',
+            aggregation=row.aggregation.lower() if row.aggregation else None,
+            time_window=row.time_window,
+            metric_name=row.metric_name
+        )
+        rule.validate()
+        rule.id = row.id
+        rule.last_triggered = row.last_triggered
+        return rule
+
+    def validate(self):
+        """ValueError si el operador o la agregación no son válidos"""
+        if self.operator not in OPERATORS:
+            raise ValueError(f"Operador no soportado: {self.operator}")
+        if self.aggregation and not is_valid_aggregation(self.aggregation):
+            raise ValueError(f"Agregación no soportada: {self.aggregation}")
+        if self.aggregation and not self.time_window:
+            raise ValueError("La agregación requiere time_window (minutos)")
+
+    def to_columns(self) -> Dict:
+        """Campos de la fila de alert_rules"""
+        return {
+            'name': self.name,
+            'condition': self.condition.value,
+            'level': self.level.value,
+            'channels': [ch.value for ch in self.channels],
+            'enabled': self.enabled,
+            'device_id': self.device_id,
+            'threshold': self.threshold,
+            'threshold_operator': self.operator,
+            'aggregation': self.aggregation,
+            'time_window': self.time_window,
+            'metric_name': self.metric_name,
+            'throttle_minutes': self.throttle_minutes,
+            'escalate_after_minutes': self.escalate_after_minutes
+        }
+
+    def matches(self, value: Optional[float]) -> bool:
+        """Compara un valor con el umbral de la regla"""
+        threshold = self.threshold if self.threshold is not None else DEFAULT_THRESHOLDS.get(self.condition)
+        if value is None or threshold is None:
             return False
-        
-        if self.last_triggered is None:
-            return True
-        
-        elapsed = datetime.utcnow() - self.last_triggered
-        return elapsed.total_seconds() >= (self.throttle_minutes * 60)
+        return OPERATORS[self.operator](value, threshold)
 
     def to_dict(self):
         """Convierte la regla a diccionario"""
@@ -139,57 +368,302 @@ class AlertRule:
             'threshold': self.threshold,
             'throttle_minutes': self.throttle_minutes,
             'escalate_after_minutes': self.escalate_after_minutes,
+            'operator': self.operator,
+            'aggregation': self.aggregation,
+            'time_window': self.time_window,
+            'metric_name': self.metric_name,
             'last_triggered': self.last_triggered.isoformat() if self.last_triggered else None
         }
 
 
+def default_rules() -> List[AlertRule]:
+    """Reglas iniciales; se guardan en alert_rules la primera vez"""
+    return [
+        AlertRule(
+            name="Dispositivo Crítico Offline",
+            condition=AlertCondition.DEVICE_OFFLINE,
+            level=AlertLevel.CRITICAL,
+            channels=[AlertChannel.IN_APP, AlertChannel.EMAIL, AlertChannel.TELEGRAM],
+            throttle_minutes=10
+        ),
+        AlertRule(
+            name="Latencia Alta",
+            condition=AlertCondition.HIGH_LATENCY,
+            level=AlertLevel.WARNING,
+            channels=[AlertChannel.IN_APP],
+            threshold=100.0,  # ms
+            throttle_minutes=15
+        ),
+        AlertRule(
+            name="Nuevo Dispositivo",
+            condition=AlertCondition.NEW_DEVICE,
+            level=AlertLevel.INFO,
+            channels=[AlertChannel.IN_APP, AlertChannel.TELEGRAM],
+            throttle_minutes=0
+        ),
+        AlertRule(
+            name="Dispositivo No Autorizado",
+            condition=AlertCondition.UNAUTHORIZED_DEVICE,
+            level=AlertLevel.CRITICAL,
+            channels=[AlertChannel.IN_APP, AlertChannel.EMAIL, AlertChannel.TELEGRAM],
+            throttle_minutes=5
+        ),
+        AlertRule(
+            name="Enlace Caído",
+            condition=AlertCondition.LINK_DOWN,
+            level=AlertLevel.WARNING,
+            channels=[AlertChannel.IN_APP, AlertChannel.TELEGRAM],
+            throttle_minutes=5
+        ),
+        AlertRule(
+            name="Fallo de Autenticación",
+            condition=AlertCondition.AUTH_FAILURE,
+            level=AlertLevel.WARNING,
+            channels=[AlertChannel.IN_APP],
+            throttle_minutes=10
+        )
+    ]
+
+
 class AlertManager:
     """Gestor principal de alertas"""
     
-    def __init__(self, db_session, config: Dict):
+    def __init__(
+        self,
+        db_session,
+        config: Dict,
+        dispatcher: Optional[NotificationDispatcher] = None,
+        throttle: Optional[ThrottleStore] = None
+    ):
         self.db = db_session
         self.config = config
         self.rules: List[AlertRule] = []
+        # (condición, device_id o None para globales) -> reglas activas
+        self.rule_index: Dict[tuple, List[AlertRule]] = {}
+        # (métrica, device_id o None) -> reglas evaluadas con cada muestra
+        self.metric_index: Dict[tuple, List[AlertRule]] = {}
+        self.windows = WindowStore()
+        self._windows_pruned_at = time.monotonic()
         self.active_alerts: List[Alert] = []
+        self._rules_lock = threading.Lock()
+        self._rules_signature = None
+        self._rules_thread: Optional[threading.Thread] = None
+        self._rules_stop = threading.Event()
+        self._dispatcher = dispatcher
+        self._dispatcher_lock = threading.Lock()
+        self._throttle = throttle
+        self._fingerprints: Dict[tuple, str] = {}
+        self.lifecycle = AlertLifecycle(on_escalate=self._escalate)
+        # Correlación: dispositivos caídos y puerta de enlace (de la que cuelga
+        # todo lo que no tiene parent_id)
+        self.down_devices = set()
+        self.gateway_device_id: Optional[int] = None
+
+    @property
+    def dispatcher(self) -> NotificationDispatcher:
+        """Colas de envío externo; se crean con el primer envío por email/Telegram/webhook"""
+        if self._dispatcher is None:
+            with self._dispatcher_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = NotificationDispatcher(
+                        {
+                            AlertChannel.EMAIL.value: self._send_email,
+                            AlertChannel.TELEGRAM.value: self._send_telegram,
+                            AlertChannel.WEBHOOK.value: self._send_webhook
+                        },
+                        digest_factory=AlertDigest,
+                        digest_key=lambda alert: (alert.condition, alert.alert_metadata.get('group_id'))
+                    )
+        return self._dispatcher
+
+    @property
+    def throttle(self) -> ThrottleStore:
+        """Huellas de throttling por (regla, dispositivo, condición), en alert_throttle"""
+        if self._throttle is None:
+            if self.db is None:
+                self._throttle = ThrottleStore()
+            else:
+                from database import SessionLocal, ReadSessionLocal
+                self._throttle = ThrottleStore(SessionLocal, ReadSessionLocal)
+        return self._throttle
+
+    def close(self):
+        """Para los hilos de envío (lo pendiente queda en dead-letter) y guarda el throttling"""
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self._throttle is not None:
+            self._throttle.close()
+        self._rules_stop.set()
+        self.lifecycle.stop()
         
+    def _read_session(self):
+        """Sesión de solo lectura: no ocupa la conexión de escritura de SQLite"""
+        from database import ReadSessionLocal
+        return ReadSessionLocal()
+
     def load_rules(self):
-        """Carga reglas desde la base de datos"""
-        # TODO: Implementar carga desde BD
-        # Por ahora, reglas por defecto
-        default_rules = [
-            AlertRule(
-                name="Dispositivo Crítico Offline",
-                condition=AlertCondition.DEVICE_OFFLINE,
-                level=AlertLevel.CRITICAL,
-                channels=[AlertChannel.IN_APP, AlertChannel.EMAIL, AlertChannel.TELEGRAM],
-                throttle_minutes=10
-            ),
-            AlertRule(
-                name="Latencia Alta",
-                condition=AlertCondition.HIGH_LATENCY,
-                level=AlertLevel.WARNING,
-                channels=[AlertChannel.IN_APP],
-                threshold=100.0,  # ms
-                throttle_minutes=15
-            ),
-            AlertRule(
-                name="Nuevo Dispositivo",
-                condition=AlertCondition.NEW_DEVICE,
-                level=AlertLevel.INFO,
-                channels=[AlertChannel.IN_APP, AlertChannel.TELEGRAM],
-                throttle_minutes=0
-            ),
-            AlertRule(
-                name="Dispositivo No Autorizado",
-                condition=AlertCondition.UNAUTHORIZED_DEVICE,
-                level=AlertLevel.CRITICAL,
-                channels=[AlertChannel.IN_APP, AlertChannel.EMAIL, AlertChannel.TELEGRAM],
-                throttle_minutes=5
-            )
-        ]
-        self.rules = default_rules
+        """
+        Carga las reglas de la tabla alert_rules (la primera vez la rellena
+        con las reglas por defecto). Sin sesión de BD usa las de por defecto.
+        Con BD arranca además la comprobación periódica de cambios.
+        """
+        if self.db is None:
+            self._set_rules(default_rules())
+            return
+
+        from database import AlertRule as AlertRuleModel
+
+        with self._rules_lock:
+            rows, signature = self._read_rules()
+            if not rows:
+                # Tabla vacía (primer arranque): única escritura, con la sesión propia
+                try:
+                    for rule in default_rules():
+                        self.db.add(AlertRuleModel(**rule.to_columns()))
+                    self.db.commit()
+                finally:
+                    self.db.close()
+                rows, signature = self._read_rules()
 
-    def check_condition(self, condition: AlertCondition, device: Dict, value: Optional[float] = None) -> bool:
+            rules = []
+            for row in rows:
+                try:
+                    rules.append(AlertRule.from_model(row))
+                except ValueError as e:
+                    logger.error(f"Regla {row.id} ({row.name}) ignorada: {e}")
+            self._rules_signature = signature
+            self._set_rules(rules)
+        logger.info(f"{len(self.rules)} reglas de alerta cargadas")
+        self._start_rules_watcher()
+
+    def _read_rules(self):
+        """(filas de alert_rules, firma) leídas con la sesión de solo lectura"""
+        from database import AlertRule as AlertRuleModel
+
+        db = self._read_session()
+        try:
+            rows = db.query(AlertRuleModel).all()
+            return rows, self._read_rules_signature(db)
+        finally:
+            db.close()
+
+    def _read_rules_signature(self, db):
+        """(número de reglas, última modificación): cambia con cualquier alta, baja o edición"""
+        from sqlalchemy import func
+        from database import AlertRule as AlertRuleModel
+
+        return tuple(db.query(
+            func.count(AlertRuleModel.id), func.max(AlertRuleModel.updated_at)
+        ).one())
+
+    def maybe_reload_rules(self):
+        """Recarga las reglas si la tabla ha cambiado"""
+        if self.db is None:
+            return
+        db = self._read_session()
+        try:
+            changed = self._read_rules_signature(db) != self._rules_signature
+        except Exception as e:
+            logger.error(f"Error comprobando reglas de alerta: {e}")
+            return
+        finally:
+            db.close()
+        if changed:
+            self.load_rules()
+
+    def _start_rules_watcher(self):
+        """
+        Hilo que comprueba cada RULES_RELOAD_SECONDS si han cambiado las
+        reglas (ediciones desde otra instancia o directas en la BD). Va
+        aparte para no consultar la BD dentro de las transacciones del
+        escáner, el colector o el receptor de eventos.
+        """
+        if self._rules_thread is not None or RULES_RELOAD_SECONDS <= 0:
+            return
+        self._rules_thread = threading.Thread(target=self._rules_loop, daemon=True, name="alert-rules")
+        self._rules_thread.start()
+
+    def _rules_loop(self):
+        while not self._rules_stop.wait(RULES_RELOAD_SECONDS):
+            try:
+                self.maybe_reload_rules()
+            except Exception as e:
+                logger.error(f"Error recargando reglas de alerta: {e}")
+
+    def _set_rules(self, rules: List[AlertRule]):
+        """Sustituye las reglas y reconstruye el índice (condición, dispositivo)"""
+        previous = {rule.id: rule.last_triggered for rule in self.rules if rule.id is not None}
+        index: Dict[tuple, List[AlertRule]] = {}
+        metric_index: Dict[tuple, List[AlertRule]] = {}
+        for rule in rules:
+            if rule.id in previous and previous[rule.id]:
+                rule.last_triggered = max(filter(None, (rule.last_triggered, previous[rule.id])))
+            if rule.enabled:
+                index.setdefault((rule.condition, rule.device_id), []).append(rule)
+                if rule.metric_name:
+                    metric_index.setdefault((rule.metric_name, rule.device_id), []).append(rule)
+        # Se asignan de una vez: los hilos que evalúan eventos ven el índice viejo o el nuevo
+        self.rules = rules
+        self.rule_index = index
+        self.metric_index = metric_index
+
+    def rules_for(self, condition: AlertCondition, device_id: Optional[int]) -> List[AlertRule]:
+        """
+        Reglas aplicables en O(1): las específicas del dispositivo sustituyen
+        a las globales de la misma condición.
+        """
+        index = self.rule_index
+        if device_id is not None:
+            rules = index.get((condition, device_id))
+            if rules:
+                return rules
+        return index.get((condition, None), [])
+
+    def metric_rules_for(self, metric_name: str, device_id: Optional[int]) -> List[AlertRule]:
+        """Como rules_for, pero por nombre de métrica"""
+        index = self.metric_index
+        if device_id is not None:
+            rules = index.get((metric_name, device_id))
+            if rules:
+                return rules
+        return index.get((metric_name, None), [])
+
+    def load_device_state(self):
+        """Dispositivos ya Offline al arrancar, para la correlación"""
+        if self.db is None:
+            return
+        from database import Device
+        db = self._read_session()
+        try:
+            self.down_devices = {
+                device_id for (device_id,) in db.query(Device.id).filter(Device.status == "Offline").all()
+            }
+        finally:
+            db.close()
+
+    def mark_down(self, device_ids):
+        """
+        Registra dispositivos caídos antes de procesar sus eventos, para que
+        en un mismo escaneo los hijos de un switch caído se supriman aunque
+        se procesen antes que él.
+        """
+        self.down_devices.update(device_ids)
+
+    def upstream_down(self, device: Dict) -> Optional[int]:
+        """Id del equipo aguas arriba caído del que depende el dispositivo, si lo hay"""
+        device_id = device.get('id')
+        for upstream in (device.get('parent_id'), self.gateway_device_id):
+            if upstream and upstream != device_id and upstream in self.down_devices:
+                return upstream
+        return None
+
+    def check_condition(
+        self,
+        condition: AlertCondition,
+        device: Dict,
+        value: Optional[float] = None,
+        rule: Optional[AlertRule] = None
+    ) -> bool:
         """Verifica si se cumple una condición"""
         if condition == AlertCondition.DEVICE_OFFLINE:
             return device.get('status') == 'Offline'
@@ -197,11 +671,11 @@ class AlertManager:
         elif condition == AlertCondition.DEVICE_ONLINE:
             return device.get('status') == 'Online'
         
-        elif condition == AlertCondition.HIGH_LATENCY:
-            return value is not None and value > 100.0
-        
-        elif condition == AlertCondition.HIGH_PACKET_LOSS:
-            return value is not None and value > 5.0
+        elif condition in DEFAULT_THRESHOLDS:
+            # Condiciones numéricas: umbral y operador de la regla
+            if rule is not None:
+                return rule.matches(value)
+            return value is not None and value > DEFAULT_THRESHOLDS[condition]
         
         elif condition == AlertCondition.NEW_DEVICE:
             # Se dispara manualmente al detectar nuevo dispositivo
@@ -210,6 +684,13 @@ class AlertManager:
         elif condition == AlertCondition.UNAUTHORIZED_DEVICE:
             return not device.get('is_authorized', True)
         
+        elif condition in (
+            AlertCondition.LINK_DOWN, AlertCondition.LINK_UP,
+            AlertCondition.AUTH_FAILURE, AlertCondition.DHCP_LEASE
+        ):
+            # Eventos recibidos del equipo (event_receiver): siempre se cumplen
+            return True
+        
         return False
 
     def create_alert(
@@ -235,7 +716,8 @@ class AlertManager:
             device_ip=device.get('ip'),
             alert_metadata={
                 'rule_id': rule.id,
-                'rule_name': rule.name
+                'rule_name': rule.name,
+                'group_id': device.get('group_id')
             }
         )
         
@@ -251,25 +733,61 @@ class AlertManager:
             AlertCondition.HIGH_LATENCY: f"⚠️ Latencia alta en '{device_name}'",
             AlertCondition.HIGH_PACKET_LOSS: f"⚠️ Pérdida de paquetes alta en '{device_name}'",
             AlertCondition.NEW_DEVICE: f"ℹ️ Nuevo dispositivo detectado: '{device_name}'",
-            AlertCondition.UNAUTHORIZED_DEVICE: f"🚨 Dispositivo NO autorizado: '{device_name}'"
+            AlertCondition.UNAUTHORIZED_DEVICE: f"🚨 Dispositivo NO autorizado: '{device_name}'",
+            AlertCondition.LINK_DOWN: f"🔌 Enlace caído en '{device_name}'",
+            AlertCondition.LINK_UP: f"🔌 Enlace recuperado en '{device_name}'",
+            AlertCondition.AUTH_FAILURE: f"🔐 Fallo de autenticación en '{device_name}'",
+            AlertCondition.DHCP_LEASE: f"ℹ️ Concesión DHCP para '{device_name}'"
         }
         
         return messages.get(rule.condition, f"Alerta: {rule.name}")
 
     def send_notification(self, alert: Alert, channels: List[AlertChannel]):
-        """Envía notificación por los canales especificados"""
+        """
+        Envía notificación por los canales especificados. In-app es inmediato;
+        email, Telegram y webhook solo se encolan en el dispatcher, de modo
+        que quien genera la alerta (escáner, colector) nunca espera a la red.
+        """
         for channel in channels:
+            started = time.perf_counter()
             try:
                 if channel == AlertChannel.IN_APP:
                     self._send_in_app(alert)
-                elif channel == AlertChannel.EMAIL:
-                    self._send_email(alert)
-                elif channel == AlertChannel.TELEGRAM:
-                    self._send_telegram(alert)
-                elif channel == AlertChannel.WEBHOOK:
-                    self._send_webhook(alert)
+                elif self._channel_enabled(channel, alert):
+                    self.dispatcher.submit(channel.value, alert)
             except Exception as e:
                 logger.error(f"Error sending alert via {channel}: {e}")
+            ALERT_DISPATCH.labels(getattr(channel, "value", str(channel))).observe(time.perf_counter() - started)
+
+    def _channel_enabled(self, channel: AlertChannel, alert: Alert) -> bool:
+        """Comprueba la configuración del canal antes de encolar"""
+        if channel == AlertChannel.EMAIL:
+            if not self.config.get('email', {}).get('enabled'):
+                logger.warning("Email notifications disabled")
+                return False
+            return True
+
+        if channel == AlertChannel.TELEGRAM:
+            telegram_config = self.config.get('telegram', {})
+            if not telegram_config.get('enabled'):
+                logger.warning("Telegram notifications disabled")
+                return False
+            # Granular checks
+            if alert.condition == AlertCondition.NEW_DEVICE and not telegram_config.get('notify_new_device', True):
+                return False
+            if alert.condition == AlertCondition.DEVICE_OFFLINE and not telegram_config.get('notify_device_offline', True):
+                return False
+            if alert.condition == AlertCondition.DEVICE_ONLINE and not telegram_config.get('notify_device_online', False):
+                return False
+            return True
+
+        if channel == AlertChannel.WEBHOOK:
+            if not self.config.get('webhook', {}).get('enabled'):
+                logger.warning("Webhook notifications disabled")
+                return False
+            return True
+
+        return False
 
     def _send_in_app(self, alert: Alert):
         """Guarda alerta para mostrar en la app"""
@@ -277,164 +795,276 @@ class AlertManager:
         logger.info(f"In-app alert created: {alert.message}")
 
     def _send_email(self, alert: Alert):
-        """Envía alerta por email"""
+        """Envía alerta por email (desde el hilo del dispatcher; lanza excepción si falla)"""
         email_config = self.config.get('email', {})
+        if not email_config.get('smtp_server'):
+            raise PermanentNotificationError("Servidor SMTP no configurado")
+
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = f"[{alert.level.value.upper()}] {alert.message}"
+        msg['From'] = email_config.get('from_email')
+        msg['To'] = email_config.get('to_email')
+
+        if isinstance(alert, AlertDigest):
+            details = "".join(f"<li>{line}</li>" for line in alert.lines(bullet=""))
+            details = f"<ul>{details}</ul>"
+        else:
+            details = (
+                f"<p><strong>Dispositivo:</strong> {alert.device_name or 'N/A'}</p>"
+                f"<p><strong>IP:</strong> {alert.device_ip or 'N/A'}</p>"
+            )
         
-        if not email_config.get('enabled'):
-            logger.warning("Email notifications disabled")
-            return
+        # Cuerpo del email
+        html = f"""
+        <html>
+            <body>
+                <h2 style="color: {'#dc2626' if alert.level == AlertLevel.CRITICAL else '#f59e0b' if alert.level == AlertLevel.WARNING else '#3b82f6'}">
+                    {alert.message}
+                </h2>
+                <p><strong>Nivel:</strong> {alert.level.value.upper()}</p>
+                <p><strong>Condición:</strong> {alert.condition.value}</p>
+                {details}
+                <p><strong>Timestamp:</strong> {alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')}</p>
+            </body>
+        </html>
+        """
         
-        try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = f"[{alert.level.value.upper()}] {alert.message}"
-            msg['From'] = email_config.get('from_email')
-            msg['To'] = email_config.get('to_email')
-            
-            # Cuerpo del email
-            html = f"""
-            <html>
-                <body>
-                    <h2 style="color: {'#dc2626' if alert.level == AlertLevel.CRITICAL else '#f59e0b' if alert.level == AlertLevel.WARNING else '#3b82f6'}">
-                        {alert.message}
-                    </h2>
-                    <p><strong>Nivel:</strong> {alert.level.value.upper()}</p>
-                    <p><strong>Condición:</strong> {alert.condition.value}</p>
-                    <p><strong>Dispositivo:</strong> {alert.device_name or 'N/A'}</p>
-                    <p><strong>IP:</strong> {alert.device_ip or 'N/A'}</p>
-                    <p><strong>Timestamp:</strong> {alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')}</p>
-                </body>
-            </html>
-            """
-            
-            msg.attach(MIMEText(html, 'html'))
-            
-            # Enviar
-            with smtplib.SMTP(email_config.get('smtp_server'), email_config.get('smtp_port', 587)) as server:
-                server.starttls()
-                server.login(email_config.get('smtp_user'), email_config.get('smtp_password'))
-                server.send_message(msg)
-            
-            logger.info(f"Email alert sent: {alert.message}")
-        except Exception as e:
-            logger.error(f"Failed to send email: {e}")
+        msg.attach(MIMEText(html, 'html'))
+        
+        # Enviar por la conexión SMTP persistente del hilo de envío
+        self.dispatcher.pool.send_mail(email_config, msg)
+        logger.info(f"Email alert sent: {alert.message}")
 
-    def _send_telegram(self, alert: Alert, force: bool = False):
-        """Envía alerta por Telegram"""
+    def _send_telegram(self, alert: Alert):
+        """Envía alerta por Telegram (desde el hilo del dispatcher; lanza excepción si falla)"""
         telegram_config = self.config.get('telegram', {})
-        
-        if not force and not telegram_config.get('enabled'):
-            logger.warning("Telegram notifications disabled")
-            return
-        
-        try:
-            bot_token = telegram_config.get('bot_token')
-            chat_id = telegram_config.get('chat_id')
+        bot_token = telegram_config.get('bot_token')
+        chat_id = telegram_config.get('chat_id')
+        if not bot_token or not chat_id:
+            raise PermanentNotificationError("Bot de Telegram no configurado")
 
-            # Granular checks
-            if alert.condition == AlertCondition.NEW_DEVICE and not telegram_config.get('notify_new_device', True):
-                return
-            if alert.condition == AlertCondition.DEVICE_OFFLINE and not telegram_config.get('notify_device_offline', True):
-                return
-            if alert.condition == AlertCondition.DEVICE_ONLINE and not telegram_config.get('notify_device_online', False):
-                return
-            
-            # Emoji según nivel
-            emoji = {
-                AlertLevel.CRITICAL: "🔴",
-                AlertLevel.WARNING: "🟠",
-                AlertLevel.INFO: "🔵",
-                AlertLevel.DEBUG: "⚪"
-            }
-            
-            message = f"{emoji.get(alert.level, '⚪')} *{alert.level.value.upper()}*\n\n"
-            message += f"{alert.message}\n\n"
+        # Emoji según nivel
+        emoji = {
+            AlertLevel.CRITICAL: "🔴",
+            AlertLevel.WARNING: "🟠",
+            AlertLevel.INFO: "🔵",
+            AlertLevel.DEBUG: "⚪"
+        }
+        
+        message = f"{emoji.get(alert.level, '⚪')} *{alert.level.value.upper()}*\n\n"
+        message += f"{alert.message}\n\n"
+        if isinstance(alert, AlertDigest):
+            message += "\n".join(alert.lines()) + "\n\n"
+        else:
             message += f"📱 Dispositivo: {alert.device_name or 'N/A'}\n"
             message += f"🌐 IP: {alert.device_ip or 'N/A'}\n"
-            message += f"🕐 {alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
-            
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': message
-            }
-            
-            response = requests.post(url, json=data, timeout=10)
-            response.raise_for_status()
-            
-            logger.info(f"Telegram alert sent: {alert.message}")
-        except Exception as e:
-            logger.error(f"Failed to send Telegram message: {e}")
+        message += f"🕐 {alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+        
+        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        data = {
+            'chat_id': chat_id,
+            'text': message
+        }
+        
+        self.dispatcher.pool.post(url, json=data)
+        logger.info(f"Telegram alert sent: {alert.message}")
 
     def _send_webhook(self, alert: Alert):
-        """Envía alerta por webhook"""
+        """Envía alerta por webhook (desde el hilo del dispatcher; lanza excepción si falla)"""
         webhook_config = self.config.get('webhook', {})
+        url = webhook_config.get('url')
+        if not url:
+            raise PermanentNotificationError("URL de webhook no configurada")
+        headers = webhook_config.get('headers', {})
         
-        if not webhook_config.get('enabled'):
-            logger.warning("Webhook notifications disabled")
-            return
+        payload = {
+            'alert': alert.to_dict(),
+            'timestamp': datetime.utcnow().isoformat()
+        }
         
-        try:
-            url = webhook_config.get('url')
-            headers = webhook_config.get('headers', {})
-            
-            payload = {
-                'alert': alert.to_dict(),
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            logger.info(f"Webhook alert sent: {alert.message}")
-        except Exception as e:
-            logger.error(f"Failed to send webhook: {e}")
+        self.dispatcher.pool.post(url, json=payload, headers=headers)
+        logger.info(f"Webhook alert sent: {alert.message}")
 
     def process_device_event(self, event_type: str, device: Dict, value: Optional[float] = None):
         """Procesa un evento de dispositivo y genera alertas si corresponde"""
         
         # Mapear evento a condición
-        condition_map = {
-            'offline': AlertCondition.DEVICE_OFFLINE,
-            'online': AlertCondition.DEVICE_ONLINE,
-            'new': AlertCondition.NEW_DEVICE,
-            'high_latency': AlertCondition.HIGH_LATENCY,
-            'high_packet_loss': AlertCondition.HIGH_PACKET_LOSS,
-            'unauthorized': AlertCondition.UNAUTHORIZED_DEVICE
-        }
-        
-        condition = condition_map.get(event_type)
+        condition = EVENT_CONDITIONS.get(event_type)
         if not condition:
             return
+
+        # Correlación: no notificar lo que se explica por un equipo aguas arriba caído
+        suppressed_by = self.upstream_down(device) if condition in CORRELATED_CONDITIONS else None
+        if condition == AlertCondition.DEVICE_OFFLINE:
+            self.down_devices.add(device.get('id'))
+        elif condition == AlertCondition.DEVICE_ONLINE:
+            self.down_devices.discard(device.get('id'))
+        device_id = device.get('id')
+        if condition in CLEARING_CONDITIONS:
+            self.lifecycle.resolve(device_id, CLEARING_CONDITIONS[condition])
+        if suppressed_by is not None:
+            ALERTS_SUPPRESSED.labels(condition.value).inc()
+            logger.debug(f"Alerta {condition.value} de {device.get('ip')} suprimida: equipo {suppressed_by} caído")
+            return
         
-        # Buscar reglas aplicables
-        for rule in self.rules:
-            if rule.condition != condition:
+        # Buscar reglas aplicables (índice por condición y dispositivo)
+        observed = {}
+        for rule in self.rules_for(condition, device_id):
+            rule_value = self._rule_value(rule, device_id, value, observed)
+
+            # Verificar condición (si deja de cumplirse, se resuelve lo abierto)
+            if not self.check_condition(condition, device, rule_value, rule):
+                if condition in DEFAULT_THRESHOLDS:
+                    self.lifecycle.resolve(device_id, (condition,), rule_id=rule.id)
                 continue
-            
-            # Verificar si aplica al dispositivo
-            if rule.device_id and rule.device_id != device.get('id'):
+
+            # Ya abierta: no se repite mientras siga activa
+            if condition in RESOLVABLE_CONDITIONS and self._is_open(rule, device_id):
                 continue
-            
-            # Verificar throttling
-            if not rule.can_trigger():
+
+            # Verificar throttling (por dispositivo)
+            if not self.can_trigger(rule, device_id):
                 continue
             
-            # Verificar condición
-            if not self.check_condition(condition, device, value):
+            self._trigger(rule, device, rule_value if condition in DEFAULT_THRESHOLDS else None)
+
+    def process_metric(self, device: Dict, metrics: Dict[str, float]) -> List[Alert]:
+        """
+        Evalúa en streaming las reglas de métricas con las muestras recién
+        recogidas (lo llama MetricsCollector antes de guardarlas). Las
+        agregaciones salen de ventanas incrementales en memoria, sin consultar
+        metrics_history. Devuelve las alertas disparadas (sin id) y las que
+        se acaban de resolver (con id y resolved_at) para persistirlas.
+        """
+        self._prune_windows()
+
+        device_id = device.get('id')
+        fired = []
+        observed = {}
+        for metric_name, value in metrics.items():
+            if value is None:
                 continue
-            
-            # Crear y enviar alerta
-            alert = self.create_alert(rule, device)
-            self.send_notification(alert, rule.channels)
-            
-            # Actualizar última vez disparada
-            rule.last_triggered = datetime.utcnow()
-            
-            logger.info(f"Alert triggered: {rule.name} for device {device.get('ip')}")
+            for rule in self.metric_rules_for(metric_name, device_id):
+                rule_value = self._rule_value(rule, device_id, value, observed)
+                if not rule.matches(rule_value):
+                    fired.extend(self.lifecycle.resolve(device_id, (rule.condition,), rule_id=rule.id))
+                    continue
+                if self._is_open(rule, device_id):
+                    continue
+                if rule.condition in CORRELATED_CONDITIONS:
+                    suppressed_by = self.upstream_down(device)
+                    if suppressed_by is not None:
+                        ALERTS_SUPPRESSED.labels(rule.condition.value).inc()
+                        continue
+                if not self.can_trigger(rule, device_id):
+                    continue
+                fired.append(self._trigger(rule, device, rule_value))
+        return fired
+
+    def _throttle_key(self, rule: AlertRule, device_id: Optional[int]) -> str:
+        parts = (rule.id if rule.id is not None else rule.name, device_id, rule.condition.value)
+        key = self._fingerprints.get(parts)
+        if key is None:
+            key = self._fingerprints[parts] = fingerprint(*parts)
+        return key
+
+    def _is_open(self, rule: AlertRule, device_id: Optional[int]) -> bool:
+        """Hay una alerta abierta de esta regla para el dispositivo"""
+        return any(
+            alert.alert_metadata.get('rule_id') == rule.id
+            for alert in self.lifecycle.open.get((device_id, rule.condition), ())
+        )
+
+    def can_trigger(self, rule: AlertRule, device_id: Optional[int]) -> bool:
+        """Verifica si la regla puede dispararse para el dispositivo (throttling)"""
+        if not rule.enabled:
+            return False
+        return self.throttle.allow(self._throttle_key(rule, device_id), rule.throttle_minutes)
+
+    def _rule_value(self, rule: AlertRule, device_id: Optional[int], value: Optional[float], observed: Dict):
+        """
+        Valor a comparar con el umbral: la muestra, o el agregado de la
+        ventana de la regla (p.ej. p95 de 5 minutos). Las reglas con la misma
+        métrica y ventana comparten serie y la muestra se añade una sola vez.
+        """
+        if not (rule.aggregation and rule.time_window) or value is None:
+            return value
+        key = (device_id, rule.metric_name or rule.condition.value, rule.time_window)
+        window = observed.get(key)
+        if window is None:
+            window = observed[key] = self.windows.observe(
+                key, value, rule.time_window * 60, quantiles=percentile_of(rule.aggregation) is not None
+            )
+        return window.aggregate(rule.aggregation)
+
+    def _prune_windows(self):
+        now = time.monotonic()
+        if now - self._windows_pruned_at >= WINDOW_PRUNE_SECONDS:
+            self._windows_pruned_at = now
+            self.windows.prune(now)
+
+    def _trigger(self, rule: AlertRule, device: Dict, value: Optional[float] = None) -> Alert:
+        """Crea la alerta de una regla, la envía y actualiza el throttling"""
+        custom_message = None
+        if value is not None:
+            detail = f"{rule.aggregation} {rule.time_window} min = " if rule.aggregation else ""
+            custom_message = f"{self._generate_message(rule, device)} ({detail}{value:.1f})"
+
+        # Crear y enviar alerta
+        alert = self.create_alert(rule, device, custom_message)
+        if value is not None:
+            alert.alert_metadata['metric_name'] = rule.metric_name
+            alert.alert_metadata['value'] = value
+        # Actualizar última vez disparada (persistente, por dispositivo)
+        now = datetime.utcnow()
+        duplicates = self.throttle.record(
+            self._throttle_key(rule, device.get('id')), rule.id, device.get('id'), rule.condition.value, now
+        )
+        if duplicates:
+            alert.alert_metadata['duplicates'] = duplicates
+        rule.last_triggered = now
+
+        self.lifecycle.track(alert, rule, resolvable=rule.condition in RESOLVABLE_CONDITIONS)
+        self.send_notification(alert, rule.channels)
+        
+        logger.info(f"Alert triggered: {rule.name} for device {device.get('ip')}")
+        return alert
+
+    def _escalate(self, alert: Alert, rule: AlertRule):
+        """
+        Vence el plazo de escalate_after_minutes sin reconocer ni resolver:
+        se reenvía como crítica y también por los canales externos activos.
+        """
+        minutes = rule.escalate_after_minutes
+        escalated = Alert(
+            level=AlertLevel.CRITICAL,
+            condition=alert.condition,
+            message=f"⏫ Sin atender desde hace {minutes} min: {alert.message}",
+            device_id=alert.device_id,
+            device_name=alert.device_name,
+            device_ip=alert.device_ip,
+            alert_metadata={**alert.alert_metadata, 'escalated_from': alert.id}
+        )
+        channels = list(rule.channels)
+        for channel in ESCALATION_CHANNELS:
+            if channel not in channels and self.config.get(channel.value, {}).get('enabled'):
+                channels.append(channel)
+        logger.warning(f"Alerta escalada tras {minutes} min: {alert.message}")
+        # Se resuelve junto con la original
+        self.lifecycle.track(escalated, resolvable=alert.condition in RESOLVABLE_CONDITIONS)
+        self.send_notification(escalated, channels)
+
+    def acknowledge_open(self, device_id: Optional[int], condition: str, user: str = "system") -> int:
+        """Reconoce las alertas abiertas de (dispositivo, condición), p.ej. al reconocer su fila en BD"""
+        try:
+            condition = AlertCondition((condition or '').lower())
+        except ValueError:
+            return 0
+        return self.lifecycle.acknowledge(device_id, condition, user)
 
     def get_active_alerts(self, level: Optional[AlertLevel] = None) -> List[Dict]:
-        """Obtiene alertas activas (no reconocidas)"""
-        alerts = [a for a in self.active_alerts if not a.acknowledged]
+        """Obtiene alertas activas (no reconocidas ni resueltas)"""
+        alerts = [a for a in self.active_alerts if not a.acknowledged and a.resolved_at is None]
         
         if level:
             alerts = [a for a in alerts if a.level == level]
@@ -445,17 +1075,16 @@ class AlertManager:
         """Marca una alerta como reconocida"""
         for alert in self.active_alerts:
             if alert.id == alert_id:
-                alert.acknowledged = True
-                alert.acknowledged_at = datetime.utcnow()
-                alert.acknowledged_by = user
+                alert.acknowledge(user)
                 logger.info(f"Alert {alert_id} acknowledged by {user}")
                 return True
         return False
 
     def clear_old_alerts(self, days: int = 7):
-        """Limpia alertas antiguas reconocidas"""
+        """Limpia alertas antiguas reconocidas o resueltas"""
         cutoff = datetime.utcnow() - timedelta(days=days)
         self.active_alerts = [
             a for a in self.active_alerts
-            if not a.acknowledged or a.acknowledged_at > cutoff
+            if (not a.acknowledged or a.acknowledged_at > cutoff)
+            and (a.resolved_at is None or a.resolved_at > cutoff)
         ]
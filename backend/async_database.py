@@ -0,0 +1,63 @@
+"""
+Capa de base de datos asíncrona para los endpoints de FastAPI.
+
+Los handlers `async def` usan AsyncSessionLocal (aiosqlite / asyncpg) y no
+ocupan un hilo del threadpool mientras esperan a la base de datos, así que
+la latencia se mantiene aunque aumenten los clientes concurrentes del
+dashboard. Los workers en hilos (escáner, colector) siguen usando
+SessionLocal de database.py.
+
+Estos endpoints solo leen: en SQLite el engine abre el fichero en modo
+solo lectura (mode=ro) y no compite con la conexión de escritura.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from database import (
+    SQLALCHEMY_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, SQLITE_PROFILE,
+    is_sqlite, read_only_url, sqlite_pragma_listener
+)
+
+# Driver asíncrono para cada dialecto
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+
+def to_async_url(url=SQLALCHEMY_DATABASE_URL):
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db, postgresql+psycopg2://... -> postgresql+asyncpg://..."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No hay driver asíncrono para {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def build_async_engine(url=SQLALCHEMY_DATABASE_URL, profile=SQLITE_PROFILE):
+    """Engine asíncrono con las mismas opciones que el síncrono (lectura en SQLite)"""
+    if is_sqlite(url):
+        ro_url = read_only_url(url)
+        new_engine = create_async_engine(to_async_url(ro_url or url))
+        event.listen(new_engine.sync_engine, "connect", sqlite_pragma_listener(profile, read_only=ro_url is not None))
+        return new_engine
+
+    async_url = to_async_url(url)
+    return create_async_engine(
+        async_url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True
+    )
+
+
+async_engine = build_async_engine()
+
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+
+# DB Dependency (async)
+async def get_async_db():
+    async with AsyncSessionLocal() as session:
+        yield session
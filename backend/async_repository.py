@@ -0,0 +1,121 @@
+"""
+Consultas asíncronas de los endpoints más usados del dashboard
+(/devices, /status, /alerts, /metrics/*).
+
+Las consultas de métricas reutilizan las sentencias de metrics_query y se
+ejecutan de forma asíncrona; el trabajo en Python sobre las filas (LTTB,
+formateo de cubos, paso a columnas) va al threadpool, porque con rangos
+largos son cientos de miles de filas y bloquearía el loop.
+"""
+import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database import Device, Alert, MetricHistory
+from metrics_query import (
+    build_raw_query, build_bucket_query, build_last_values_query, build_batch_query,
+    chunked, format_buckets, downsample_rows, to_columnar, _IN_CHUNK
+)
+
+
+def _dialect_name(session: AsyncSession) -> str:
+    return session.get_bind().dialect.name
+
+
+async def list_devices(session: AsyncSession) -> List[Device]:
+    result = await session.execute(select(Device))
+    return list(result.scalars().all())
+
+
+async def status_counts(session: AsyncSession) -> Dict[str, int]:
+    """Totales del dashboard en una sola consulta"""
+    today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0)
+    row = (await session.execute(select(
+        func.count(Device.id),
+        func.sum(case((Device.status == "Online", 1), else_=0)),
+        func.sum(case((Device.first_seen >= today, 1), else_=0))
+    ))).one()
+    return {
+        "total": row[0] or 0,
+        "online": row[1] or 0,
+        "new_today": row[2] or 0
+    }
+
+
+async def recent_alerts(session: AsyncSession, limit: int = 50) -> List[Alert]:
+    result = await session.execute(select(Alert).order_by(Alert.timestamp.desc()).limit(limit))
+    return list(result.scalars().all())
+
+
+async def raw_device_metrics(
+    session: AsyncSession,
+    device_id: int,
+    since: datetime.datetime,
+    metric_name: Optional[str] = None
+) -> List[Dict]:
+    result = await session.execute(build_raw_query(device_id, since, metric_name))
+    return [
+        {
+            "timestamp": r.timestamp.isoformat(),
+            "metric_name": r.metric_name,
+            "value": r.value,
+            "unit": r.unit
+        } for r in result
+    ]
+
+
+async def bucketed_device_metrics(session: AsyncSession, device_id: int, since, step: int, metric_name=None) -> List[Dict]:
+    """Igual que metrics_query.bucketed_metrics"""
+    query = build_bucket_query(device_id, since, step, _dialect_name(session), metric_name)
+    rows = (await session.execute(query)).all()
+
+    last_values = {}
+    for ids in chunked([r.last_id for r in rows]):
+        last_values.update((await session.execute(build_last_values_query(ids))).all())
+
+    return await run_in_threadpool(format_buckets, rows, last_values)
+
+
+async def lttb_device_metrics(session: AsyncSession, device_id: int, since, points: int, metric_name=None) -> List[Dict]:
+    """Igual que metrics_query.lttb_metrics"""
+    rows = (await session.execute(build_raw_query(device_id, since, metric_name))).all()
+    return await run_in_threadpool(downsample_rows, rows, points)
+
+
+async def metrics_summary(session: AsyncSession, device_id: int, since: datetime.datetime):
+    result = await session.execute(select(
+        MetricHistory.metric_name,
+        func.avg(MetricHistory.value).label('avg_value'),
+        func.min(MetricHistory.value).label('min_value'),
+        func.max(MetricHistory.value).label('max_value'),
+        func.count(MetricHistory.id).label('count')
+    ).where(
+        MetricHistory.device_id == device_id,
+        MetricHistory.timestamp >= since
+    ).group_by(MetricHistory.metric_name))
+    return result.all()
+
+
+async def group_device_ids(session: AsyncSession, group_id: int) -> List[int]:
+    result = await session.execute(select(Device.id).where(Device.group_id == group_id))
+    return list(result.scalars().all())
+
+
+async def batch_device_metrics(session: AsyncSession, device_ids, metric_name, since, step, agg="avg") -> Dict:
+    """Igual que metrics_query.batch_metrics"""
+    if not device_ids:
+        return {"timestamps": [], "series": {}}
+
+    dialect_name = _dialect_name(session)
+    rows = []
+    for ids in chunked(list(device_ids)):
+        query = build_batch_query(ids, metric_name, since, step, dialect_name, agg)
+        rows.extend((await session.execute(query)).all())
+
+    if len(device_ids) > _IN_CHUNK:
+        rows.sort(key=lambda r: r[0])
+
+    return await run_in_threadpool(to_columnar, rows, device_ids)
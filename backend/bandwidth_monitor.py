@@ -0,0 +1,181 @@
+"""
+Muestreo de ancho de banda por interfaz de red.
+
+Una sola tarea asíncrona lee los contadores de todas las NIC
+(psutil.net_io_counters(pernic=True)) cada CRC_BANDWIDTH_SAMPLE_SECONDS y
+guarda la tasa de cada intervalo en una ventana acotada de
+CRC_BANDWIDTH_WINDOW_SECONDS. El sensor BANDWIDTH publica de esa ventana la
+media, el p95 y el máximo, de modo que un pico de pocos segundos sigue
+viéndose aunque la métrica se guarde una vez por minuto.
+
+La lectura cuesta decenas de microsegundos (en Linux es /proc/net/dev), así
+que se hace en el propio bucle de eventos, sin hilos. psutil ya corrige los
+contadores que dan la vuelta; si aun así uno retrocede (la interfaz se ha
+reiniciado) ese intervalo se descarta.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import psutil
+
+from metric_windows import RollingWindow
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SECONDS = float(os.getenv("CRC_BANDWIDTH_SAMPLE_SECONDS", "0.5"))
+WINDOW_SECONDS = float(os.getenv("CRC_BANDWIDTH_WINDOW_SECONDS", "60"))
+# Lista separada por comas; vacía = todas salvo las de loopback
+INTERFACES = [name.strip() for name in os.getenv("CRC_BANDWIDTH_INTERFACES", "").split(",") if name.strip()]
+
+TOTAL = "total"
+AGGREGATES = ("avg", "p95", "max")
+
+
+def is_loopback(name: str) -> bool:
+    """'lo' en Linux, 'lo0' en macOS, 'Loopback Pseudo-Interface 1' en Windows"""
+    return name.rstrip("0123456789") == "lo" or "loopback" in name.lower()
+
+
+class BandwidthMonitor:
+    """Tasas de subida y bajada (Mbps) por NIC y en total"""
+
+    def __init__(
+        self,
+        interval: float = SAMPLE_SECONDS,
+        window_seconds: float = WINDOW_SECONDS,
+        interfaces: Optional[Iterable[str]] = None
+    ):
+        self.interval = max(interval, 0.05)
+        self.window_seconds = window_seconds
+        self.interfaces = set(interfaces if interfaces is not None else INTERFACES)
+        # Tamaño del anillo: las muestras de una ventana, con algo de margen
+        self.max_samples = math.ceil(window_seconds / self.interval) + 2
+        self.windows: Dict[tuple, RollingWindow] = {}  # (nic, 'rx'|'tx') -> ventana
+        self._last: Dict[str, tuple] = {}              # nic -> (bytes_recv, bytes_sent)
+        self._last_ts: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _selected(self, name: str) -> bool:
+        if self.interfaces:
+            return name in self.interfaces
+        return not is_loopback(name)
+
+    def _window(self, nic: str, direction: str) -> RollingWindow:
+        window = self.windows.get((nic, direction))
+        if window is None:
+            window = self.windows[(nic, direction)] = RollingWindow(
+                self.window_seconds, quantiles=True, max_samples=self.max_samples
+            )
+        return window
+
+    def sample(self, counters: Dict[str, Any], ts: Optional[float] = None):
+        """Añade un intervalo a partir de los contadores {nic: snetio}"""
+        ts = time.monotonic() if ts is None else ts
+        elapsed = ts - self._last_ts if self._last_ts is not None else 0
+        current = {}
+        total_rx = total_tx = 0.0
+        complete = elapsed > 0
+        for nic, io in counters.items():
+            if not self._selected(nic):
+                continue
+            current[nic] = (io.bytes_recv, io.bytes_sent)
+            previous = self._last.get(nic)
+            if previous is None or elapsed <= 0:
+                continue
+            rx_bytes = io.bytes_recv - previous[0]
+            tx_bytes = io.bytes_sent - previous[1]
+            if rx_bytes < 0 or tx_bytes < 0:
+                # Contador reiniciado: ni la NIC ni el total valen en este intervalo
+                complete = False
+                continue
+            rx = rx_bytes * 8 / (elapsed * 1_000_000)
+            tx = tx_bytes * 8 / (elapsed * 1_000_000)
+            self._window(nic, "rx").add(rx, ts)
+            self._window(nic, "tx").add(tx, ts)
+            total_rx += rx
+            total_tx += tx
+        if complete and self._last:
+            self._window(TOTAL, "rx").add(total_rx, ts)
+            self._window(TOTAL, "tx").add(total_tx, ts)
+        # Las NIC que desaparecen se olvidan; sus ventanas se vacían solas
+        self._last = current
+        self._last_ts = ts
+
+    def stats(self, interface: Optional[str] = None, now: Optional[float] = None) -> Dict[str, float]:
+        """
+        bandwidth_download/_upload (media) más sus _p95 y _max en la ventana,
+        para una NIC o, sin interfaz, para la suma de todas. Vacío si aún no
+        hay muestras.
+        """
+        nic = interface or TOTAL
+        result = {}
+        for direction, metric in (("rx", "bandwidth_download"), ("tx", "bandwidth_upload")):
+            window = self.windows.get((nic, direction))
+            if window is None:
+                continue
+            window.evict(now)
+            for name in AGGREGATES:
+                value = window.aggregate(name)
+                if value is None:
+                    continue
+                result[metric if name == "avg" else f"{metric}_{name}"] = round(value, 3)
+        return result
+
+    def interface_names(self) -> List[str]:
+        """NIC presentes en la última lectura"""
+        return sorted(self._last)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Arranca el muestreo en el bucle actual (idempotente)"""
+        if self.running:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(
+            f"Muestreo de ancho de banda cada {self.interval}s (ventana de {self.window_seconds:g}s)"
+        )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            try:
+                self.sample(psutil.net_io_counters(pernic=True))
+            except Exception as e:
+                logger.error(f"Error leyendo contadores de red: {e}")
+            # Ritmo fijo: el tiempo de la lectura no se acumula como deriva
+            deadline += self.interval
+            delay = deadline - loop.time()
+            if delay < 0:
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_monitor: Optional[BandwidthMonitor] = None
+
+
+def get_monitor() -> BandwidthMonitor:
+    """Monitor del proceso; lo arranca la primera vez que se pide"""
+    global _monitor
+    if _monitor is None:
+        _monitor = BandwidthMonitor()
+    _monitor.start()
+    return _monitor
+
+
+def stop_monitor():
+    if _monitor is not None:
+        _monitor.stop()
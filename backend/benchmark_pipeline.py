@@ -0,0 +1,357 @@
+"""
+Benchmark del pipeline escaneo -> reconciliación -> alertas -> broadcast.
+
+Todo corre en el proceso, sin red: un escaneo ARP falso genera inventarios
+sintéticos (100 a 10k dispositivos), la BD es SQLite en memoria y los
+clientes WebSocket son falsos. Mide:
+  - reconciliación (InventoryReconciler, lo que ejecuta background_scanner)
+    en el primer escaneo, en régimen estable y con altas/bajas
+  - evaluación de eventos de AlertManager por segundo
+  - evaluación en streaming de reglas de métricas (umbral, media y p95)
+  - fan-out de ConnectionManager.broadcast a N clientes
+  - opcionalmente, latencia p50/p99 de la API de un servidor en marcha
+
+Cada ejecución se añade al histórico (JSON) y se compara con la mediana de
+las anteriores; si alguna métrica empeora más de --threshold el script
+termina con código 1.
+
+Uso:
+    python benchmark_pipeline.py
+    python benchmark_pipeline.py --sizes 100,1000 --clients 1,50
+    python benchmark_pipeline.py --api-url http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from inventory import InventoryReconciler
+from device_state import DeviceStateTracker
+from liveness import LivenessTable
+from alerts import AlertManager, AlertRule, AlertCondition, AlertLevel, AlertChannel
+from websocket_manager import ConnectionManager
+
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.json")
+# Ejecuciones anteriores con las que se compara
+HISTORY_WINDOW = 5
+# Tiempos por debajo de este valor (segundos) son ruido del temporizador
+NOISE_FLOOR = 0.0001
+API_ENDPOINTS = ["/status", "/devices", "/alerts", "/metrics/device/1?hours=24&points=300"]
+
+BENCH_ALERT_CONFIG = {
+    'email': {'enabled': False},
+    'telegram': {'enabled': False},
+    'webhook': {'enabled': False}
+}
+
+
+# ============================================
+# FUENTES FALSAS
+# ============================================
+
+def fake_arp_scan(count: int, offset: int = 0) -> List[Dict[str, str]]:
+    """Resultado de scan_network_arp para `count` dispositivos"""
+    devices = []
+    for i in range(offset, offset + count):
+        devices.append({
+            'ip': f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            'mac': f"02:00:00:{(i >> 16) & 255:02x}:{(i >> 8) & 255:02x}:{i & 255:02x}"
+        })
+    return devices
+
+
+def fake_resolve_hostname(ip: str) -> str:
+    return f"host-{ip.replace('.', '-')}"
+
+
+def fake_vendor(mac: str) -> str:
+    return random.choice(["Apple", "Samsung", "TP-Link", "Espressif", "Unknown Vendor"])
+
+
+class FakeWebSocket:
+    """Cliente WebSocket que serializa los mensajes como lo haría Starlette"""
+
+    def __init__(self):
+        self.received = 0
+
+    async def send_json(self, message: dict):
+        json.dumps(message, separators=(",", ":"))
+        self.received += 1
+
+
+def memory_session_factory():
+    """SQLite en memoria compartida entre sesiones del mismo hilo"""
+    bind = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=bind)
+    return sessionmaker(autocommit=False, autoflush=False, bind=bind)
+
+
+def _silence_logs():
+    # El coste de crear los registros se mide, pero no se escriben
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+
+
+# ============================================
+# MEDICIONES
+# ============================================
+
+def _timed(func: Callable) -> float:
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+
+def bench_reconcile(size: int, repeat: int, clients: int) -> Dict[str, float]:
+    """Reconciliación de un inventario de `size` dispositivos"""
+    session_factory = memory_session_factory()
+    ws_manager = ConnectionManager()
+    ws_manager.active_connections = [FakeWebSocket() for _ in range(clients)]
+    reconciler = InventoryReconciler(
+        resolve_hostname=fake_resolve_hostname,
+        get_vendor=fake_vendor,
+        alert_manager=AlertManager(None, BENCH_ALERT_CONFIG),
+        ws_manager=ws_manager,
+        # Sin histéresis: el escaneo con bajas las marca Offline en la misma pasada
+        states=DeviceStateTracker(offline_misses=1),
+        liveness=LivenessTable(class_timeouts={})
+    )
+    reconciler.alert_manager.load_rules()
+    scan = fake_arp_scan(size)
+    results = {}
+
+    db = session_factory()
+    try:
+        results[f"reconcile_initial_{size}_s"] = _timed(lambda: reconciler.reconcile(db, scan))
+
+        steady = [_timed(lambda: reconciler.reconcile(db, scan)) for _ in range(repeat)]
+        results[f"reconcile_steady_{size}_s"] = statistics.median(steady)
+
+        # 10% desaparece (sin señal desde hace 10 minutos) y entra un 5% nuevo
+        gone = max(size // 10, 1)
+        later = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
+        churn_scan = scan[gone:] + fake_arp_scan(max(size // 20, 1), offset=size)
+        results[f"reconcile_churn_{size}_s"] = _timed(lambda: reconciler.reconcile(db, churn_scan, now=later))
+    finally:
+        db.close()
+    return results
+
+
+def bench_alerts(events: int) -> Dict[str, float]:
+    """Eventos por segundo que procesa AlertManager.process_device_event"""
+    manager = AlertManager(None, BENCH_ALERT_CONFIG)
+    manager.load_rules()
+    event_types = ['offline', 'online', 'new', 'high_latency', 'unauthorized']
+    devices = [
+        {'id': i, 'ip': f"10.0.{i >> 8}.{i & 255}", 'hostname': f"host-{i}", 'alias': None,
+         'status': random.choice(['Online', 'Offline']), 'is_authorized': i % 10 != 0}
+        for i in range(1000)
+    ]
+
+    t0 = time.perf_counter()
+    for i in range(events):
+        manager.process_device_event(event_types[i % len(event_types)], devices[i % len(devices)], value=random.uniform(0, 200))
+    elapsed = time.perf_counter() - t0
+    return {"alert_events_per_s": events / elapsed}
+
+
+def bench_metrics(samples: int, devices: int = 1000) -> Dict[str, float]:
+    """Lotes de métricas por segundo que evalúa AlertManager.process_metric"""
+    manager = AlertManager(None, BENCH_ALERT_CONFIG)
+    manager.load_rules()
+    manager._set_rules(manager.rules + [
+        AlertRule("Latencia media", AlertCondition.HIGH_LATENCY, AlertLevel.WARNING, [AlertChannel.IN_APP],
+                  threshold=150.0, aggregation="avg", time_window=5),
+        AlertRule("Latencia p95", AlertCondition.HIGH_LATENCY, AlertLevel.WARNING, [AlertChannel.IN_APP],
+                  threshold=180.0, aggregation="p95", time_window=15),
+        AlertRule("Pérdida", AlertCondition.HIGH_PACKET_LOSS, AlertLevel.WARNING, [AlertChannel.IN_APP],
+                  threshold=20.0, aggregation="max", time_window=5)
+    ])
+    device_list = [{'id': i, 'ip': f"10.0.{i >> 8}.{i & 255}", 'hostname': f"host-{i}", 'status': 'Online'} for i in range(devices)]
+
+    t0 = time.perf_counter()
+    for i in range(samples):
+        manager.process_metric(device_list[i % devices], {
+            "ping_latency": random.uniform(1, 200),
+            "ping_packet_loss": random.choice([0, 0, 0, 25])
+        })
+    elapsed = time.perf_counter() - t0
+    return {"metric_batches_per_s": samples / elapsed}
+
+
+def bench_broadcast(clients: int, messages: int) -> Dict[str, float]:
+    """Latencia de un broadcast a `clients` clientes"""
+    manager = ConnectionManager()
+    manager.active_connections = [FakeWebSocket() for _ in range(clients)]
+    payload = {"id": 1, "mac": "02:00:00:00:00:01", "ip": "10.0.0.1", "hostname": "host", "status": "Online", "vendor": "Apple"}
+
+    async def run():
+        latencies = []
+        for _ in range(messages):
+            t0 = time.perf_counter()
+            await manager.broadcast_device_update(payload)
+            latencies.append(time.perf_counter() - t0)
+        return latencies
+
+    latencies = asyncio.run(run())
+    return {
+        f"broadcast_{clients}_p50_ms": _percentile(latencies, 0.50) * 1000,
+        f"broadcast_{clients}_p99_ms": _percentile(latencies, 0.99) * 1000
+    }
+
+
+def bench_api(base_url: str, requests_per_endpoint: int) -> Dict[str, float]:
+    """p50/p99 de los endpoints más usados de un servidor en marcha"""
+    import requests
+
+    results = {}
+    with requests.Session() as session:
+        for endpoint in API_ENDPOINTS:
+            latencies = []
+            for _ in range(requests_per_endpoint):
+                t0 = time.perf_counter()
+                session.get(base_url.rstrip("/") + endpoint, timeout=30).raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            name = endpoint.split("?")[0].strip("/").replace("/", "_")
+            results[f"api_{name}_p50_ms"] = _percentile(latencies, 0.50) * 1000
+            results[f"api_{name}_p99_ms"] = _percentile(latencies, 0.99) * 1000
+    return results
+
+
+# ============================================
+# HISTÓRICO
+# ============================================
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def _seconds(metric: str, value: float) -> Optional[float]:
+    if metric.endswith("_ms"):
+        return value / 1000
+    if metric.endswith("_s") and not higher_is_better(metric):
+        return value
+    return None
+
+
+def load_history(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_regressions(results: Dict[str, float], history: List[Dict], threshold: float) -> List[str]:
+    """Métricas que empeoran más de `threshold` respecto a la mediana reciente"""
+    regressions = []
+    for metric, value in results.items():
+        previous = [run["results"][metric] for run in history[-HISTORY_WINDOW:] if metric in run.get("results", {})]
+        if not previous:
+            continue
+        baseline = statistics.median(previous)
+        if baseline <= 0:
+            continue
+        seconds = _seconds(metric, max(value, baseline))
+        if seconds is not None and seconds < NOISE_FLOOR:
+            continue
+        if higher_is_better(metric):
+            change = (baseline - value) / baseline
+        else:
+            change = (value - baseline) / baseline
+        if change > threshold:
+            regressions.append(f"{metric}: {value:.4g} vs {baseline:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de escaneo")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Tamaños de inventario")
+    parser.add_argument("--clients", default="1,10,100", help="Clientes WebSocket para el fan-out")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones del escaneo estable")
+    parser.add_argument("--events", type=int, default=100000, help="Eventos para AlertManager")
+    parser.add_argument("--samples", type=int, default=100000, help="Lotes de métricas para process_metric")
+    parser.add_argument("--messages", type=int, default=2000, help="Broadcasts por número de clientes")
+    parser.add_argument("--api-url", help="Servidor en marcha para medir la API")
+    parser.add_argument("--api-requests", type=int, default=200, help="Peticiones por endpoint")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="Fichero JSON del histórico")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Empeoramiento tolerado (0.5 = 50%%)")
+    parser.add_argument("--no-save", action="store_true", help="No añadir esta ejecución al histórico")
+    args = parser.parse_args(argv)
+
+    _silence_logs()
+    random.seed(42)
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    clients = [int(c) for c in args.clients.split(",") if c]
+
+    results: Dict[str, float] = {}
+    for size in sizes:
+        print(f"Reconciliación con {size} dispositivos...")
+        results.update(bench_reconcile(size, args.repeat, clients[0] if clients else 0))
+    print("AlertManager...")
+    results.update(bench_alerts(args.events))
+    print("Reglas de métricas...")
+    results.update(bench_metrics(args.samples))
+    for count in clients:
+        print(f"Broadcast a {count} clientes...")
+        results.update(bench_broadcast(count, args.messages))
+    if args.api_url:
+        print(f"API en {args.api_url}...")
+        results.update(bench_api(args.api_url, args.api_requests))
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, args.threshold)
+
+    print()
+    for metric, value in results.items():
+        print(f"  {metric:<36} {value:>12.4f}")
+
+    if not args.no_save:
+        history.append({
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "revision": _git_revision(),
+            "results": results
+        })
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump(history, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regresión(es) respecto a las últimas {HISTORY_WINDOW} ejecuciones:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nSin regresiones.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
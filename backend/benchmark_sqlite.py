@@ -0,0 +1,306 @@
+"""
+Benchmark de SQLite: rendimiento de lectura y escritura sobre metrics_history.
+
+Genera una sola vez una BD sintética (10M filas por defecto) y mide cada
+configuración con tres cargas: solo lectura, solo escritura y mixta.
+  - legacy: configuración anterior, un único pool compartido por lectores
+    y escritores y solo WAL + synchronous=NORMAL
+  - resto de perfiles (CRC_SQLITE_PROFILE): conexión de escritura dedicada
+    + pool de conexiones de solo lectura
+
+Uso:
+    python benchmark_sqlite.py
+    python benchmark_sqlite.py --rows 1000000 --profiles legacy,balanced,performance
+    python benchmark_sqlite.py --db /tmp/bench.db --rebuild --json resultados.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import create_engine, event, func, insert, select, text
+
+from database import (
+    Base, MetricHistory, SQLITE_PROFILES, SQLITE_READERS,
+    build_engine, build_read_engine, sqlite_pragma_listener
+)
+from metrics_query import build_bucket_query, build_raw_query
+
+METRIC_NAMES = ["ping_latency", "packet_loss", "response_time"]
+SAMPLE_INTERVAL = 60  # segundos entre muestras de cada serie
+LOAD_BATCH = 100000
+
+
+# ============================================
+# DATOS SINTÉTICOS
+# ============================================
+
+def _timestamp(value: datetime.datetime) -> str:
+    # Mismo formato que usa SQLAlchemy para DateTime en SQLite
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def build_dataset(path: str, rows: int, devices: int):
+    """Crea la BD con `rows` filas repartidas entre devices x métricas"""
+    if os.path.exists(path):
+        os.remove(path)
+
+    bind = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=bind)
+    indexes = list(MetricHistory.__table__.indexes)
+    with bind.begin() as conn:
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        conn.execute(text("INSERT INTO devices (id, mac, ip, status) VALUES " + ", ".join(
+            f"({i}, '02:00:00:00:{i // 256:02x}:{i % 256:02x}', '10.0.{i // 256}.{i % 256}', 'Online')"
+            for i in range(1, devices + 1)
+        )))
+
+    series = devices * len(METRIC_NAMES)
+    samples = max(rows // series, 1)
+    now = datetime.datetime.utcnow()
+    start = now - datetime.timedelta(seconds=samples * SAMPLE_INTERVAL)
+
+    def generate():
+        produced = 0
+        for n in range(samples):
+            ts = _timestamp(start + datetime.timedelta(seconds=n * SAMPLE_INTERVAL))
+            for device_id in range(1, devices + 1):
+                for metric in METRIC_NAMES:
+                    if produced >= rows:
+                        return
+                    yield (device_id, None, metric, random.uniform(1, 100), "ms", ts)
+                    produced += 1
+
+    # Carga directa con sqlite3: sin índices ni journal, los índices se crean al final
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    rows_iter = generate()
+    loaded = 0
+    while True:
+        batch = [row for _, row in zip(range(LOAD_BATCH), rows_iter)]
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT INTO metrics_history (device_id, sensor_id, metric_name, value, unit, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?)", batch
+        )
+        conn.commit()
+        loaded += len(batch)
+        if loaded % 1000000 < LOAD_BATCH:
+            print(f"  {loaded:,} filas")
+    conn.close()
+
+    print("  creando índices...")
+    with bind.begin() as conn:
+        for index in indexes:
+            index.create(bind=conn)
+        conn.execute(text("ANALYZE"))
+    bind.dispose()
+
+
+def dataset_rows(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT max(id) FROM metrics_history").fetchone()[0] or 0
+    except sqlite3.Error:
+        return 0
+    finally:
+        conn.close()
+
+
+# ============================================
+# CARGAS
+# ============================================
+
+def _read_once(conn, devices: int, now: datetime.datetime):
+    """Una consulta de dashboard al azar"""
+    device_id = random.randint(1, devices)
+    kind = random.random()
+    if kind < 0.5:
+        stmt = build_bucket_query(device_id, now - datetime.timedelta(hours=24), 300, "sqlite", "ping_latency")
+    elif kind < 0.8:
+        stmt = build_raw_query(device_id, now - datetime.timedelta(hours=1), "ping_latency")
+    else:
+        stmt = select(
+            MetricHistory.metric_name, func.avg(MetricHistory.value), func.count(MetricHistory.id)
+        ).where(
+            MetricHistory.device_id == device_id,
+            MetricHistory.timestamp >= now - datetime.timedelta(hours=24)
+        ).group_by(MetricHistory.metric_name)
+    conn.execute(stmt).all()
+
+
+def _write_once(conn, devices: int):
+    """Un ciclo del colector: las métricas de un dispositivo en una transacción"""
+    device_id = random.randint(1, devices)
+    now = datetime.datetime.utcnow()
+    conn.execute(insert(MetricHistory.__table__), [
+        {"device_id": device_id, "metric_name": metric, "value": random.uniform(1, 100), "unit": "ms", "timestamp": now}
+        for metric in METRIC_NAMES
+    ])
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)]
+
+
+def run_load(read_bind, write_bind, readers: int, writers: int, duration: float, devices: int) -> Dict:
+    """Lanza lectores y escritores durante `duration` segundos"""
+    stop = threading.Event()
+    read_latencies: List[List[float]] = [[] for _ in range(readers)]
+    write_latencies: List[List[float]] = [[] for _ in range(writers)]
+    errors: List[str] = []
+    now = datetime.datetime.utcnow()
+
+    def reader(slot):
+        try:
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                with read_bind.connect() as conn:
+                    _read_once(conn, devices, now)
+                read_latencies[slot].append(time.perf_counter() - t0)
+        except Exception as e:
+            errors.append(f"lector: {e}")
+
+    def writer(slot):
+        try:
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                with write_bind.begin() as conn:
+                    _write_once(conn, devices)
+                write_latencies[slot].append(time.perf_counter() - t0)
+        except Exception as e:
+            errors.append(f"escritor: {e}")
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = [v for slot in read_latencies for v in slot]
+    writes = [v for slot in write_latencies for v in slot]
+    return {
+        "reads_per_s": round(len(reads) / duration, 1),
+        "read_p50_ms": round(_percentile(reads, 0.50) * 1000, 2),
+        "read_p99_ms": round(_percentile(reads, 0.99) * 1000, 2),
+        "writes_per_s": round(len(writes) / duration, 1),
+        "rows_written_per_s": round(len(writes) * len(METRIC_NAMES) / duration, 1),
+        "write_p50_ms": round(_percentile(writes, 0.50) * 1000, 2),
+        "write_p99_ms": round(_percentile(writes, 0.99) * 1000, 2),
+        "errors": errors[:5]
+    }
+
+
+def engines_for(url: str, profile: str):
+    """(lectura, escritura) para una configuración"""
+    if profile == "legacy":
+        shared = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(shared, "connect", sqlite_pragma_listener("legacy"))
+        return shared, shared
+    write_bind = build_engine(url, profile)
+    return build_read_engine(url, profile, write_engine=write_bind), write_bind
+
+
+def benchmark_profile(path: str, profile: str, args) -> Dict:
+    url = f"sqlite:///{path}"
+    read_bind, write_bind = engines_for(url, profile)
+    baseline_id = dataset_rows(path)
+    results = {}
+    try:
+        # Calentar caché de páginas / mmap
+        run_load(read_bind, write_bind, args.readers, 0, 1, args.devices)
+        results["read"] = run_load(read_bind, write_bind, args.readers, 0, args.duration, args.devices)
+        results["write"] = run_load(read_bind, write_bind, 0, args.writers, args.duration, args.devices)
+        results["mixed"] = run_load(read_bind, write_bind, args.readers, args.writers, args.duration, args.devices)
+    finally:
+        read_bind.dispose()
+        write_bind.dispose()
+
+    # Dejar la BD como estaba para la siguiente configuración
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM metrics_history WHERE id > ?", (baseline_id,))
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return results
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de lectura/escritura de SQLite")
+    parser.add_argument("--db", default="benchmark_metrics.db", help="Fichero de la BD sintética")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Filas de metrics_history")
+    parser.add_argument("--devices", type=int, default=50, help="Dispositivos sintéticos")
+    parser.add_argument("--profiles", default="legacy,balanced", help="Perfiles separados por comas")
+    parser.add_argument("--readers", type=int, default=SQLITE_READERS, help="Hilos lectores")
+    parser.add_argument("--writers", type=int, default=2, help="Hilos escritores")
+    parser.add_argument("--duration", type=float, default=10, help="Segundos por carga")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerar la BD aunque exista")
+    parser.add_argument("--json", help="Guardar los resultados en este fichero")
+    args = parser.parse_args(argv)
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in SQLITE_PROFILES]
+    if unknown:
+        parser.error(f"Perfiles desconocidos: {', '.join(unknown)}")
+
+    if args.rebuild or dataset_rows(args.db) < args.rows:
+        print(f"Generando {args.rows:,} filas en {args.db}...")
+        t0 = time.perf_counter()
+        build_dataset(args.db, args.rows, args.devices)
+        print(f"  listo en {time.perf_counter() - t0:.0f}s")
+
+    results = {}
+    for profile in profiles:
+        print(f"\n== {profile} ==")
+        results[profile] = benchmark_profile(args.db, profile, args)
+        for load, stats in results[profile].items():
+            print(
+                f"  {load:<6} lecturas {stats['reads_per_s']:>8}/s "
+                f"(p50 {stats['read_p50_ms']}ms, p99 {stats['read_p99_ms']}ms)  "
+                f"escrituras {stats['rows_written_per_s']:>8} filas/s "
+                f"(p50 {stats['write_p50_ms']}ms, p99 {stats['write_p99_ms']}ms)"
+            )
+            for error in stats["errors"]:
+                print(f"    ERROR {error}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "devices": args.devices, "results": results}, f, indent=2)
+
+    if len(profiles) > 1:
+        base = results[profiles[0]]
+        print(f"\nRespecto a {profiles[0]}:")
+        for profile in profiles[1:]:
+            for load in ("read", "write", "mixed"):
+                before, after = base[load], results[profile][load]
+                reads = after["reads_per_s"] / before["reads_per_s"] if before["reads_per_s"] else None
+                writes = after["rows_written_per_s"] / before["rows_written_per_s"] if before["rows_written_per_s"] else None
+                parts = []
+                if reads:
+                    parts.append(f"lecturas x{reads:.2f}")
+                if writes:
+                    parts.append(f"escrituras x{writes:.2f}")
+                print(f"  {profile} {load}: {', '.join(parts)}")
+
+    return 0 if not any(s["errors"] for r in results.values() for s in r.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
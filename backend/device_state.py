@@ -0,0 +1,154 @@
+"""
+Máquina de estados Online/Offline por dispositivo, con histéresis y
+amortiguación de oscilaciones (flap damping).
+
+- Histéresis: un dispositivo pasa a Offline cuando el motor de presencia
+  lo da por caducado y además CRC_OFFLINE_MISSES escaneos seguidos lo
+  confirman (un escaneo tras suspender el equipo no tira toda la red), y
+  vuelve a Online tras CRC_ONLINE_HITS escaneos seguidos viéndolo.
+- Amortiguación: cada cambio de estado suma FLAP_PENALTY a una puntuación
+  que decae exponencialmente (vida media CRC_FLAP_HALF_LIFE segundos). Si
+  supera CRC_FLAP_SUPPRESS el dispositivo se considera inestable y sus
+  cambios dejan de confirmarse (ni escritura de estado, ni alertas, ni
+  WebSocket) hasta que la puntuación baja de FLAP_REUSE; entonces se
+  confirma el último estado observado, si difiere del confirmado.
+
+El estado vive solo en memoria: tras un reinicio se parte del estado de la
+BD sin penalización.
+"""
+import datetime
+import os
+from typing import Dict, List, Optional
+
+OFFLINE_MISSES = int(os.getenv("CRC_OFFLINE_MISSES", "2"))
+ONLINE_HITS = int(os.getenv("CRC_ONLINE_HITS", "1"))
+FLAP_HALF_LIFE = float(os.getenv("CRC_FLAP_HALF_LIFE", "900"))
+FLAP_SUPPRESS = float(os.getenv("CRC_FLAP_SUPPRESS", "3000"))
+FLAP_PENALTY = 1000.0
+FLAP_REUSE = 750.0
+
+ONLINE = "Online"
+OFFLINE = "Offline"
+
+
+class DeviceState:
+    __slots__ = ("status", "observed", "misses", "hits", "penalty", "penalty_at", "damped")
+
+    def __init__(self, status: str):
+        self.status = status      # Estado confirmado (el de la BD)
+        self.observed = status    # Último estado que pasó la histéresis
+        self.misses = 0
+        self.hits = 0
+        self.penalty = 0.0
+        self.penalty_at: Optional[datetime.datetime] = None
+        self.damped = False
+
+    def score(self, now: datetime.datetime, half_life: float) -> float:
+        """Puntuación de oscilación decaída hasta `now`"""
+        if not self.penalty or self.penalty_at is None:
+            return 0.0
+        elapsed = max((now - self.penalty_at).total_seconds(), 0.0)
+        return self.penalty * 0.5 ** (elapsed / half_life)
+
+
+class DeviceStateTracker:
+    """Estados de todos los dispositivos, por id"""
+
+    def __init__(
+        self,
+        offline_misses: int = OFFLINE_MISSES,
+        online_hits: int = ONLINE_HITS,
+        half_life: float = FLAP_HALF_LIFE,
+        suppress: float = FLAP_SUPPRESS,
+        reuse: float = FLAP_REUSE
+    ):
+        self.offline_misses = max(offline_misses, 1)
+        self.online_hits = max(online_hits, 1)
+        self.half_life = half_life
+        self.suppress = suppress
+        self.reuse = reuse
+        self.states: Dict[int, DeviceState] = {}
+        self._damped = set()
+        self._missing = set()  # Con ausencias acumuladas
+
+    def _state(self, device_id: int, status: str) -> DeviceState:
+        # Warning/Critical (sensores) cuentan como presentes en la red
+        status = OFFLINE if status == OFFLINE else ONLINE
+        state = self.states.get(device_id)
+        if state is None:
+            state = self.states[device_id] = DeviceState(status)
+        elif not state.damped and state.status != status:
+            # Cambiado fuera del escáner (API, otro proceso): manda la BD
+            state.status = state.observed = status
+        return state
+
+    def seen(self, device_id: int, status: str, now: datetime.datetime) -> bool:
+        """El escaneo ha visto el dispositivo. True si hay que confirmar Online."""
+        state = self._state(device_id, status)
+        state.misses = 0
+        self._missing.discard(device_id)
+        state.hits += 1
+        if state.observed == ONLINE or state.hits < self.online_hits:
+            return False
+        return self._observe(device_id, state, ONLINE, now)
+
+    def missed(self, device_id: int, status: str, now: datetime.datetime) -> bool:
+        """El dispositivo sigue sin verse. True si hay que confirmar Offline."""
+        state = self._state(device_id, status)
+        state.hits = 0
+        state.misses += 1
+        self._missing.add(device_id)
+        if state.observed == OFFLINE or state.misses < self.offline_misses:
+            return False
+        return self._observe(device_id, state, OFFLINE, now)
+
+    def _observe(self, device_id: int, state: DeviceState, status: str, now: datetime.datetime) -> bool:
+        state.observed = status
+        state.penalty = state.score(now, self.half_life) + FLAP_PENALTY
+        state.penalty_at = now
+        if state.damped or state.penalty >= self.suppress:
+            state.damped = True
+            self._damped.add(device_id)
+            return False
+        state.status = status
+        return True
+
+    def reset_misses(self, still_missing):
+        """Las ausencias dejan de ser consecutivas si el dispositivo ha dado otra señal de vida"""
+        for device_id in self._missing - set(still_missing):
+            state = self.states.get(device_id)
+            if state is not None:
+                state.misses = 0
+            self._missing.discard(device_id)
+
+    def settle(self, now: datetime.datetime) -> Dict[int, str]:
+        """
+        Libera los dispositivos cuya puntuación ha bajado de FLAP_REUSE y
+        devuelve {device_id: estado} de los que hay que confirmar.
+        """
+        changes = {}
+        for device_id in list(self._damped):
+            state = self.states.get(device_id)
+            if state is not None and state.score(now, self.half_life) >= self.reuse:
+                continue
+            self._damped.discard(device_id)
+            if state is None:
+                continue
+            state.damped = False
+            if state.observed != state.status:
+                state.status = state.observed
+                changes[device_id] = state.status
+        return changes
+
+    def flapping(self) -> List[int]:
+        """Dispositivos cuyos cambios están retenidos"""
+        return list(self._damped)
+
+    def is_damped(self, device_id: int) -> bool:
+        state = self.states.get(device_id)
+        return bool(state and state.damped)
+
+    def forget(self, device_id: int):
+        self.states.pop(device_id, None)
+        self._damped.discard(device_id)
+        self._missing.discard(device_id)
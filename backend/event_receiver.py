@@ -0,0 +1,570 @@
+"""
+Receptor de eventos de red: traps SNMPv2c y syslog (RFC 3164 / RFC 5424) por UDP.
+
+El equipo de red avisa en el momento en que algo cambia, sin esperar al
+siguiente sondeo:
+- link_down / link_up: traps linkDown/linkUp o mensajes de enlace
+  (Cisco %LINK-3-UPDOWN, "eth0: Link is Down", "port 3 link down"...)
+- auth_failure: trap authenticationFailure o fallos de login (sshd, dropbear...)
+- dhcp_lease: DHCPACK de dnsmasq / ISC dhcpd; actualiza la IP del dispositivo
+
+El camino rápido (datagram_received) solo descarta lo que no interesa con
+comparaciones de bytes y encola el evento; la BD, las alertas y el
+WebSocket se aplican por lotes en un hilo. Los dispositivos se localizan
+con un índice IP/MAC en memoria.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from instrumentation import NETWORK_EVENTS
+
+logger = logging.getLogger(__name__)
+
+EVENT_BIND = os.getenv("CRC_EVENT_BIND", "0.0.0.0")
+SYSLOG_PORT = int(os.getenv("CRC_SYSLOG_PORT", "514"))
+TRAP_PORT = int(os.getenv("CRC_TRAP_PORT", "162"))
+TRAP_COMMUNITY = os.getenv("CRC_TRAP_COMMUNITY", "public")
+# Un mismo evento llega a menudo por trap y por syslog, o repetido (fuerza bruta)
+EVENT_DEDUP_SECONDS = float(os.getenv("CRC_EVENT_DEDUP_SECONDS", "30"))
+EVENT_QUEUE_SIZE = 10000
+EVENT_BATCH = 200
+INDEX_REFRESH_SECONDS = 60
+
+# SNMPv2-MIB / IF-MIB
+SNMP_TRAP_OID = "1.3.6.1.6.3.1.1.4.1.0"
+TRAP_EVENTS = {
+    "1.3.6.1.6.3.1.1.5.3": "link_down",
+    "1.3.6.1.6.3.1.1.5.4": "link_up",
+    "1.3.6.1.6.3.1.1.5.5": "auth_failure"
+}
+IF_INDEX = "1.3.6.1.2.1.2.2.1.1."
+IF_DESCR = "1.3.6.1.2.1.2.2.1.2."
+IF_NAME = "1.3.6.1.2.1.31.1.1.1.1."
+
+# Palabras clave: los mensajes que no contienen ninguna no pasan por las regex
+_SYSLOG_KEYWORDS = ("link", "changed state", "dhcpack", "password", "invalid user", "authentication fail", "login fail")
+
+_LINK_PATTERNS = (
+    # Cisco: %LINK-3-UPDOWN: Interface GigabitEthernet0/1, changed state to down
+    re.compile(r"Interface ([\w/.:-]+), changed state to (up|down)", re.I),
+    # Juniper: SNMP_TRAP_LINK_DOWN: ifIndex 501, ..., ifName ge-0/0/1
+    re.compile(r"SNMP_TRAP_LINK_(UP|DOWN):.*?ifName ([\w/.:-]+)", re.I),
+    # Linux: eth0: Link is Down / e1000e: eth0 NIC Link is Up 1000 Mbps
+    re.compile(r"([\w.@-]+):? (?:NIC )?Link is (Up|Down)", re.I),
+    # Switches domésticos: port 3 link down
+    re.compile(r"port\s*([\w/.-]+?)[,:]? link (?:is )?(up|down)", re.I)
+)
+_AUTH_PATTERN = re.compile(
+    r"failed password|invalid user|authentication failure|bad password|login fail", re.I
+)
+_AUTH_SOURCE = re.compile(r"(?:from|rhost=)\s*'?(\d{1,3}(?:\.\d{1,3}){3})")
+_AUTH_USER = re.compile(r"(?:for (?:invalid user )?|user[= ])'?([\w.@-]+)", re.I)
+# dnsmasq: DHCPACK(br-lan) 192.168.1.23 aa:bb:cc:dd:ee:ff nombre
+# ISC:     DHCPACK on 192.168.1.23 to aa:bb:cc:dd:ee:ff (nombre) via eth0
+_DHCP_PATTERN = re.compile(
+    r"DHCPACK(?:\([^)]*\))?(?: on)? (\d{1,3}(?:\.\d{1,3}){3}) (?:to )?([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})"
+    r"(?: \(?([^\s()]+)\)?)?"
+)
+_BSD_TIMESTAMP = re.compile(r"^[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d ")
+
+
+class NetworkEvent:
+    __slots__ = ("kind", "source", "sender_ip", "interface", "ip", "mac", "hostname", "user", "message", "timestamp")
+
+    def __init__(self, kind: str, source: str, sender_ip: str, message: str = "", interface: Optional[str] = None,
+                 ip: Optional[str] = None, mac: Optional[str] = None, hostname: Optional[str] = None,
+                 user: Optional[str] = None):
+        self.kind = kind
+        self.source = source          # trap | syslog
+        self.sender_ip = sender_ip    # Equipo que envía el evento
+        self.interface = interface
+        self.ip = ip                  # IP afectada (origen del login, IP concedida)
+        self.mac = mac
+        self.hostname = hostname
+        self.user = user
+        self.message = message
+        self.timestamp = datetime.datetime.utcnow()
+
+
+# ============================================
+# PARSERS
+# ============================================
+
+def parse_syslog(data: bytes) -> Optional[Dict]:
+    """
+    Cabecera syslog RFC 5424 o RFC 3164. Devuelve facility, severity,
+    hostname, app y message; None si no es syslog.
+    """
+    if not data.startswith(b"<"):
+        return None
+    end = data.find(b">", 1, 5)
+    if end < 0 or not data[1:end].isdigit():
+        return None
+    pri = int(data[1:end])
+    text = data[end + 1:].decode("utf-8", "replace")
+    hostname = app = None
+
+    if text.startswith("1 "):
+        # RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID SD MSG
+        parts = text.split(" ", 6)
+        if len(parts) < 7:
+            return None
+        hostname, app, rest = parts[2], parts[3], parts[6]
+        if rest.startswith("-"):
+            message = rest[1:]
+        else:
+            position = 0
+            while rest.startswith("[", position):
+                close = rest.find("]", position)
+                if close < 0:
+                    break
+                position = close + 1
+            message = rest[position:]
+        message = message.lstrip(" \ufeff")
+    else:
+        # RFC 3164: "Mmm dd hh:mm:ss HOST TAG: MSG"; muchos equipos omiten algo
+        message = text
+        if _BSD_TIMESTAMP.match(text):
+            host, _, message = text[16:].partition(" ")
+            hostname = host
+        tag, separator, body = message.partition(": ")
+        if separator and " " not in tag:
+            app, message = tag.split("[", 1)[0], body
+    return {
+        "facility": pri >> 3,
+        "severity": pri & 7,
+        "hostname": None if hostname == "-" else hostname,
+        "app": None if app == "-" else app,
+        "message": message.strip()
+    }
+
+
+def classify_syslog(message: str, sender_ip: str) -> Optional[NetworkEvent]:
+    """Evento de un mensaje syslog; None si no es de enlace, autenticación ni DHCP"""
+    lowered = message.lower()
+    if not any(keyword in lowered for keyword in _SYSLOG_KEYWORDS):
+        return None
+
+    if "dhcpack" in lowered:
+        match = _DHCP_PATTERN.search(message)
+        if match:
+            return NetworkEvent(
+                "dhcp_lease", "syslog", sender_ip, message,
+                ip=match.group(1), mac=match.group(2).lower(), hostname=match.group(3)
+            )
+        return None
+
+    if "link" in lowered or "changed state" in lowered:
+        for pattern in _LINK_PATTERNS:
+            match = pattern.search(message)
+            if match:
+                first, second = match.groups()
+                state, interface = (first, second) if first.lower() in ("up", "down") else (second, first)
+                return NetworkEvent(f"link_{state.lower()}", "syslog", sender_ip, message, interface=interface)
+
+    if _AUTH_PATTERN.search(message):
+        source = _AUTH_SOURCE.search(message)
+        user = _AUTH_USER.search(message)
+        return NetworkEvent(
+            "auth_failure", "syslog", sender_ip, message,
+            ip=source.group(1) if source else None, user=user.group(1) if user else None
+        )
+    return None
+
+
+def _tlv(data: bytes, pos: int) -> tuple:
+    """(tag, inicio del valor, fin del valor) del elemento BER en pos"""
+    tag, length = data[pos], data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[pos:pos + size], "big")
+        pos += size
+    end = pos + length
+    if end > len(data):
+        raise ValueError("BER truncado")
+    return tag, pos, end
+
+
+def _oid(raw: bytes) -> str:
+    arcs = []
+    value = 0
+    for byte in raw:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    first = min(arcs[0] // 40, 2)
+    return ".".join(map(str, [first, arcs[0] - 40 * first] + arcs[1:]))
+
+
+def _ber_value(tag: int, raw: bytes):
+    if tag == 0x06:  # OBJECT IDENTIFIER
+        return _oid(raw)
+    if tag == 0x04:  # OCTET STRING
+        return raw.decode("utf-8", "replace")
+    if tag == 0x40:  # IpAddress
+        return ".".join(map(str, raw))
+    if tag in (0x02, 0x41, 0x42, 0x43, 0x46):  # INTEGER, Counter32, Gauge32, TimeTicks, Counter64
+        return int.from_bytes(raw, "big", signed=tag == 0x02)
+    return None
+
+
+def parse_trap(data: bytes, sender_ip: str, community: Optional[str] = TRAP_COMMUNITY) -> Optional[NetworkEvent]:
+    """
+    Evento de un trap SNMPv2c; None si no es uno de TRAP_EVENTS, la comunidad
+    no coincide o el paquete no es válido. Lee el BER directamente: un trap
+    son unas pocas varbinds y pyasn1 es ~50 veces más lento.
+    """
+    try:
+        tag, pos, _ = _tlv(data, 0)                      # Message: SEQUENCE
+        if tag != 0x30:
+            return None
+        tag, start, pos = _tlv(data, pos)                # version (1 = v2c)
+        if tag != 0x02 or int.from_bytes(data[start:pos], "big") != 1:
+            return None
+        tag, start, pos = _tlv(data, pos)                # community
+        if tag != 0x04 or (community and data[start:pos] != community.encode()):
+            return None
+        tag, pos, _ = _tlv(data, pos)                    # SNMPv2-Trap-PDU
+        if tag != 0xA7:
+            return None
+        for _ in range(3):                               # request-id, error-status, error-index
+            _, _, pos = _tlv(data, pos)
+        tag, pos, end = _tlv(data, pos)                  # variable-bindings
+        var_binds = []
+        while pos < end:
+            _, start, pos = _tlv(data, pos)
+            _, oid_start, oid_end = _tlv(data, start)
+            tag, value_start, value_end = _tlv(data, oid_end)
+            var_binds.append((_oid(data[oid_start:oid_end]), _ber_value(tag, data[value_start:value_end])))
+    except (IndexError, ValueError):
+        return None
+
+    trap_oid = next((value for oid, value in var_binds if oid == SNMP_TRAP_OID), None)
+    kind = TRAP_EVENTS.get(trap_oid)
+    if kind is None:
+        return None
+
+    interface = None
+    if kind != "auth_failure":
+        names = {}
+        for oid, value in var_binds:
+            for prefix in (IF_NAME, IF_DESCR, IF_INDEX):
+                if oid.startswith(prefix):
+                    names.setdefault(prefix, value)
+        interface = names.get(IF_NAME) or names.get(IF_DESCR)
+        if interface is None and IF_INDEX in names:
+            interface = f"if{names[IF_INDEX]}"
+    return NetworkEvent(kind, "trap", sender_ip, f"SNMP trap {trap_oid}", interface=interface)
+
+
+# ============================================
+# ÍNDICE DE DISPOSITIVOS
+# ============================================
+
+class DeviceIndex:
+    """
+    IP -> id y MAC -> id de los dispositivos, en memoria. Una clave
+    desconocida recarga el índice de la BD como mucho cada refresh_seconds.
+    """
+
+    def __init__(self, read_session_factory=None, refresh_seconds: float = INDEX_REFRESH_SECONDS):
+        self.read_session_factory = read_session_factory
+        self.refresh_seconds = refresh_seconds
+        self.by_ip: Dict[str, int] = {}
+        self.by_mac: Dict[str, int] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.read_session_factory is None:
+            return
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        from database import Device
+
+        db = self.read_session_factory()
+        try:
+            rows = db.query(Device.id, Device.ip, Device.mac).all()
+        finally:
+            db.close()
+        with self._lock:
+            self.by_ip = {ip: device_id for device_id, ip, _ in rows if ip}
+            self.by_mac = {mac.lower(): device_id for device_id, _, mac in rows if mac}
+            self._loaded_at = time.monotonic()
+
+    def lookup(self, ip: Optional[str] = None, mac: Optional[str] = None) -> Optional[int]:
+        for attempt in range(2):
+            device_id = (self.by_mac.get(mac) if mac else None) or (self.by_ip.get(ip) if ip else None)
+            if device_id is not None or attempt:
+                return device_id
+            self._refresh()
+        return None
+
+    def update(self, device_id: int, ip: Optional[str] = None, mac: Optional[str] = None):
+        with self._lock:
+            if ip:
+                # La IP anterior del dispositivo deja de apuntarle; la nueva pasa a él
+                # aunque la tuviera otro
+                for stale in [key for key, value in self.by_ip.items() if value == device_id and key != ip]:
+                    del self.by_ip[stale]
+                self.by_ip[ip] = device_id
+            if mac:
+                self.by_mac[mac] = device_id
+
+
+# ============================================
+# RECEPTOR
+# ============================================
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver: "EventReceiver", source: str):
+        self.receiver = receiver
+        self.source = source
+
+    def datagram_received(self, data: bytes, addr):
+        self.receiver.datagram(self.source, data, addr[0])
+
+
+class EventReceiver:
+    """Escucha traps y syslog y los aplica sobre dispositivos, alertas y WebSocket"""
+
+    def __init__(
+        self,
+        alert_manager=None,
+        ws_manager=None,
+        liveness=None,
+        session_factory=None,
+        read_session_factory=None,
+        community: Optional[str] = TRAP_COMMUNITY,
+        dedup_seconds: float = EVENT_DEDUP_SECONDS
+    ):
+        if session_factory is None:
+            from database import SessionLocal, ReadSessionLocal
+            session_factory, read_session_factory = SessionLocal, read_session_factory or ReadSessionLocal
+        self.alert_manager = alert_manager
+        self.ws_manager = ws_manager
+        self.liveness = liveness
+        self.session_factory = session_factory
+        self.community = community
+        self.dedup_seconds = dedup_seconds
+        self.index = DeviceIndex(read_session_factory or session_factory)
+        self.queue: Optional[asyncio.Queue] = None
+        self._transports = []
+        self._consumer: Optional[asyncio.Task] = None
+        self._recent: Dict[tuple, float] = {}
+
+    async def start(self, host: str = EVENT_BIND, syslog_port: int = SYSLOG_PORT, trap_port: int = TRAP_PORT):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        for source, port in (("syslog", syslog_port), ("trap", trap_port)):
+            if not port:
+                continue
+            try:
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda source=source: _DatagramProtocol(self, source), local_addr=(host, port)
+                )
+                self._transports.append(transport)
+                logger.info(f"Escuchando {source} en UDP {host}:{port}")
+            except OSError as e:
+                # Puertos < 1024: hace falta administrador / CAP_NET_BIND_SERVICE
+                logger.error(f"No se pudo abrir UDP {port} para {source}: {e}")
+        self._consumer = asyncio.create_task(self._consume())
+
+    def stop(self):
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        if self._consumer is not None:
+            self._consumer.cancel()
+            self._consumer = None
+
+    def datagram(self, source: str, data: bytes, sender_ip: str):
+        """Camino rápido: parseo y encolado, sin BD"""
+        if source == "trap":
+            event = parse_trap(data, sender_ip, self.community)
+        else:
+            parsed = parse_syslog(data)
+            event = classify_syslog(parsed["message"], sender_ip) if parsed else None
+        if event is None:
+            NETWORK_EVENTS.labels(source, "ignored").inc()
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            NETWORK_EVENTS.labels(source, "dropped").inc()
+            return
+        NETWORK_EVENTS.labels(source, event.kind).inc()
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = [await self.queue.get()]
+            while len(events) < EVENT_BATCH and not self.queue.empty():
+                events.append(self.queue.get_nowait())
+            try:
+                broadcasts = await loop.run_in_executor(None, self.apply, events)
+            except Exception as e:
+                logger.error(f"Error aplicando eventos de red: {e}")
+                continue
+            for coroutine_factory, data in broadcasts:
+                await coroutine_factory(data)
+
+    def _duplicate(self, event: NetworkEvent, device_id: Optional[int]) -> bool:
+        key = (event.kind, device_id, event.interface or event.ip or event.mac)
+        now = time.monotonic()
+        if now - self._recent.get(key, -self.dedup_seconds) < self.dedup_seconds:
+            return True
+        self._recent[key] = now
+        if len(self._recent) > EVENT_QUEUE_SIZE:
+            cutoff = now - self.dedup_seconds
+            self._recent = {k: t for k, t in self._recent.items() if t >= cutoff}
+        return False
+
+    def apply(self, events: List[NetworkEvent]) -> List[tuple]:
+        """
+        Aplica un lote en una transacción, con un savepoint por evento: uno
+        que falla se descarta sin arrastrar al resto. AlertManager se llama
+        tras el commit, fuera de la transacción (con SQLite hay una sola
+        conexión de escritura). Devuelve los broadcasts WebSocket pendientes.
+        """
+        from database import Device
+
+        pending: List[tuple] = []
+        followups: List[Callable] = []
+        db = self.session_factory()
+        try:
+            for event in events:
+                sender_id = self.index.lookup(ip=event.sender_ip)
+                # El dispositivo afectado: el que concede la IP es el router, no el cliente
+                device_id = self.index.lookup(mac=event.mac) if event.kind == "dhcp_lease" else sender_id
+                if self._duplicate(event, device_id):
+                    continue
+                if self.liveness is not None and sender_id is not None:
+                    # Quien envía el evento está vivo
+                    self.liveness.heard(sender_id, "passive", event.timestamp)
+
+                event_pending: List[tuple] = []
+                event_followups: List[Callable] = []
+                try:
+                    with db.begin_nested():
+                        device = db.get(Device, device_id) if device_id is not None else None
+                        if event.kind == "dhcp_lease":
+                            self._dhcp_lease(db, event, device, event_followups)
+                        elif device is not None:
+                            self._device_event(db, event, device, event_pending, event_followups)
+                        else:
+                            logger.debug(f"Evento {event.kind} de {event.sender_ip}: equipo desconocido")
+                except Exception as e:
+                    NETWORK_EVENTS.labels(event.source, "error").inc()
+                    logger.error(f"Evento {event.kind} de {event.sender_ip} descartado: {e}")
+                    continue
+                pending.extend(event_pending)
+                followups.extend(event_followups)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        for followup in followups:
+            try:
+                followup()
+            except Exception as e:
+                logger.error(f"Error procesando evento de red: {e}")
+        return pending
+
+    def _device_event(self, db, event: NetworkEvent, device, pending: List[tuple], followups: List[Callable]):
+        from database import Alert
+        from inventory import device_dict
+
+        name = device.hostname or device.ip
+        if event.kind == "link_up":
+            resolve_link_rows(db, device.id, event.interface, event.timestamp)
+        else:
+            if event.kind == "link_down":
+                level, message = "WARNING", f"Enlace caído: {event.interface or '?'} en {name}"
+                metadata = {"interface": event.interface}
+            else:
+                level = "WARNING"
+                message = f"Fallo de autenticación en {name}" + (f" desde {event.ip}" if event.ip else "")
+                metadata = {"source_ip": event.ip, "user": event.user}
+            metadata["source"] = event.source
+            row = Alert(
+                device_id=device.id,
+                type=event.kind.upper(),
+                condition=event.kind,
+                level=level,
+                message=message,
+                device_name=name,
+                device_ip=device.ip,
+                alert_metadata=metadata,
+                timestamp=event.timestamp
+            )
+            db.add(row)
+            db.flush()
+            if self.ws_manager:
+                pending.append((self.ws_manager.broadcast_alert, {
+                    "id": row.id,
+                    "type": event.kind.upper(),
+                    "level": level,
+                    "message": message
+                }))
+        if self.alert_manager:
+            data = device_dict(device, device.ip, device.status)
+            followups.append(lambda: self.alert_manager.process_device_event(event.kind, data))
+
+    def _dhcp_lease(self, db, event: NetworkEvent, device, followups: List[Callable]):
+        """Concesión DHCP: la IP del dispositivo cambia ya, sin esperar al escaneo ARP"""
+        from database import Device
+        from inventory import device_dict
+
+        if device is not None:
+            if device.ip != event.ip:
+                logger.info(f"DHCP: {device.mac} pasa de {device.ip} a {event.ip}")
+                device.ip = event.ip
+                # La IP ya no es de quien la tenía antes; el próximo escaneo le asignará la suya
+                db.query(Device).filter(Device.ip == event.ip, Device.id != device.id).update({Device.ip: None})
+            device.last_seen = event.timestamp
+            device_id = device.id
+            data = device_dict(device, event.ip, device.status)
+
+            # Índice y presencia en memoria solo si el cambio llega a guardarse
+            def remember():
+                self.index.update(device_id, ip=event.ip, mac=event.mac)
+                if self.liveness is not None:
+                    self.liveness.heard(device_id, "passive", event.timestamp, ip=event.ip)
+            followups.append(remember)
+        else:
+            # Desconocido: lo dará de alta el próximo escaneo
+            data = {'id': None, 'ip': event.ip, 'mac': event.mac, 'hostname': event.hostname}
+        if self.alert_manager:
+            followups.append(lambda: self.alert_manager.process_device_event("dhcp_lease", data))
+
+
+def resolve_link_rows(db, device_id: int, interface: Optional[str], now: datetime.datetime) -> int:
+    """Resuelve las alertas link_down abiertas del dispositivo para esa interfaz (todas si no se sabe)"""
+    from database import Alert
+
+    rows = db.query(Alert).filter(
+        Alert.device_id == device_id,
+        Alert.condition == "link_down",
+        Alert.resolved_at.is_(None)
+    ).all()
+    count = 0
+    for row in rows:
+        if interface and (row.alert_metadata or {}).get("interface") not in (None, interface):
+            continue
+        row.resolved_at = now
+        if row.timestamp:
+            row.duration_seconds = max((now - row.timestamp).total_seconds(), 0.0)
+        count += 1
+    return count
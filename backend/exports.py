@@ -0,0 +1,209 @@
+"""
+Exportación en streaming del histórico (métricas, alertas y escaneos de puertos).
+
+Las filas se leen por lotes con cursores de servidor y se serializan a
+medida que se envían, así que la memoria usada es constante sin importar
+cuántos meses de histórico se exporten.
+"""
+import csv
+import datetime
+import io
+import json
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from database import ReadSessionLocal, MetricHistory, Alert, PortScan
+
+logger = logging.getLogger(__name__)
+
+# Filas leídas de la BD por lote
+BATCH_SIZE = 5000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+# Dataset -> (modelo, [(columna, tipo)])
+EXPORT_DATASETS: Dict[str, Tuple[object, List[Tuple[str, str]]]] = {
+    "metrics": (MetricHistory, [
+        ("id", "int"), ("device_id", "int"), ("sensor_id", "int"),
+        ("metric_name", "str"), ("value", "float"), ("unit", "str"),
+        ("timestamp", "datetime")
+    ]),
+    "alerts": (Alert, [
+        ("id", "int"), ("device_id", "int"), ("level", "str"),
+        ("condition", "str"), ("type", "str"), ("message", "str"),
+        ("device_name", "str"), ("device_ip", "str"), ("alert_metadata", "json"),
+        ("timestamp", "datetime"), ("is_read", "bool"), ("is_acknowledged", "bool"),
+        ("acknowledged_by", "str"), ("acknowledged_at", "datetime"), ("resolved_at", "datetime")
+    ]),
+    "port_scans": (PortScan, [
+        ("id", "int"), ("device_id", "int"), ("port", "int"), ("protocol", "str"),
+        ("state", "str"), ("service", "str"), ("version", "str"),
+        ("timestamp", "datetime")
+    ])
+}
+
+
+def build_export_query(
+    dataset: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    device_id: Optional[int] = None
+):
+    """Consulta columnar del dataset ordenada por timestamp"""
+    model, columns = EXPORT_DATASETS[dataset]
+    stmt = select(*[getattr(model, name) for name, _ in columns])
+
+    if since:
+        stmt = stmt.where(model.timestamp >= since)
+    if until:
+        stmt = stmt.where(model.timestamp < until)
+    if device_id is not None:
+        stmt = stmt.where(model.device_id == device_id)
+
+    return stmt.order_by(model.timestamp.asc())
+
+
+def iter_batches(stmt, session_factory=ReadSessionLocal, batch_size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Lee la consulta por lotes con un cursor de servidor (stream_results)"""
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+        for partition in result.partitions(batch_size):
+            yield partition
+    finally:
+        db.close()
+
+
+def _plain(value, kind: str):
+    """Valor serializable para CSV/NDJSON"""
+    if value is None:
+        return None
+    if kind == "datetime":
+        return value.isoformat()
+    if kind == "json":
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def stream_csv(batches: Iterator[List[tuple]], columns: List[Tuple[str, str]]) -> Iterator[str]:
+    """Genera CSV por lotes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+
+    for batch in batches:
+        for row in batch:
+            writer.writerow([_plain(v, kind) for v, (_, kind) in zip(row, columns)])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(batches: Iterator[List[tuple]], columns: List[Tuple[str, str]]) -> Iterator[str]:
+    """Genera NDJSON (un objeto JSON por línea) por lotes"""
+    names = [name for name, _ in columns]
+    for batch in batches:
+        lines = []
+        for row in batch:
+            record = {name: _plain(v, kind) for name, v, (_, kind) in zip(names, row, columns)}
+            lines.append(json.dumps(record, ensure_ascii=False))
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Destino de escritura que acumula bytes hasta que se vacían con drain().
+    tell() sigue contando desde el inicio para que el pie del Parquet
+    tenga offsets correctos.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_parquet(batches: Iterator[List[tuple]], columns: List[Tuple[str, str]]) -> Iterator[bytes]:
+    """Genera un fichero Parquet con un row group por lote (requiere pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "json": pa.string(),
+        "bool": pa.bool_(),
+        "datetime": pa.timestamp("us")
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            arrays = []
+            for i, (name, kind) in enumerate(columns):
+                values = [row[i] for row in batch]
+                if kind == "json":
+                    values = [_plain(v, kind) for v in values]
+                arrays.append(pa.array(values, type=arrow_types[kind]))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    """pyarrow es una dependencia opcional"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def stream_export(
+    dataset: str,
+    fmt: str,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    device_id: Optional[int] = None
+):
+    """Generador del contenido exportado en el formato pedido"""
+    _, columns = EXPORT_DATASETS[dataset]
+    batches = iter_batches(build_export_query(dataset, since, until, device_id))
+
+    if fmt == "csv":
+        return stream_csv(batches, columns)
+    if fmt == "ndjson":
+        return stream_ndjson(batches, columns)
+    return stream_parquet(batches, columns)
@@ -0,0 +1,194 @@
+"""
+Métricas internas del propio monitor en formato Prometheus / OpenMetrics.
+
+Los histogramas se actualizan en el camino caliente (escaneo, colector,
+commits, alertas, WebSocket) y solo cuestan un par de sumas. Los gauges que
+requieren consultar la BD (dispositivos, sensores) se calculan al hacer
+scrape y se cachean DB_GAUGE_TTL segundos, así que /metrics se puede
+consultar cada 5 segundos sin cargar la base de datos.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE,
+    generate_latest as generate_openmetrics
+)
+from sqlalchemy import event, func
+
+logger = logging.getLogger(__name__)
+
+# Segundos que se reutilizan los recuentos de la BD entre scrapes
+DB_GAUGE_TTL = float(os.getenv("CRC_METRICS_DB_TTL", "15"))
+
+REGISTRY = CollectorRegistry()
+
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+SCAN_DURATION = Histogram(
+    "crc_scan_duration_seconds", "Duración de cada fase del escaneo de red",
+    ["phase"], registry=REGISTRY,
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+SENSOR_COLLECTION = Histogram(
+    "crc_sensor_collection_seconds", "Tiempo de recolección de un sensor (ping RTT, HTTP, ...)",
+    ["sensor_type"], registry=REGISTRY,
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 30)
+)
+DB_FLUSH = Histogram(
+    "crc_db_flush_seconds", "Tiempo de flush + commit de las sesiones síncronas",
+    registry=REGISTRY, buckets=_FAST_BUCKETS
+)
+ALERT_DISPATCH = Histogram(
+    "crc_alert_dispatch_seconds", "Latencia de envío de una alerta por canal",
+    ["channel"], registry=REGISTRY, buckets=_FAST_BUCKETS + (10.0, 30.0)
+)
+NOTIFICATION_DELIVERY = Histogram(
+    "crc_notification_delivery_seconds", "Tiempo desde que se encola una notificación hasta que se entrega",
+    ["channel"], registry=REGISTRY, buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+)
+BROADCAST = Histogram(
+    "crc_ws_broadcast_seconds", "Latencia de un broadcast WebSocket a todos los clientes",
+    ["message_type"], registry=REGISTRY, buckets=_FAST_BUCKETS
+)
+
+SCAN_DEVICES_FOUND = Gauge(
+    "crc_scan_devices_found", "Dispositivos encontrados en el último escaneo ARP", registry=REGISTRY
+)
+SENSOR_BACKLOG = Gauge(
+    "crc_sensor_collections_in_flight", "Recolecciones de sensores lanzadas y aún sin terminar", registry=REGISTRY
+)
+WS_CONNECTIONS = Gauge(
+    "crc_ws_connections", "Clientes WebSocket conectados", registry=REGISTRY
+)
+ASYNCIO_TASKS = Gauge(
+    "crc_asyncio_tasks", "Tareas vivas en el event loop principal", registry=REGISTRY
+)
+NOTIFICATION_QUEUE = Gauge(
+    "crc_notification_queue_depth", "Notificaciones pendientes de envío por canal", ["channel"], registry=REGISTRY
+)
+NOTIFICATIONS = Counter(
+    "crc_notifications", "Notificaciones por canal y resultado (sent, retry, dead_letter, digested)",
+    ["channel", "result"], registry=REGISTRY
+)
+ALERTS_SUPPRESSED = Counter(
+    "crc_alerts_suppressed", "Alertas no notificadas porque su equipo aguas arriba está caído",
+    ["condition"], registry=REGISTRY
+)
+NETWORK_EVENTS = Counter(
+    "crc_network_events", "Traps SNMP y mensajes syslog recibidos por evento (link_down, auth_failure, ..., ignored, dropped, error)",
+    ["source", "event"], registry=REGISTRY
+)
+METRIC_WINDOW_SAMPLES = Gauge(
+    "crc_metric_window_samples", "Muestras retenidas en las ventanas de evaluación de reglas", registry=REGISTRY
+)
+THREADS = Gauge(
+    "crc_threads", "Hilos activos del proceso", registry=REGISTRY
+)
+THREADS.set_function(threading.active_count)
+
+
+class InventoryCollector:
+    """Recuento de dispositivos y sensores por estado, cacheado DB_GAUGE_TTL segundos"""
+
+    def __init__(self, session_factory=None, ttl: float = DB_GAUGE_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._cached_at = 0.0
+        self._devices = {}
+        self._sensors = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Un fallo de la BD no tumba el scrape: se siguen sirviendo los últimos recuentos"""
+        from database import ReadSessionLocal, Device, Sensor
+
+        # Aunque falle, no se reintenta hasta pasado el TTL
+        self._cached_at = time.monotonic()
+        db = (self.session_factory or ReadSessionLocal)()
+        try:
+            devices = dict(db.query(Device.status, func.count(Device.id)).group_by(Device.status).all())
+            sensors = {
+                (sensor_type, bool(enabled)): count
+                for sensor_type, enabled, count in db.query(
+                    Sensor.sensor_type, Sensor.enabled, func.count(Sensor.id)
+                ).group_by(Sensor.sensor_type, Sensor.enabled).all()
+            }
+        except Exception as e:
+            logger.error(f"Error actualizando los recuentos de inventario: {e}")
+            return
+        finally:
+            db.close()
+        self._devices = devices
+        self._sensors = sensors
+
+    def collect(self):
+        with self._lock:
+            if time.monotonic() - self._cached_at > self.ttl:
+                self._refresh()
+            devices = dict(self._devices)
+            sensors = dict(self._sensors)
+
+        device_family = GaugeMetricFamily("crc_devices", "Dispositivos por estado", labels=["status"])
+        for status, count in devices.items():
+            device_family.add_metric([status or "Unknown"], count)
+        yield device_family
+
+        sensor_family = GaugeMetricFamily("crc_sensors", "Sensores por tipo", labels=["sensor_type", "enabled"])
+        for (sensor_type, enabled), count in sensors.items():
+            sensor_family.add_metric([sensor_type or "UNKNOWN", "true" if enabled else "false"], count)
+        yield sensor_family
+
+
+REGISTRY.register(InventoryCollector())
+
+
+def instrument_sessions(session_factory):
+    """Mide flush + commit de todas las sesiones creadas por session_factory"""
+    def before_commit(session):
+        session.info["commit_started"] = time.perf_counter()
+
+    def after_commit(session):
+        started = session.info.pop("commit_started", None)
+        if started is not None:
+            DB_FLUSH.observe(time.perf_counter() - started)
+
+    def after_rollback(session):
+        session.info.pop("commit_started", None)
+
+    event.listen(session_factory, "before_commit", before_commit)
+    event.listen(session_factory, "after_commit", after_commit)
+    event.listen(session_factory, "after_rollback", after_rollback)
+
+
+def watch_websockets(ws_manager):
+    """Gauge de clientes conectados leído al hacer scrape"""
+    WS_CONNECTIONS.set_function(lambda: len(ws_manager.active_connections))
+
+
+def watch_metric_windows(store):
+    """Memoria de las ventanas deslizantes de AlertManager, leída al hacer scrape"""
+    METRIC_WINDOW_SAMPLES.set_function(store.sample_count)
+
+
+def render_metrics(accept: str = ""):
+    """(cuerpo, content-type) según lo que acepte el scraper"""
+    from profiling import main_loop
+
+    # /metrics se sirve desde el threadpool: las tareas son las del loop de la API
+    loop = main_loop()
+    if loop is not None and not loop.is_closed():
+        try:
+            ASYNCIO_TASKS.set(len(asyncio.all_tasks(loop)))
+        except RuntimeError as e:
+            logger.debug(f"No se pudieron contar las tareas asyncio: {e}")
+
+    if "application/openmetrics-text" in (accept or ""):
+        return generate_openmetrics(REGISTRY), OPENMETRICS_CONTENT_TYPE
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
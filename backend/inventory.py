@@ -0,0 +1,386 @@
+"""
+Reconciliación del inventario de dispositivos tras cada escaneo ARP.
+
+Compara lo encontrado en la red con la tabla `devices`: da de alta los
+nuevos, marca como Online los que vuelven, como Offline los que el motor
+de presencia (LivenessTable: ARP, mDNS, ping, TCP) da por caducados, y
+genera las alertas, notificaciones y mensajes WebSocket correspondientes. Los cambios Online/Offline pasan por
+DeviceStateTracker (histéresis y amortiguación de oscilaciones), así que un
+dispositivo inestable no genera una alerta por escaneo.
+
+Los nombres (DNS, NetBIOS...) se resuelven antes de abrir la transacción
+del escaneo y los eventos para AlertManager se disparan después del
+commit: con SQLite hay una sola conexión de escritura y no debe quedarse
+retenida esperando a la red ni a otras sesiones.
+
+Las dependencias externas (resolución de nombres y fabricante,
+notificaciones de escritorio, AlertManager, WebSocket) se inyectan para
+que el mismo código se use desde server.py y desde benchmark_pipeline.py
+con fuentes falsas.
+"""
+import asyncio
+import datetime
+import logging
+from typing import Callable, Dict, List, Optional
+
+from database import Device, Alert
+from alert_lifecycle import resolve_alert_rows
+from device_state import DeviceStateTracker
+from liveness import LivenessTable
+from metrics_query import chunked
+
+logger = logging.getLogger(__name__)
+
+# MACs por consulta al precargar el inventario (límite de parámetros de SQLite)
+MAC_LOOKUP_CHUNK = 500
+
+
+def guess_device_type(vendor, hostname):
+    v = vendor.lower()
+    h = (hostname or "").lower()
+
+    if any(k in v or k in h for k in ["apple", "iphone", "ipad", "android", "samsung", "huawei", "xiaomi", "mobile", "phone"]):
+        return "Mobile/Tablet"
+    if any(k in v or k in h for k in ["cisco", "tplink", "tp-link", "dlink", "d-link", "huawei", "router", "gateway", "mikrotik"]):
+        return "Router/Network"
+    if any(k in v or k in h for k in ["hp", "canon", "epson", "brother", "printer", "lexmark"]):
+        return "Printer"
+    if any(k in v or k in h for k in ["raspberry", "esp32", "espressif", "iot", "arduino", "nest", "google home", "alexa"]):
+        return "IoT/Device"
+    if any(k in v or k in h for k in ["vmware", "virtualbox", "microsoft", "windows", "linux", "desktop", "laptop", "pc"]):
+        return "PC/Server"
+
+    return "Unknown"
+
+
+def device_dict(device: Device, ip: str, status: str) -> Dict:
+    """Datos del dispositivo en el formato que espera AlertManager"""
+    return {
+        'id': device.id,
+        'ip': ip,
+        'hostname': device.hostname,
+        'alias': device.alias,
+        'status': status,
+        'is_authorized': device.is_authorized,
+        'group_id': device.group_id,
+        'parent_id': device.parent_id
+    }
+
+
+class InventoryReconciler:
+    """Aplica el resultado de un escaneo sobre la tabla de dispositivos"""
+
+    def __init__(
+        self,
+        resolve_hostname: Callable[[str], str],
+        get_vendor: Callable[[str], str],
+        notify: Optional[Callable[[str, str], None]] = None,
+        alert_manager=None,
+        ws_manager=None,
+        hostname_cache: Optional[Dict[str, str]] = None,
+        track_detected_at: bool = False,
+        run_coroutine: Callable = asyncio.run,
+        states: Optional[DeviceStateTracker] = None,
+        liveness: Optional[LivenessTable] = None
+    ):
+        self.resolve_hostname = resolve_hostname
+        self.get_vendor = get_vendor
+        self.notify = notify
+        self.alert_manager = alert_manager
+        self.ws_manager = ws_manager
+        self.hostname_cache = hostname_cache if hostname_cache is not None else {}
+        self.track_detected_at = track_detected_at
+        self.run_coroutine = run_coroutine
+        self.states = states or DeviceStateTracker()
+        self.liveness = liveness if liveness is not None else LivenessTable()
+
+    def _notify(self, title: str, msg: str):
+        if self.notify:
+            self.notify(title, msg)
+
+    def _broadcast(self, coroutine_factory: Callable, data: Dict):
+        if self.ws_manager:
+            self.run_coroutine(coroutine_factory(data))
+
+    def _flush_broadcasts(self, pending: List[tuple]):
+        for coroutine_factory, data in pending:
+            self._broadcast(coroutine_factory, data)
+
+    def _fire_events(self, events: List[tuple]):
+        """Eventos para AlertManager, ya fuera de la transacción del escaneo"""
+        if not self.alert_manager:
+            return
+        for event_type, device_data in events:
+            try:
+                self.alert_manager.process_device_event(event_type, device_data)
+            except Exception as e:
+                logger.error(f"Error procesando evento {event_type} de {device_data.get('ip')}: {e}")
+
+    def _resolve_names(self, db, found_devices: List[Dict[str, str]]) -> Dict[str, str]:
+        """
+        Nombres de los dispositivos que los necesitan (nuevos o sin nombre),
+        resueltos antes de la transacción del escaneo. IP -> nombre.
+        """
+        hostnames = {}
+        for chunk in chunked([d['mac'] for d in found_devices], MAC_LOOKUP_CHUNK):
+            hostnames.update(db.query(Device.mac, Device.hostname).filter(Device.mac.in_(chunk)).all())
+        # Fin de la lectura: la conexión vuelve al pool mientras se consulta la red
+        db.rollback()
+
+        names = {}
+        for d in found_devices:
+            if d['mac'] in hostnames:
+                if hostnames[d['mac']] not in (None, "", "Unknown"):
+                    continue
+                cached = self.hostname_cache.get(d['ip'])
+                if cached:
+                    names[d['ip']] = cached
+                    continue
+            names[d['ip']] = self.resolve_hostname(d['ip'])
+        return names
+
+    def _load_known(self, db, macs: List[str]) -> Dict[str, Device]:
+        """Precarga los dispositivos escaneados en una consulta por lote"""
+        known = {}
+        for chunk in chunked(macs, MAC_LOOKUP_CHUNK):
+            for device in db.query(Device).filter(Device.mac.in_(chunk)).all():
+                known[device.mac] = device
+        return known
+
+    def reconcile(self, db, found_devices: List[Dict[str, str]], now: Optional[datetime.datetime] = None) -> Dict[str, int]:
+        """
+        Reconcilia un escaneo. Devuelve el número de dispositivos nuevos,
+        vistos, que han vuelto, que han pasado a Offline y que están
+        oscilando (cambios retenidos).
+        """
+        now = now or datetime.datetime.utcnow()
+        summary = {"new": 0, "seen": 0, "reappeared": 0, "offline": 0, "flapping": 0}
+        names = self._resolve_names(db, found_devices)
+        events: List[tuple] = []
+        if not self.liveness.seeded:
+            self.liveness.seed(db)
+
+        # Dispositivos que han dejado de oscilar: se confirma su último estado
+        settled_offline = []
+        settled = self.states.settle(now)
+        if settled:
+            for device in db.query(Device).filter(Device.id.in_(list(settled))).all():
+                if settled[device.id] == "Offline":
+                    settled_offline.append(device)
+                elif device.status == "Offline":
+                    self._come_back(db, device, device.ip, now, events)
+                    device.status = "Online"
+                    summary["reappeared"] += 1
+
+        # Una sola transacción por escaneo: un commit por dispositivo expira
+        # todo el mapa de identidad de la sesión y el coste crece como N².
+        # Los mensajes WebSocket y los eventos de AlertManager van tras el commit.
+        pending: List[tuple] = []
+        known = self._load_known(db, [d['mac'] for d in found_devices])
+        for d in found_devices:
+            device = known.get(d['mac'])
+            if not device:
+                device = self._add_new(db, d, now, pending, events, names)
+                known[d['mac']] = device
+                summary["new"] += 1
+            else:
+                if self._update_known(db, device, d, now, events, names):
+                    summary["reappeared"] += 1
+                summary["seen"] += 1
+            self.liveness.heard(device.id, "arp", now, ip=d['ip'], device_type=device.device_type)
+        db.commit()
+        self._flush_broadcasts(pending)
+        self._fire_events(events)
+
+        events = []
+        summary["offline"] = self._mark_offline(db, now, settled_offline, events)
+        db.commit()
+        self._fire_events(events)
+        summary["flapping"] = len(self.states.flapping())
+
+        # Broadcast status update
+        if self.ws_manager:
+            total = db.query(Device).count()
+            online = db.query(Device).filter(Device.status == "Online").count()
+            self._broadcast(self.ws_manager.broadcast_status, {
+                "total": total,
+                "online": online
+            })
+        return summary
+
+    def _add_new(
+        self,
+        db,
+        d: Dict[str, str],
+        now: datetime.datetime,
+        pending: List[tuple],
+        events: List[tuple],
+        names: Dict[str, str]
+    ) -> Device:
+        hostname = names.get(d['ip'], "Unknown")
+        vendor = self.get_vendor(d['mac'])
+        device_type = guess_device_type(vendor, hostname)
+        new_dev = Device(
+            mac=d['mac'],
+            ip=d['ip'],
+            hostname=hostname,
+            vendor=vendor,
+            device_type=device_type,
+            status="Online",
+            first_seen=now,
+            last_seen=now
+        )
+        if self.track_detected_at:
+            new_dev.detected_at = now
+        db.add(new_dev)
+        db.flush()
+
+        alert_msg = f"Nuevo dispositivo detectado: {hostname or 'Desconocido'} ({d['ip']})"
+        new_alert = Alert(
+            device_id=new_dev.id,
+            type="NEW_DEVICE",
+            condition="new_device",
+            level="INFO",
+            message=alert_msg,
+            device_name=hostname or 'Desconocido',
+            device_ip=d['ip']
+        )
+        db.add(new_alert)
+        db.flush()
+
+        self._notify("Nuevo Dispositivo", alert_msg)
+
+        # Alerta con AlertManager (tras el commit)
+        events.append(('new', device_dict(new_dev, d['ip'], 'Online')))
+
+        # Broadcast via WebSocket
+        if self.ws_manager:
+            pending.append((self.ws_manager.broadcast_device_update, {
+                "id": new_dev.id,
+                "mac": new_dev.mac,
+                "ip": new_dev.ip,
+                "hostname": new_dev.hostname,
+                "status": "Online",
+                "vendor": new_dev.vendor
+            }))
+            pending.append((self.ws_manager.broadcast_alert, {
+                "id": new_alert.id,
+                "type": "NEW_DEVICE",
+                "level": "INFO",
+                "message": alert_msg
+            }))
+        return new_dev
+
+    def _come_back(self, db, device: Device, ip: str, now: datetime.datetime, events: List[tuple]):
+        """Alertas y notificaciones de un dispositivo que vuelve a Online"""
+        # La alerta OFFLINE abierta se cierra con la duración de la caída
+        resolve_alert_rows(db, device.id, ("device_offline",), now)
+        alert_msg = f"Dispositivo ha vuelto: {device.hostname or device.ip}"
+        new_alert = Alert(
+            device_id=device.id,
+            type="REAPPEARED",
+            condition="device_online",
+            level="INFO",
+            message=alert_msg,
+            device_name=device.hostname or device.ip,
+            device_ip=ip
+        )
+        db.add(new_alert)
+        self._notify("Dispositivo en Red", alert_msg)
+
+        # Alerta con AlertManager (tras el commit)
+        events.append(('online', device_dict(device, ip, 'Online')))
+
+    def _update_known(
+        self,
+        db,
+        device: Device,
+        d: Dict[str, str],
+        now: datetime.datetime,
+        events: List[tuple],
+        names: Dict[str, str]
+    ) -> bool:
+        """
+        Actualiza un dispositivo conocido. True si estaba Offline y se
+        confirma que ha vuelto (si está oscilando sigue Offline).
+        """
+        was_offline = device.status == "Offline"
+        reappeared = self.states.seen(device.id, device.status, now)
+        if reappeared:
+            self._come_back(db, device, d['ip'], now, events)
+
+        if not device.hostname or device.hostname == "Unknown" or device.hostname == "":
+            # mDNS o lo resuelto antes de la transacción (_resolve_names)
+            device.hostname = self.hostname_cache.get(d['ip']) or names.get(d['ip']) or device.hostname
+
+        if not device.vendor or device.vendor == "Unknown Vendor":
+            device.vendor = self.get_vendor(d['mac'])
+            device.device_type = guess_device_type(device.vendor, device.hostname)
+
+        if device.hostname == "Unknown" and device.vendor != "Unknown Vendor":
+            device.hostname = f"Dispositivo {device.vendor}"
+
+        if reappeared or not was_offline:
+            device.status = "Online"
+        device.ip = d['ip']
+        device.last_seen = now
+        if reappeared and self.track_detected_at:
+            device.detected_at = now
+        return reappeared
+
+    def _mark_offline(
+        self,
+        db,
+        now: datetime.datetime,
+        settled: Optional[List[Device]],
+        events: List[tuple]
+    ) -> int:
+        # Candidatos en memoria (sin recorrer la tabla): sin señal de ninguna
+        # fuente dentro de su timeout y aún no confirmados Offline
+        expired = self.liveness.expired(now)
+        self.states.reset_misses(expired)
+        candidates = []
+        for chunk in chunked(expired, MAC_LOOKUP_CHUNK):
+            candidates.extend(db.query(Device).filter(Device.id.in_(chunk)).all())
+
+        offline_devices = []
+        for dev in candidates:
+            if dev.status == "Online":
+                # Solo los que la máquina de estados confirma (histéresis / oscilación)
+                if self.states.missed(dev.id, dev.status, now):
+                    offline_devices.append(dev)
+                continue
+            if dev.status == "Offline":
+                # Retenido en Offline por oscilación: también cuentan las ausencias
+                self.states.missed(dev.id, dev.status, now)
+            if not self.states.is_damped(dev.id):
+                self.liveness.mark_down([dev.id])
+        offline_devices += [dev for dev in settled or () if dev.status != "Offline"]
+        self.liveness.mark_down(dev.id for dev in offline_devices)
+        if self.alert_manager:
+            self.alert_manager.mark_down(dev.id for dev in offline_devices)
+
+        for dev in offline_devices:
+            dev.status = "Offline"
+            # Hijo de un switch/AP/puerta de enlace caído: se registra la alerta,
+            # pero sin notificación de escritorio (AlertManager tampoco notifica)
+            device_data = device_dict(dev, dev.ip, 'Offline')
+            suppressed_by = self.alert_manager.upstream_down(device_data) if self.alert_manager else None
+            alert_msg = f"Dispositivo desconectado: {dev.hostname or dev.ip}"
+            new_alert = Alert(
+                device_id=dev.id,
+                type="OFFLINE",
+                condition="device_offline",
+                level="WARNING",
+                message=alert_msg,
+                device_name=dev.hostname or dev.ip,
+                device_ip=dev.ip,
+                alert_metadata={"suppressed_by": suppressed_by} if suppressed_by else None
+            )
+            db.add(new_alert)
+            if suppressed_by is None:
+                self._notify("Dispositivo Offline", alert_msg)
+
+            # Alerta con AlertManager (tras el commit)
+            events.append(('offline', device_data))
+        return len(offline_devices)
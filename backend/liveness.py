@@ -0,0 +1,200 @@
+"""
+Motor de presencia: cuándo se supo por última vez de cada dispositivo.
+
+Combina varias fuentes de evidencia, cada una con un peso:
+- arp: el dispositivo respondió al escaneo ARP
+- passive: tráfico visto sin preguntar (anuncios mDNS)
+- icmp: un sensor PING obtuvo respuesta
+- tcp: un sensor PORT/HTTP conectó
+- snmp: un sensor SNMP obtuvo respuesta del agente
+
+Una señal de la fuente s mantiene vivo al dispositivo durante
+peso(s) x timeout(clase) segundos, donde la clase es su device_type (un
+móvil que duerme el Wi-Fi aguanta más que un router). La tabla vive en
+memoria (un array pequeño por dispositivo) y se siembra con last_seen de la
+BD, así que decidir quién ha caducado no consulta la BD en cada escaneo.
+"""
+import datetime
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+SOURCES = ("arp", "passive", "icmp", "tcp", "snmp")
+_SOURCE_INDEX = {name: i for i, name in enumerate(SOURCES)}
+
+DEFAULT_TIMEOUT = float(os.getenv("CRC_OFFLINE_AFTER_SECONDS", "300"))
+
+DEFAULT_WEIGHTS = {"arp": 1.0, "passive": 0.5, "icmp": 1.0, "tcp": 1.0, "snmp": 1.0}
+DEFAULT_CLASS_TIMEOUTS = {
+    "Router/Network": 180.0,
+    "Mobile/Tablet": 600.0,
+    "Printer": 600.0
+}
+
+# Sensor -> (fuente, ¿la lectura demuestra que el equipo responde?)
+SENSOR_SOURCES = {
+    "PING": ("icmp", lambda m: m.get("ping_packet_loss", 100) < 100),
+    "PORT": ("tcp", lambda m: m.get("open_ports_count", 0) > 0),
+    "HTTP": ("tcp", lambda m: m.get("http_status_code", 0) > 0),
+    "SNMP": ("snmp", lambda m: m.get("snmp_available", 0) > 0)
+}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _parse_pairs(raw: str) -> Dict[str, float]:
+    """'Mobile/Tablet=900,Printer=1200' -> {'Mobile/Tablet': 900.0, ...}"""
+    pairs = {}
+    for item in (raw or "").split(","):
+        if "=" in item:
+            key, value = item.rsplit("=", 1)
+            pairs[key.strip()] = float(value)
+    return pairs
+
+
+WEIGHTS = {**DEFAULT_WEIGHTS, **_parse_pairs(os.getenv("CRC_LIVENESS_WEIGHTS", ""))}
+CLASS_TIMEOUTS = {**DEFAULT_CLASS_TIMEOUTS, **_parse_pairs(os.getenv("CRC_LIVENESS_TIMEOUTS", ""))}
+
+
+def _ts(when: Optional[datetime.datetime]) -> float:
+    """Datetime UTC naive (como last_seen) a segundos"""
+    return ((when or datetime.datetime.utcnow()) - _EPOCH).total_seconds()
+
+
+class LivenessEntry:
+    __slots__ = ("timeout", "heard", "expires")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.heard = array("d", [0.0] * len(SOURCES))
+        self.expires = 0.0
+
+
+class LivenessTable:
+    """Última señal por dispositivo y fuente"""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        class_timeouts: Optional[Dict[str, float]] = None,
+        default_timeout: float = DEFAULT_TIMEOUT
+    ):
+        weights = WEIGHTS if weights is None else {**DEFAULT_WEIGHTS, **weights}
+        self.weights = array("d", [weights.get(name, 1.0) for name in SOURCES])
+        self.class_timeouts = CLASS_TIMEOUTS if class_timeouts is None else class_timeouts
+        self.default_timeout = default_timeout
+        self.entries: Dict[int, LivenessEntry] = {}
+        self.ip_index: Dict[str, int] = {}
+        # Confirmados Offline: no se vuelven a proponer hasta que den señal
+        self.down = set()
+        self.seeded = False
+        self._lock = threading.Lock()
+
+    def _timeout(self, device_type: Optional[str]) -> float:
+        return self.class_timeouts.get(device_type or "Unknown", self.default_timeout)
+
+    def _entry(self, device_id: int, device_type: Optional[str] = None) -> LivenessEntry:
+        entry = self.entries.get(device_id)
+        if entry is None:
+            entry = self.entries[device_id] = LivenessEntry(self._timeout(device_type))
+        elif device_type is not None:
+            entry.timeout = self._timeout(device_type)
+        return entry
+
+    def _refresh(self, entry: LivenessEntry):
+        entry.expires = max(
+            (heard + weight * entry.timeout for heard, weight in zip(entry.heard, self.weights) if heard),
+            default=0.0
+        )
+
+    def seed(self, db):
+        """Carga last_seen, device_type, IP y estado de todos los dispositivos"""
+        from database import Device
+
+        rows = db.query(Device.id, Device.ip, Device.device_type, Device.last_seen, Device.status).all()
+        with self._lock:
+            for device_id, ip, device_type, last_seen, status in rows:
+                fresh = device_id in self.entries
+                entry = self._entry(device_id, device_type)
+                if last_seen is not None:
+                    # Lo oído desde el arranque prevalece
+                    entry.heard[0] = max(entry.heard[0], _ts(last_seen))
+                    self._refresh(entry)
+                if ip:
+                    self.ip_index[ip] = device_id
+                if status == "Offline" and not fresh:
+                    self.down.add(device_id)
+            self.seeded = True
+
+    def heard(
+        self,
+        device_id: int,
+        source: str,
+        when: Optional[datetime.datetime] = None,
+        ip: Optional[str] = None,
+        device_type: Optional[str] = None
+    ):
+        """Registra una señal de vida del dispositivo"""
+        index = _SOURCE_INDEX[source]
+        ts = _ts(when)
+        with self._lock:
+            entry = self._entry(device_id, device_type)
+            if ts > entry.heard[index]:
+                entry.heard[index] = ts
+                self._refresh(entry)
+            self.down.discard(device_id)
+            if ip:
+                self.ip_index[ip] = device_id
+
+    def heard_ip(self, ip: str, source: str, when: Optional[datetime.datetime] = None) -> bool:
+        """Señal de una IP (p.ej. anuncio mDNS); False si no es de un dispositivo conocido"""
+        device_id = self.ip_index.get(ip)
+        if device_id is None:
+            return False
+        self.heard(device_id, source, when)
+        return True
+
+    def heard_sensor(self, device_id: int, sensor_type: str, metrics: Dict, when: Optional[datetime.datetime] = None):
+        """Cuenta la lectura de un sensor como señal si demuestra que el equipo responde"""
+        source = SENSOR_SOURCES.get((sensor_type or "").upper())
+        if source and source[1](metrics):
+            self.heard(device_id, source[0], when)
+
+    def is_alive(self, device_id: int, now: Optional[datetime.datetime] = None) -> bool:
+        entry = self.entries.get(device_id)
+        return entry is not None and entry.expires > _ts(now)
+
+    def expired(self, now: Optional[datetime.datetime] = None) -> List[int]:
+        """Dispositivos sin señal válida que aún no se han confirmado Offline"""
+        ts = _ts(now)
+        with self._lock:
+            return [
+                device_id for device_id, entry in self.entries.items()
+                if entry.expires <= ts and device_id not in self.down
+            ]
+
+    def mark_down(self, device_ids: Iterable[int]):
+        with self._lock:
+            self.down.update(device_ids)
+
+    def forget(self, device_id: int):
+        with self._lock:
+            self.entries.pop(device_id, None)
+            self.down.discard(device_id)
+
+    def snapshot(self, device_id: int) -> Optional[Dict]:
+        """Última señal por fuente (ISO) y hasta cuándo se considera vivo"""
+        entry = self.entries.get(device_id)
+        if entry is None:
+            return None
+
+        def iso(ts: float):
+            return (_EPOCH + datetime.timedelta(seconds=ts)).isoformat() if ts else None
+
+        return {
+            "timeout_seconds": entry.timeout,
+            "heard": {name: iso(entry.heard[i]) for i, name in enumerate(SOURCES)},
+            "alive_until": iso(entry.expires),
+            "confirmed_down": device_id in self.down
+        }
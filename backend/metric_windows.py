@@ -0,0 +1,150 @@
+"""
+Agregados incrementales sobre ventanas deslizantes de tiempo.
+
+Cada RollingWindow mantiene suma y cuenta acumuladas y dos colas monótonas
+para el máximo y el mínimo, de modo que añadir una muestra y consultar
+avg/min/max/sum/count cuesta O(1) amortizado, sin volver a recorrer la
+ventana ni consultar metrics_history. Los percentiles (p50, p95, p99...)
+usan además una lista ordenada que solo se mantiene en las ventanas que
+los necesitan.
+
+La memoria está acotada: cada ventana guarda como mucho MAX_WINDOW_SAMPLES
+muestras (las más antiguas salen antes de tiempo) y WindowStore.prune()
+libera las series que se han quedado vacías.
+"""
+import bisect
+import collections
+import os
+import re
+import time
+from typing import Dict, Hashable, Optional
+
+AGGREGATIONS = ("avg", "min", "max", "sum", "count")
+MAX_WINDOW_SAMPLES = int(os.getenv("CRC_METRIC_WINDOW_MAX_SAMPLES", "1000"))
+
+_PERCENTILE = re.compile(r"^p(\d{1,2}(\.\d+)?)$")
+
+
+def percentile_of(name: str) -> Optional[float]:
+    """'p95' -> 95.0; None si no es un percentil"""
+    match = _PERCENTILE.match(name or "")
+    return float(match.group(1)) if match else None
+
+
+def is_valid_aggregation(name: str) -> bool:
+    return name in AGGREGATIONS or percentile_of(name) is not None
+
+
+class RollingWindow:
+    """Muestras de los últimos `seconds` segundos de una serie"""
+
+    __slots__ = ("seconds", "max_samples", "samples", "total", "max_queue", "min_queue", "ordered", "_seq")
+
+    def __init__(self, seconds: float, quantiles: bool = False, max_samples: int = MAX_WINDOW_SAMPLES):
+        self.seconds = seconds
+        self.max_samples = max_samples
+        self.samples = collections.deque()    # (seq, ts, valor)
+        self.max_queue = collections.deque()  # (seq, valor) decreciente
+        self.min_queue = collections.deque()  # (seq, valor) creciente
+        self.ordered = [] if quantiles else None
+        self.total = 0.0
+        self._seq = 0
+
+    def enable_quantiles(self):
+        if self.ordered is None:
+            self.ordered = sorted(value for _, _, value in self.samples)
+
+    def add(self, value: float, ts: Optional[float] = None):
+        ts = time.monotonic() if ts is None else ts
+        self._seq += 1
+        self.samples.append((self._seq, ts, value))
+        self.total += value
+        while self.max_queue and self.max_queue[-1][1] <= value:
+            self.max_queue.pop()
+        self.max_queue.append((self._seq, value))
+        while self.min_queue and self.min_queue[-1][1] >= value:
+            self.min_queue.pop()
+        self.min_queue.append((self._seq, value))
+        if self.ordered is not None:
+            bisect.insort(self.ordered, value)
+        self.evict(ts)
+
+    def _pop_oldest(self):
+        seq, _, value = self.samples.popleft()
+        self.total -= value
+        if self.max_queue and self.max_queue[0][0] == seq:
+            self.max_queue.popleft()
+        if self.min_queue and self.min_queue[0][0] == seq:
+            self.min_queue.popleft()
+        if self.ordered is not None:
+            del self.ordered[bisect.bisect_left(self.ordered, value)]
+
+    def evict(self, now: Optional[float] = None):
+        """Descarta las muestras que han salido de la ventana o exceden el máximo"""
+        cutoff = (time.monotonic() if now is None else now) - self.seconds
+        while self.samples and (self.samples[0][1] <= cutoff or len(self.samples) > self.max_samples):
+            self._pop_oldest()
+        if not self.samples:
+            # Sin muestras la suma vuelve a 0 exacto (sin error de coma flotante acumulado)
+            self.total = 0.0
+
+    def aggregate(self, name: str) -> Optional[float]:
+        """avg, min, max, sum, count o pNN; None si la ventana está vacía"""
+        if name == "count":
+            return float(len(self.samples))
+        if not self.samples:
+            return None
+        if name == "avg":
+            return self.total / len(self.samples)
+        if name == "sum":
+            return self.total
+        if name == "max":
+            return self.max_queue[0][1]
+        if name == "min":
+            return self.min_queue[0][1]
+        pct = percentile_of(name)
+        if pct is None:
+            raise ValueError(f"Agregación no soportada: {name}")
+        self.enable_quantiles()
+        # Percentil por el método del rango más cercano
+        rank = max(int(-(-pct * len(self.ordered) // 100)), 1)
+        return self.ordered[min(rank, len(self.ordered)) - 1]
+
+
+class WindowStore:
+    """Ventanas por clave (p.ej. (device_id, métrica, segundos))"""
+
+    def __init__(self, max_samples: int = MAX_WINDOW_SAMPLES):
+        self.max_samples = max_samples
+        self.windows: Dict[Hashable, RollingWindow] = {}
+
+    def observe(
+        self,
+        key: Hashable,
+        value: float,
+        seconds: float,
+        ts: Optional[float] = None,
+        quantiles: bool = False
+    ) -> RollingWindow:
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = RollingWindow(seconds, quantiles, self.max_samples)
+        elif quantiles:
+            window.enable_quantiles()
+        window.add(value, ts)
+        return window
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Libera las ventanas sin muestras recientes; devuelve cuántas"""
+        empty = []
+        for key, window in self.windows.items():
+            window.evict(now)
+            if not window.samples:
+                empty.append(key)
+        for key in empty:
+            del self.windows[key]
+        return len(empty)
+
+    def sample_count(self) -> int:
+        # Copia: se llama desde el hilo de /metrics mientras el colector añade series
+        return sum(len(window.samples) for window in list(self.windows.values()))
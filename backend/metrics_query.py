@@ -0,0 +1,297 @@
+"""
+Consultas de métricas históricas con reducción de puntos en el servidor.
+
+En lugar de devolver todas las muestras crudas, se agrupan en cubos de
+tiempo directamente en SQL (min/avg/max/last por cubo) o se reducen con
+LTTB, de modo que el tamaño de la respuesta depende del ancho del gráfico
+y no del número de muestras almacenadas.
+"""
+import datetime
+import math
+from typing import Dict, List, Optional
+
+from sqlalchemy import Integer, cast, func, select
+
+from database import MetricHistory
+
+# Límite superior de puntos por métrica que puede pedir un cliente
+MAX_POINTS = 5000
+
+# SQLite limita el número de parámetros por sentencia
+_IN_CHUNK = 500
+
+
+def epoch_seconds(column, dialect_name: str):
+    """Expresión SQL que convierte un DateTime a segundos epoch (entero)"""
+    if dialect_name == "postgresql":
+        return cast(func.extract("epoch", column), Integer)
+    return cast(func.strftime("%s", column), Integer)
+
+
+def resolve_step(
+    since: datetime.datetime,
+    until: datetime.datetime,
+    points: Optional[int] = None,
+    step: Optional[int] = None
+) -> int:
+    """Calcula el tamaño del cubo en segundos a partir de `step` o `points`"""
+    if step:
+        step = int(step)
+    else:
+        span = max(1.0, (until - since).total_seconds())
+        step = int(math.ceil(span / max(1, points or MAX_POINTS)))
+
+    # Nunca más de MAX_POINTS cubos por métrica
+    span = max(1.0, (until - since).total_seconds())
+    return max(1, step, int(math.ceil(span / MAX_POINTS)))
+
+
+def build_bucket_query(
+    device_id: int,
+    since: datetime.datetime,
+    step: int,
+    dialect_name: str,
+    metric_name: Optional[str] = None
+):
+    """
+    Construye la consulta agregada por (métrica, cubo).
+    El último valor de cada cubo se resuelve con max(id), ya que las
+    muestras se insertan en orden cronológico.
+    """
+    ts = epoch_seconds(MetricHistory.timestamp, dialect_name)
+    bucket = (ts - (ts % step)).label("bucket")
+
+    stmt = select(
+        MetricHistory.metric_name,
+        bucket,
+        func.min(MetricHistory.value).label("min_value"),
+        func.avg(MetricHistory.value).label("avg_value"),
+        func.max(MetricHistory.value).label("max_value"),
+        func.count(MetricHistory.id).label("count"),
+        func.max(MetricHistory.id).label("last_id"),
+        func.max(MetricHistory.unit).label("unit")
+    ).where(
+        MetricHistory.device_id == device_id,
+        MetricHistory.timestamp >= since
+    )
+
+    if metric_name:
+        stmt = stmt.where(MetricHistory.metric_name == metric_name)
+
+    return stmt.group_by(MetricHistory.metric_name, bucket).order_by(bucket)
+
+
+def build_last_values_query(ids: List[int]):
+    """Consulta los valores de las filas indicadas (último valor por cubo)"""
+    return select(MetricHistory.id, MetricHistory.value).where(MetricHistory.id.in_(ids))
+
+
+def build_raw_query(device_id: int, since: datetime.datetime, metric_name: Optional[str] = None):
+    """Consulta columnar de muestras crudas (sin cargar objetos ORM)"""
+    stmt = select(
+        MetricHistory.metric_name,
+        MetricHistory.timestamp,
+        MetricHistory.value,
+        MetricHistory.unit
+    ).where(
+        MetricHistory.device_id == device_id,
+        MetricHistory.timestamp >= since
+    )
+
+    if metric_name:
+        stmt = stmt.where(MetricHistory.metric_name == metric_name)
+
+    return stmt.order_by(MetricHistory.timestamp.asc())
+
+
+def format_buckets(rows, last_values: Dict[int, float]) -> List[Dict]:
+    """Convierte las filas agregadas en la respuesta de la API"""
+    data = []
+    for r in rows:
+        data.append({
+            "timestamp": datetime.datetime.utcfromtimestamp(r.bucket).isoformat(),
+            "metric_name": r.metric_name,
+            "value": r.avg_value,
+            "min": r.min_value,
+            "max": r.max_value,
+            "last": last_values.get(r.last_id),
+            "count": r.count,
+            "unit": r.unit
+        })
+    return data
+
+
+def chunked(items: List, size: int = _IN_CHUNK):
+    """Divide una lista en trozos para respetar el límite de parámetros"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bucketed_metrics(
+    db,
+    device_id: int,
+    since: datetime.datetime,
+    step: int,
+    metric_name: Optional[str] = None
+) -> List[Dict]:
+    """Métricas agrupadas en cubos de `step` segundos (min/avg/max/last)"""
+    dialect_name = db.get_bind().dialect.name
+    rows = db.execute(build_bucket_query(device_id, since, step, dialect_name, metric_name)).all()
+
+    last_values = {}
+    for ids in chunked([r.last_id for r in rows]):
+        last_values.update(db.execute(build_last_values_query(ids)).all())
+
+    return format_buckets(rows, last_values)
+
+
+def lttb(points: List[tuple], threshold: int) -> List[tuple]:
+    """
+    Largest-Triangle-Three-Buckets sobre una lista de (x, y) ordenada por x.
+    Conserva la forma visual de la serie con `threshold` puntos.
+    """
+    n = len(points)
+    if threshold >= n:
+        return list(points)
+    if threshold < 3:
+        # Sin cubos intermedios: solo los extremos
+        return [points[0], points[-1]][:max(threshold, 0)]
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Media del siguiente cubo (tercer vértice del triángulo)
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(p[0] for p in points[avg_start:avg_end]) / avg_len
+        avg_y = sum(p[1] for p in points[avg_start:avg_end]) / avg_len
+
+        # Punto del cubo actual que forma el triángulo de mayor área
+        range_start = int(math.floor(i * every)) + 1
+        range_end = int(math.floor((i + 1) * every)) + 1
+        ax, ay = points[a][0], points[a][1]
+
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+
+        sampled.append(points[next_a])
+        a = next_a
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def downsample_rows(rows, points: int) -> List[Dict]:
+    """Aplica LTTB por métrica sobre filas crudas (metric_name, timestamp, value, unit)"""
+    series: Dict[str, List[tuple]] = {}
+    units: Dict[str, str] = {}
+    for r in rows:
+        if r.value is None:
+            continue
+        series.setdefault(r.metric_name, []).append((r.timestamp.timestamp(), r.value, r.timestamp))
+        units[r.metric_name] = r.unit
+
+    data = []
+    for name, values in series.items():
+        for x, y, ts in lttb(values, points):
+            data.append({
+                "timestamp": ts.isoformat(),
+                "metric_name": name,
+                "value": y,
+                "unit": units.get(name)
+            })
+
+    data.sort(key=lambda d: d["timestamp"])
+    return data
+
+
+def lttb_metrics(
+    db,
+    device_id: int,
+    since: datetime.datetime,
+    points: int,
+    metric_name: Optional[str] = None
+) -> List[Dict]:
+    """Métricas reducidas con LTTB a `points` puntos por métrica"""
+    rows = db.execute(build_raw_query(device_id, since, metric_name)).all()
+    return downsample_rows(rows, points)
+
+
+BATCH_AGGREGATIONS = ("avg", "min", "max")
+
+
+def build_batch_query(
+    device_ids: List[int],
+    metric_name: str,
+    since: datetime.datetime,
+    step: int,
+    dialect_name: str,
+    agg: str = "avg"
+):
+    """Una sola consulta agrupada por (cubo, dispositivo) para varios dispositivos"""
+    ts = epoch_seconds(MetricHistory.timestamp, dialect_name)
+    bucket = (ts - (ts % step)).label("bucket")
+    agg_func = getattr(func, agg if agg in BATCH_AGGREGATIONS else "avg")
+
+    return select(
+        bucket,
+        MetricHistory.device_id,
+        agg_func(MetricHistory.value).label("value")
+    ).where(
+        MetricHistory.device_id.in_(device_ids),
+        MetricHistory.metric_name == metric_name,
+        MetricHistory.timestamp >= since
+    ).group_by(bucket, MetricHistory.device_id).order_by(bucket)
+
+
+def to_columnar(rows, device_ids: List[int]) -> Dict:
+    """
+    Convierte filas (bucket, device_id, value) en arrays columnares:
+    una lista de timestamps y una lista de valores alineada por dispositivo.
+    """
+    timestamps: List[int] = []
+    series: Dict[int, List[Optional[float]]] = {dev_id: [] for dev_id in device_ids}
+
+    for bucket, dev_id, value in rows:
+        if not timestamps or timestamps[-1] != bucket:
+            timestamps.append(bucket)
+            for values in series.values():
+                values.append(None)
+        if dev_id in series:
+            series[dev_id][-1] = value
+
+    return {
+        "timestamps": [datetime.datetime.utcfromtimestamp(t).isoformat() for t in timestamps],
+        "series": {str(dev_id): values for dev_id, values in series.items()}
+    }
+
+
+def batch_metrics(
+    db,
+    device_ids: List[int],
+    metric_name: str,
+    since: datetime.datetime,
+    step: int,
+    agg: str = "avg"
+) -> Dict:
+    """Métrica de varios dispositivos en formato columnar (un solo escaneo)"""
+    if not device_ids:
+        return {"timestamps": [], "series": {}}
+
+    dialect_name = db.get_bind().dialect.name
+    rows = []
+    for ids in chunked(list(device_ids)):
+        rows.extend(db.execute(build_batch_query(ids, metric_name, since, step, dialect_name, agg)).all())
+
+    if len(device_ids) > _IN_CHUNK:
+        rows.sort(key=lambda r: r[0])
+
+    return to_columnar(rows, device_ids)
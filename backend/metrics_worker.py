@@ -1,27 +1,93 @@
 """
 Workers para recolección continua de métricas en background.
+
+Los sensores se leen en el loop de asyncio, pero todo lo que toca la base de
+datos va a un único hilo de escritura (MetricsCollector.writer): con SQLite
+el pool de escritura tiene una sola conexión y esperar turno en el loop
+congelaría la API mientras el escáner la tiene ocupada. Un solo hilo además
+evalúa las reglas de métricas de una en una, como antes.
 """
 import asyncio
 import logging
 import datetime
-from typing import List
-from database import SessionLocal, Device, Sensor, MetricHistory
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from database import SessionLocal, ReadSessionLocal, Device, Sensor, MetricHistory, Alert
 from sensors import create_sensor
+from inventory import device_dict
+from instrumentation import SENSOR_COLLECTION, SENSOR_BACKLOG
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def alert_row(alert) -> Alert:
+    """Fila de la tabla alerts para una alerta de AlertManager"""
+    return Alert(
+        device_id=alert.device_id,
+        type=alert.condition.value.upper(),
+        condition=alert.condition.value,
+        level=alert.level.value.upper(),
+        message=alert.message,
+        device_name=alert.device_name,
+        device_ip=alert.device_ip,
+        alert_metadata=alert.alert_metadata,
+        timestamp=alert.timestamp
+    )
+
+
 class MetricsCollector:
     """Recolector de métricas en background"""
     
-    def __init__(self):
+    def __init__(self, on_metric: Optional[Callable[[Dict, Dict[str, float]], List]] = None, liveness=None):
+        """
+        on_metric(dispositivo, métricas) se llama con cada lote recogido antes
+        de guardarlo (p.ej. AlertManager.process_metric) y devuelve las
+        alertas disparadas y las resueltas, que se guardan en la misma
+        transacción. Las respuestas de ping/puertos/HTTP cuentan además como
+        señal de vida en `liveness` (LivenessTable).
+        """
         self.running = False
         self.tasks = []
+        self.on_metric = on_metric
+        self.liveness = liveness
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-writer")
+
+    def _evaluate(self, db, device_info: Dict, metrics: Dict[str, float]) -> List[tuple]:
+        """Evalúa las reglas de métricas; un fallo aquí no impide guardar las muestras"""
+        if not self.on_metric:
+            return []
+        try:
+            fired = self.on_metric(device_info, metrics)
+        except Exception as e:
+            logger.error(f"Error evaluando reglas de métricas (device {device_info.get('id')}): {e}")
+            return []
+        rows = []
+        for alert in fired:
+            if alert.resolved_at is not None:
+                # Resuelta por esta muestra: se cierra su fila si llegó a guardarse
+                if alert.id is not None:
+                    db.query(Alert).filter(Alert.id == alert.id).update({
+                        Alert.resolved_at: alert.resolved_at,
+                        Alert.duration_seconds: alert.duration_seconds
+                    }, synchronize_session=False)
+                continue
+            row = alert_row(alert)
+            db.add(row)
+            rows.append((alert, row))
+        return rows
     
-    async def collect_device_metrics(self, device_id: int, device_ip: str, sensors: List[Sensor]):
+    async def collect_device_metrics(
+        self,
+        device_id: int,
+        device_ip: str,
+        sensors: List[Sensor],
+        device_info: Optional[Dict] = None
+    ):
         """Recolecta métricas de todos los sensores de un dispositivo"""
-        db = SessionLocal()
+        device_info = device_info or {'id': device_id, 'ip': device_ip}
+        loop = asyncio.get_running_loop()
+        SENSOR_BACKLOG.inc()
         try:
             for sensor in sensors:
                 if not sensor.enabled:
@@ -36,34 +102,90 @@ class MetricsCollector:
                     )
                     
                     # Recolectar métricas
-                    metrics = await sensor_instance.collect()
-                    
-                    # Guardar en base de datos
-                    timestamp = datetime.datetime.utcnow()
-                    for metric_name, value in metrics.items():
-                        metric = MetricHistory(
-                            device_id=device_id,
-                            sensor_id=sensor.id,
-                            metric_name=metric_name,
-                            value=value,
-                            unit=self._get_unit(metric_name),
-                            timestamp=timestamp
-                        )
-                        db.add(metric)
-                    
-                    # Actualizar estado del sensor
-                    sensor.last_run = timestamp
-                    sensor.status = sensor_instance.status
-                    
-                    db.commit()
-                    logger.info(f"Métricas recolectadas para sensor {sensor.name} (device {device_id})")
-                    
+                    with SENSOR_COLLECTION.labels(sensor.sensor_type).time():
+                        metrics = await sensor_instance.collect()
                 except Exception as e:
                     logger.error(f"Error recolectando métricas de sensor {sensor.id}: {e}")
-                    db.rollback()
+                    continue
+                
+                # Guardar en base de datos (en el hilo de escritura)
+                await loop.run_in_executor(
+                    self.writer, self._store_sensor_metrics,
+                    device_info, sensor, metrics, sensor_instance.status
+                )
+        finally:
+            SENSOR_BACKLOG.dec()
+
+    def _store_sensor_metrics(self, device_info: Dict, sensor: Sensor, metrics: Dict[str, float], status: str):
+        """Guarda las muestras de un sensor y las alertas que disparan, en una transacción"""
+        device_id = device_info['id']
+        db = SessionLocal()
+        try:
+            timestamp = datetime.datetime.utcnow()
+            if self.liveness is not None:
+                self.liveness.heard_sensor(device_id, sensor.sensor_type, metrics, timestamp)
+            self._add_rows(db, device_id, sensor.id, metrics, timestamp)
+            
+            # Reglas de umbral en streaming, en la misma transacción
+            fired = self._evaluate(db, device_info, metrics)
+            
+            # Actualizar estado del sensor (el objeto viene de otra sesión, ya cerrada)
+            db.query(Sensor).filter(Sensor.id == sensor.id).update({
+                Sensor.last_run: timestamp,
+                Sensor.status: status
+            }, synchronize_session=False)
+            
+            db.commit()
+            for alert, row in fired:
+                alert.id = row.id
+            logger.info(f"Métricas recolectadas para sensor {sensor.name} (device {device_id})")
+            
+        except Exception as e:
+            logger.error(f"Error guardando métricas de sensor {sensor.id}: {e}")
+            db.rollback()
         finally:
             db.close()
     
+    def _add_rows(self, db, device_id: int, sensor_id: Optional[int], metrics: Dict[str, float], timestamp):
+        for metric_name, value in metrics.items():
+            db.add(MetricHistory(
+                device_id=device_id,
+                sensor_id=sensor_id,
+                metric_name=metric_name,
+                value=value,
+                unit=self._get_unit(metric_name),
+                timestamp=timestamp
+            ))
+
+    def record_metrics(self, device_ip: str, metrics: Dict[str, float]) -> bool:
+        """
+        Guarda métricas que no vienen de un sensor (p.ej. las interfaces SNMP
+        del router) para el dispositivo con esa IP, evaluando también las
+        reglas. False si la IP no es de ningún dispositivo conocido.
+        """
+        db = SessionLocal()
+        try:
+            device = db.query(Device).filter(Device.ip == device_ip).first()
+            if device is None:
+                return False
+            timestamp = datetime.datetime.utcnow()
+            self._add_rows(db, device.id, None, metrics, timestamp)
+            fired = self._evaluate(db, device_dict(device, device.ip, device.status), metrics)
+            db.commit()
+            for alert, row in fired:
+                alert.id = row.id
+            return True
+        except Exception as e:
+            logger.error(f"Error guardando métricas de {device_ip}: {e}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def submit_metrics(self, device_ip: str, metrics: Dict[str, float]):
+        """record_metrics en el hilo de escritura, sin esperar (para llamarlo desde el loop)"""
+        self.writer.submit(self.record_metrics, device_ip, metrics)
+
     def _get_unit(self, metric_name: str) -> str:
         """Determina la unidad de medida según el nombre de la métrica"""
         units = {
@@ -79,7 +201,9 @@ class MetricsCollector:
             'temperature': '°C',
             'count': '#',
             'status_code': '#',
-            'available': 'bool'
+            'available': 'bool',
+            'reused': 'bool',
+            '_ms': 'ms'
         }
         
         for key, unit in units.items():
@@ -92,32 +216,42 @@ class MetricsCollector:
         """Loop principal de recolección"""
         logger.info("Iniciando loop de recolección de métricas...")
         
+        loop = asyncio.get_running_loop()
         while self.running:
-            db = SessionLocal()
             try:
-                # Obtener todos los dispositivos online con sensores activos
-                devices = db.query(Device).filter(Device.status == "Online").all()
-                
-                for device in devices:
-                    # Obtener sensores activos del dispositivo
-                    sensors = db.query(Sensor).filter(
-                        Sensor.device_id == device.id,
-                        Sensor.enabled == True
-                    ).all()
-                    
-                    if sensors:
-                        # Crear tarea asíncrona para recolectar métricas
-                        asyncio.create_task(
-                            self.collect_device_metrics(device.id, device.ip, sensors)
+                # Lectura en un hilo y con la conexión de solo lectura
+                targets = await loop.run_in_executor(None, self._load_targets)
+                for device_info, sensors in targets:
+                    # Crear tarea asíncrona para recolectar métricas
+                    asyncio.create_task(
+                        self.collect_device_metrics(
+                            device_info['id'], device_info['ip'], sensors, device_info
                         )
-                
+                    )
             except Exception as e:
                 logger.error(f"Error en loop de recolección: {e}")
-            finally:
-                db.close()
             
             # Esperar antes del próximo ciclo (60 segundos por defecto)
             await asyncio.sleep(60)
+
+    def _load_targets(self) -> List[tuple]:
+        """Dispositivos online con sensores activos: [(device_info, sensores)]"""
+        db = ReadSessionLocal()
+        try:
+            targets = []
+            # Obtener todos los dispositivos online con sensores activos
+            devices = db.query(Device).filter(Device.status == "Online").all()
+            for device in devices:
+                # Obtener sensores activos del dispositivo
+                sensors = db.query(Sensor).filter(
+                    Sensor.device_id == device.id,
+                    Sensor.enabled == True
+                ).all()
+                if sensors:
+                    targets.append((device_dict(device, device.ip, device.status), sensors))
+            return targets
+        finally:
+            db.close()
     
     async def start(self):
         """Inicia el recolector"""
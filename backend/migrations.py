@@ -0,0 +1,278 @@
+"""
+Migraciones de esquema versionadas.
+
+Sustituyen a los scripts sueltos (patch_db.py) y complementan a
+create_all(), que solo crea tablas nuevas y nunca altera las existentes.
+Cada migración se registra con @migration(version, descripción) y se
+aplica una sola vez; la versión aplicada queda en `schema_migrations`.
+
+Las migraciones normales se ejecutan al arrancar, antes de servir la API.
+Las marcadas como online=True (tablas grandes) se ejecutan después en un
+hilo aparte copiando por lotes y haciendo el swap al final, de modo que
+la aplicación sigue funcionando mientras tanto.
+"""
+import datetime
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+logger = logging.getLogger(__name__)
+
+# version -> (descripción, función, online)
+MIGRATIONS: Dict[int, tuple] = {}
+
+# Estado visible desde la API mientras corren las migraciones online
+MIGRATION_STATUS: Dict[str, object] = {
+    "current_version": None,
+    "running": None,
+    "progress": None,
+    "error": None
+}
+
+# Filas copiadas por transacción en copy_and_swap
+COPY_BATCH_SIZE = 20000
+
+
+def migration(version: int, description: str, online: bool = False):
+    """Registra una migración. La función recibe (bind, report)."""
+    def decorator(func: Callable):
+        if version in MIGRATIONS:
+            raise ValueError(f"Migración duplicada: {version}")
+        MIGRATIONS[version] = (description, func, online)
+        return func
+    return decorator
+
+
+def _ensure_version_table(bind):
+    with bind.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " description VARCHAR,"
+            " applied_at TIMESTAMP)"
+        ))
+
+
+def applied_versions(bind) -> List[int]:
+    """Versiones ya aplicadas"""
+    _ensure_version_table(bind)
+    with bind.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))]
+
+
+def _record(bind, version: int, description: str):
+    with bind.begin() as conn:
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+            {"v": version, "d": description, "t": datetime.datetime.utcnow()}
+        )
+
+
+def _log_progress(info: Dict):
+    """Reporte de progreso por defecto"""
+    MIGRATION_STATUS["progress"] = info
+    total = info.get("total")
+    done = info.get("done", 0)
+    if total:
+        logger.info(f"[MIGRATION {info.get('version')}] {info.get('step')}: {done}/{total} ({done * 100 // total}%)")
+    else:
+        logger.info(f"[MIGRATION {info.get('version')}] {info.get('step')}")
+
+
+def _apply(bind, version: int, progress: Callable):
+    description, func, _ = MIGRATIONS[version]
+    MIGRATION_STATUS["running"] = version
+
+    def report(step: str, done: int = 0, total: Optional[int] = None):
+        progress({"version": version, "description": description, "step": step, "done": done, "total": total})
+
+    logger.info(f"Aplicando migración {version}: {description}")
+    func(bind, report)
+    _record(bind, version, description)
+    MIGRATION_STATUS["current_version"] = version
+    MIGRATION_STATUS["running"] = None
+
+
+def run_migrations(bind=None, progress: Callable = _log_progress, include_online: bool = False) -> List[int]:
+    """
+    Aplica las migraciones pendientes en orden.
+    Las online se saltan salvo include_online=True (ver start_online_migrations).
+    """
+    if bind is None:
+        from database import engine as bind
+
+    done = set(applied_versions(bind))
+    applied = []
+    for version in sorted(MIGRATIONS):
+        if version in done:
+            continue
+        _, _, online = MIGRATIONS[version]
+        if online and not include_online:
+            continue
+        _apply(bind, version, progress)
+        applied.append(version)
+
+    if done or applied:
+        MIGRATION_STATUS["current_version"] = max(done | set(applied))
+    return applied
+
+
+def start_online_migrations(bind=None, progress: Callable = _log_progress) -> Optional[threading.Thread]:
+    """Lanza las migraciones online pendientes en un hilo en segundo plano"""
+    if bind is None:
+        from database import engine as bind
+
+    pending = [v for v in sorted(MIGRATIONS) if MIGRATIONS[v][2] and v not in set(applied_versions(bind))]
+    if not pending:
+        return None
+
+    def worker():
+        try:
+            run_migrations(bind, progress, include_online=True)
+        except Exception as e:
+            MIGRATION_STATUS["error"] = str(e)
+            MIGRATION_STATUS["running"] = None
+            logger.error(f"Error en migración online: {e}")
+
+    thread = threading.Thread(target=worker, daemon=True, name="online-migrations")
+    thread.start()
+    return thread
+
+
+# ============================================
+# HELPERS
+# ============================================
+
+def column_exists(bind, table: str, column: str) -> bool:
+    return column in [c["name"] for c in inspect(bind).get_columns(table)]
+
+
+def add_column(bind, table: str, column: str, ddl_type: str):
+    """ALTER TABLE ADD COLUMN idempotente"""
+    if column_exists(bind, table, column):
+        return
+    with bind.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def copy_and_swap(
+    bind,
+    table,
+    report: Callable,
+    create_new: Optional[Callable] = None,
+    batch_size: int = COPY_BATCH_SIZE
+):
+    """
+    Reconstruye una tabla grande sin bloquearla durante horas:
+      1. crea `<tabla>__new` (con create_new(conn, nombre) o a partir del modelo)
+      2. copia por lotes de id en transacciones cortas (los escritores siguen)
+      3. en una transacción corta copia las filas nuevas, borra la vieja y renombra
+      4. recrea los índices del modelo uno a uno
+    Pensado para tablas append-only con clave `id` creciente (metrics_history).
+    """
+    name = table.name
+    new_name = f"{name}__new"
+    columns = ", ".join(c.name for c in table.columns)
+
+    with bind.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+        if create_new:
+            create_new(conn, new_name)
+        else:
+            # Mismo DDL que el modelo, sin índices (se recrean tras el swap
+            # con sus nombres definitivos)
+            ddl = str(CreateTable(table).compile(dialect=bind.dialect))
+            conn.execute(text(ddl.replace(f"CREATE TABLE {name} ", f"CREATE TABLE {new_name} ", 1)))
+
+    with bind.connect() as conn:
+        total = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar() or 0
+        max_id = conn.execute(text(f"SELECT max(id) FROM {name}")).scalar() or 0
+
+    copied = 0
+    last_id = 0
+    report("copy", copied, total)
+    while last_id < max_id:
+        upper = last_id + batch_size
+        with bind.begin() as conn:
+            result = conn.execute(text(
+                f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {name} "
+                f"WHERE id > :lo AND id <= :hi"
+            ), {"lo": last_id, "hi": upper})
+            copied += max(result.rowcount or 0, 0)
+        last_id = upper
+        report("copy", min(copied, total), total)
+
+    # Swap: solo se copian las filas llegadas durante la copia. El límite es
+    # el último id copiado de verdad, no el tope del último lote (las filas
+    # escritas después con id por debajo de ese tope se perderían)
+    report("swap", copied, total)
+    with bind.begin() as conn:
+        copied_id = conn.execute(text(f"SELECT max(id) FROM {new_name}")).scalar() or 0
+        conn.execute(text(
+            f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {name} WHERE id > :lo"
+        ), {"lo": copied_id})
+        conn.execute(text(f"DROP TABLE {name}"))
+        conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {name}"))
+        if bind.dialect.name == "postgresql":
+            # La secuencia del id es la de la tabla nueva: continuar tras el último id
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                f"COALESCE((SELECT max(id) FROM {name}), 1))"
+            ))
+
+    indexes = list(table.indexes)
+    for i, index in enumerate(indexes):
+        report(f"index {index.name}", i, len(indexes))
+        with bind.begin() as conn:
+            index.create(bind=conn, checkfirst=True)
+    report("done", total, total)
+
+
+# ============================================
+# MIGRACIONES
+# ============================================
+
+@migration(1, "devices.detected_at (antes patch_db.py)")
+def _m001_detected_at(bind, report):
+    add_column(bind, "devices", "detected_at", "DATETIME")
+
+
+@migration(2, "Índices compuestos en metrics_history y alerts", online=True)
+def _m002_composite_indexes(bind, report):
+    from database import migrate_indexes
+    migrate_indexes(bind)
+
+
+@migration(3, "metrics_history como serie temporal particionada (PostgreSQL)", online=True)
+def _m003_partition_metrics(bind, report):
+    if bind.dialect.name != "postgresql":
+        report("skip: solo aplica a PostgreSQL")
+        return
+
+    from database import MetricHistory
+    from storage import is_partitioned, create_partitioned_metrics
+
+    with bind.connect() as conn:
+        if is_partitioned(conn, "metrics_history"):
+            report("skip: ya particionada")
+            return
+
+    copy_and_swap(bind, MetricHistory.__table__, report, create_new=create_partitioned_metrics)
+
+
+@migration(4, "devices.parent_id (correlación de alertas con el equipo aguas arriba)")
+def _m004_device_parent(bind, report):
+    add_column(bind, "devices", "parent_id", "INTEGER")
+
+
+@migration(5, "alert_rules.updated_at (recarga de reglas en caliente)")
+def _m005_rule_updated_at(bind, report):
+    add_column(bind, "alert_rules", "updated_at", "DATETIME")
+
+
+@migration(6, "alerts.duration_seconds (ciclo de vida de las alertas)")
+def _m006_alert_duration(bind, report):
+    add_column(bind, "alerts", "duration_seconds", "FLOAT")
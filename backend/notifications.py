@@ -0,0 +1,447 @@
+"""
+Envío de notificaciones externas (email, Telegram, webhook) fuera del hilo
+que genera las alertas.
+
+AlertManager.send_notification solo encola la alerta; cada canal tiene su
+propia cola y su grupo de hilos de envío, que:
+  - reutilizan conexiones: una requests.Session con pool por hilo y una
+    conexión SMTP persistente (STARTTLS + login una sola vez) que se reabre
+    si el servidor la cierra
+  - reintentan los fallos transitorios (red, 5xx, 429 respetando
+    Retry-After) con backoff exponencial y jitter
+  - guardan en notification_dead_letters lo que agota los reintentos, lo que
+    no tiene arreglo (4xx, credenciales) y lo que no cabe en la cola
+
+Modo resumen (digest): en los canales con ventana (CRC_DIGEST_WINDOW_*) la
+primera alerta de cada grupo (condición + grupo de dispositivos) sale al
+momento y abre una ventana; las que llegan durante la ventana se envían al
+cerrarla en un único mensaje. Así, un switch que se reinicia y deja 80
+dispositivos Offline genera dos mensajes de Telegram en lugar de 80.
+
+Las métricas de entrega están en instrumentation (crc_notifications_*).
+"""
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import NOTIFICATIONS, NOTIFICATION_DELIVERY, NOTIFICATION_QUEUE
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("CRC_NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("CRC_NOTIFY_QUEUE_SIZE", "1000"))
+NOTIFY_WORKERS = int(os.getenv("CRC_NOTIFY_WORKERS", "2"))
+
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+HTTP_TIMEOUT = (5, 10)  # (conexión, lectura) en segundos
+SMTP_TIMEOUT = 15
+# Conexión SMTP sin usar más de este tiempo: comprobarla con NOOP antes de enviar
+SMTP_IDLE_SECONDS = 60
+
+# Los servidores SMTP suelen limitar las sesiones simultáneas por cuenta
+CHANNEL_WORKERS = {"email": 1, "telegram": NOTIFY_WORKERS, "webhook": NOTIFY_WORKERS}
+
+# Segundos de agregación por canal (0 = cada alerta por separado). Los
+# webhooks suelen alimentar otros sistemas que prefieren eventos sueltos.
+DIGEST_WINDOWS = {
+    "email": float(os.getenv("CRC_DIGEST_WINDOW_EMAIL", "120")),
+    "telegram": float(os.getenv("CRC_DIGEST_WINDOW_TELEGRAM", "30")),
+    "webhook": float(os.getenv("CRC_DIGEST_WINDOW_WEBHOOK", "0"))
+}
+
+
+class NotificationError(Exception):
+    """Fallo de envío transitorio, se reintenta"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PermanentNotificationError(NotificationError):
+    """Fallo que no se arregla reintentando (credenciales, destino inválido...)"""
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        # Telegram lo indica en el cuerpo: {"parameters": {"retry_after": 30}}
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            value = (body.get("parameters") or {}).get("retry_after")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def check_response(response):
+    """429 y 5xx se reintentan; el resto de 4xx va directo a dead-letter"""
+    if response.status_code < 400:
+        return
+    detail = f"HTTP {response.status_code}: {response.text[:200]}"
+    if response.status_code == 429 or response.status_code >= 500:
+        raise NotificationError(detail, retry_after=_retry_after(response))
+    raise PermanentNotificationError(detail)
+
+
+class ConnectionPool:
+    """Conexiones HTTP y SMTP reutilizadas por cada hilo de envío"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return session
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        try:
+            response = self._session().post(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise NotificationError(str(e))
+        except requests.RequestException as e:
+            # URL mal formada, esquema no soportado...
+            raise PermanentNotificationError(str(e))
+        check_response(response)
+        return response
+
+    def _smtp(self, config: Dict) -> smtplib.SMTP:
+        key = (config.get('smtp_server'), config.get('smtp_port', 587), config.get('smtp_user'))
+        conn = getattr(self._local, "smtp", None)
+        if conn is not None and self._local.smtp_key != key:
+            # La configuración cambió desde la API
+            self.close_smtp()
+            conn = None
+        if conn is not None and time.monotonic() - self._local.smtp_used > SMTP_IDLE_SECONDS:
+            try:
+                conn.noop()
+            except (smtplib.SMTPException, OSError):
+                self.close_smtp()
+                conn = None
+
+        if conn is None:
+            try:
+                conn = smtplib.SMTP(key[0], key[1], timeout=SMTP_TIMEOUT)
+                conn.starttls()
+                conn.login(config.get('smtp_user'), config.get('smtp_password'))
+            except smtplib.SMTPAuthenticationError as e:
+                raise PermanentNotificationError(f"Login SMTP rechazado: {e}")
+            except (smtplib.SMTPException, OSError) as e:
+                raise NotificationError(f"No se pudo conectar al SMTP: {e}")
+            self._local.smtp = conn
+            self._local.smtp_key = key
+        self._local.smtp_used = time.monotonic()
+        return conn
+
+    def send_mail(self, config: Dict, msg):
+        # Un segundo intento inmediato por si el servidor cerró la conexión ociosa
+        for attempt in range(2):
+            conn = self._smtp(config)
+            try:
+                conn.send_message(msg)
+                self._local.smtp_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected as e:
+                self.close_smtp()
+                if attempt:
+                    raise NotificationError(str(e))
+            except smtplib.SMTPRecipientsRefused as e:
+                raise PermanentNotificationError(f"Destinatario rechazado: {e}")
+            except (smtplib.SMTPException, OSError) as e:
+                self.close_smtp()
+                raise NotificationError(str(e))
+
+    def close_smtp(self):
+        conn = getattr(self._local, "smtp", None)
+        self._local.smtp = None
+        if conn is not None:
+            try:
+                conn.quit()
+            except (smtplib.SMTPException, OSError):
+                conn.close()
+
+    def close(self):
+        """Cierra las conexiones del hilo actual"""
+        self.close_smtp()
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            session.close()
+            self._local.session = None
+
+
+def store_dead_letter(channel: str, payload: Dict, error: str, attempts: int):
+    """Guarda una notificación no entregada en notification_dead_letters"""
+    from database import SessionLocal, NotificationDeadLetter
+
+    db = SessionLocal()
+    try:
+        db.add(NotificationDeadLetter(channel=channel, payload=payload, error=error, attempts=attempts))
+        db.commit()
+    finally:
+        db.close()
+
+
+class NotificationJob:
+    """Una alerta pendiente de enviar por un canal"""
+
+    __slots__ = ("channel", "alert", "attempts", "enqueued_at")
+
+    def __init__(self, channel: str, alert):
+        self.channel = channel
+        self.alert = alert
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class NotificationDispatcher:
+    """
+    Colas por canal con hilos de envío, reintentos y dead-letter.
+    `senders` asocia cada canal a la función que entrega una alerta; debe
+    lanzar NotificationError (o cualquier excepción) si falla y
+    PermanentNotificationError si no tiene sentido reintentar.
+    Con `digest_factory` (lista de alertas -> objeto con to_dict que el
+    sender sabe formatear) se activan las ventanas de `digest_windows`;
+    `digest_key` decide qué alertas van juntas.
+    """
+
+    def __init__(
+        self,
+        senders: Dict[str, Callable],
+        workers: Optional[Dict[str, int]] = None,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+        queue_size: int = NOTIFY_QUEUE_SIZE,
+        dead_letter: Callable = store_dead_letter,
+        digest_factory: Optional[Callable[[List], object]] = None,
+        digest_key: Callable[[object], Hashable] = lambda alert: None,
+        digest_windows: Optional[Dict[str, float]] = None
+    ):
+        self.senders = senders
+        self.workers = workers or CHANNEL_WORKERS
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+        self.digest_factory = digest_factory
+        self.digest_key = digest_key
+        self.digest_windows = DIGEST_WINDOWS if digest_windows is None else digest_windows
+        self.queues = {channel: queue.Queue(maxsize=queue_size) for channel in senders}
+        self.pool = ConnectionPool()
+        self.running = False
+        self._threads = []
+        self._lock = threading.Lock()
+        # heap (vencimiento, secuencia, tipo, dato): reintentos y cierres de ventana
+        self._timers = []
+        self._timer_cond = threading.Condition()
+        self._seq = itertools.count()
+        # (canal, clave) -> alertas recibidas con la ventana abierta
+        self._digests: Dict[tuple, List] = {}
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for channel in self.queues:
+                for i in range(max(self.workers.get(channel, 1), 1)):
+                    thread = threading.Thread(target=self._worker, args=(channel,), daemon=True, name=f"notify-{channel}-{i}")
+                    thread.start()
+                    self._threads.append(thread)
+            thread = threading.Thread(target=self._timer_loop, daemon=True, name="notify-timers")
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, channel: str, alert) -> bool:
+        """Encola una alerta sin esperar a la red. False si se descarta."""
+        if channel not in self.queues:
+            raise ValueError(f"Canal sin sender: {channel}")
+        if not self.running:
+            self.start()
+
+        window = self.digest_windows.get(channel, 0) if self.digest_factory else 0
+        if window > 0:
+            key = (channel, self.digest_key(alert))
+            with self._timer_cond:
+                batch = self._digests.get(key)
+                if batch is not None:
+                    # Ventana abierta: se enviará en el resumen
+                    batch.append(alert)
+                    NOTIFICATIONS.labels(channel, "digested").inc()
+                    return True
+                self._digests[key] = []
+                self._schedule(window, "digest", key)
+        return self._enqueue(NotificationJob(channel, alert), defer_dead_letter=True)
+
+    def _schedule(self, delay: float, kind: str, item):
+        # Llamar con _timer_cond adquirido
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), kind, item))
+        self._timer_cond.notify()
+
+    def _close_digest(self, key: tuple) -> Optional[NotificationJob]:
+        """Cierra la ventana y devuelve el job a enviar, si llegó algo durante ella"""
+        batch = self._digests.pop(key, None)
+        if not batch:
+            return None
+        channel = key[0]
+        return NotificationJob(channel, batch[0] if len(batch) == 1 else self.digest_factory(batch))
+
+    def _enqueue(self, job: NotificationJob, defer_dead_letter: bool = False) -> bool:
+        """
+        Encola el job. Con defer_dead_letter (llamadas desde submit) el
+        dead-letter de una cola llena lo escribe el hilo de temporizadores:
+        quien llama puede estar dentro de una transacción con la única
+        conexión de escritura de SQLite y abrir otra sesión lo bloquearía.
+        """
+        try:
+            self.queues[job.channel].put_nowait(job)
+        except queue.Full:
+            if defer_dead_letter:
+                with self._timer_cond:
+                    self._schedule(0, "dead_letter", (job, "Cola de envío llena"))
+            else:
+                self._dead_letter(job, "Cola de envío llena")
+            return False
+        NOTIFICATION_QUEUE.labels(job.channel).inc()
+        return True
+
+    def _worker(self, channel: str):
+        jobs = self.queues[channel]
+        try:
+            while self.running:
+                try:
+                    job = jobs.get(timeout=1)
+                except queue.Empty:
+                    continue
+                NOTIFICATION_QUEUE.labels(channel).dec()
+                self._deliver(job)
+        finally:
+            self.pool.close()
+
+    @staticmethod
+    def backoff(attempts: int, retry_after: Optional[float] = None) -> float:
+        """Espera antes del siguiente intento: exponencial con jitter"""
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after:
+            delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+        return delay
+
+    def _deliver(self, job: NotificationJob):
+        job.attempts += 1
+        try:
+            self.senders[job.channel](job.alert)
+        except PermanentNotificationError as e:
+            self._dead_letter(job, str(e))
+            return
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                self._dead_letter(job, str(e))
+                return
+            delay = self.backoff(job.attempts, getattr(e, "retry_after", None))
+            NOTIFICATIONS.labels(job.channel, "retry").inc()
+            logger.warning(
+                f"Fallo enviando por {job.channel} (intento {job.attempts}/{self.max_attempts}), "
+                f"reintento en {delay:.1f}s: {e}"
+            )
+            with self._timer_cond:
+                self._schedule(delay, "retry", job)
+            return
+
+        NOTIFICATIONS.labels(job.channel, "sent").inc()
+        NOTIFICATION_DELIVERY.labels(job.channel).observe(time.monotonic() - job.enqueued_at)
+
+    def _timer_loop(self):
+        while self.running:
+            with self._timer_cond:
+                if not self._timers:
+                    self._timer_cond.wait(1)
+                    continue
+                wait = self._timers[0][0] - time.monotonic()
+                if wait > 0:
+                    self._timer_cond.wait(min(wait, 1))
+                    continue
+                _, _, kind, item = heapq.heappop(self._timers)
+                job = self._close_digest(item) if kind == "digest" else item
+            # Fuera del lock: el dead-letter escribe en la base de datos
+            if kind == "dead_letter":
+                self._dead_letter(*job)
+            elif job is not None:
+                self._enqueue(job)
+
+    def _dead_letter(self, job: NotificationJob, error: str):
+        NOTIFICATIONS.labels(job.channel, "dead_letter").inc()
+        logger.error(f"Notificación por {job.channel} descartada tras {job.attempts} intento(s): {error}")
+        try:
+            self.dead_letter(job.channel, job.alert.to_dict(), error, job.attempts)
+        except Exception as e:
+            logger.error(f"No se pudo guardar la notificación fallida: {e}")
+
+    def pending(self) -> Dict[str, Dict[str, int]]:
+        """Notificaciones en cola, esperando reintento y acumuladas para resumen por canal"""
+        with self._timer_cond:
+            retrying = [item.channel for _, _, kind, item in self._timers if kind == "retry"]
+            digesting = [channel for (channel, _), batch in self._digests.items() for _ in batch]
+        return {
+            channel: {
+                "queued": jobs.qsize(),
+                "retrying": retrying.count(channel),
+                "digest": digesting.count(channel)
+            }
+            for channel, jobs in self.queues.items()
+        }
+
+    def stop(self, timeout: float = 5):
+        """
+        Para los hilos de envío. Lo que quede en cola o esperando reintento se
+        guarda como dead-letter para poder reenviarlo tras reiniciar.
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        with self._timer_cond:
+            self._timer_cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+        leftovers = []
+        for jobs in self.queues.values():
+            while True:
+                try:
+                    leftovers.append(jobs.get_nowait())
+                except queue.Empty:
+                    break
+                NOTIFICATION_QUEUE.labels(leftovers[-1].channel).dec()
+        with self._timer_cond:
+            leftovers.extend(item for _, _, kind, item in self._timers if kind == "retry")
+            rejected = [item for _, _, kind, item in self._timers if kind == "dead_letter"]
+            self._timers = []
+            for key in list(self._digests):
+                job = self._close_digest(key)
+                if job is not None:
+                    leftovers.append(job)
+        for job, error in rejected:
+            self._dead_letter(job, error)
+        for job in leftovers:
+            self._dead_letter(job, "Servidor detenido antes del envío")
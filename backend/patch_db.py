@@ -1,5 +1,8 @@
-import sqlite3
 import os
+from sqlalchemy import create_engine
+
+from database import Base
+from migrations import run_migrations, applied_versions
 
 def patch_db(db_path):
     print(f"--- Patching: {db_path} ---")
@@ -8,24 +11,16 @@ def patch_db(db_path):
         return
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Check if column exists first
-        cursor.execute("PRAGMA table_info(devices)")
-        cols = [c[1] for c in cursor.fetchall()]
-        
-        if not cols:
-            print("Table 'devices' not found in this database.")
-        elif 'detected_at' not in cols:
-            print("Adding 'detected_at' column to 'devices' table...")
-            cursor.execute("ALTER TABLE devices ADD COLUMN detected_at DATETIME")
-            conn.commit()
-            print("Column added successfully.")
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        # Incluye las migraciones online: aquí no hay API sirviendo
+        applied = run_migrations(engine, include_online=True)
+        if applied:
+            print(f"Migrations applied: {applied}")
         else:
-            print("Column 'detected_at' already exists.")
-            
-        conn.close()
+            print("Database already up to date.")
+        print(f"Schema version: {max(applied_versions(engine), default=0)}")
+        engine.dispose()
     except Exception as e:
         print(f"Error patching database {db_path}: {e}")
 
@@ -40,4 +35,3 @@ if __name__ == "__main__":
     # 2. Dist database (where the app actually runs from logs)
     dist_db = os.path.join(base_dir, 'dist', 'network_monitor.db')
     patch_db(dist_db)
-
@@ -0,0 +1,206 @@
+"""
+Perfilado bajo demanda del proceso en marcha.
+
+- sample_profile(): perfil por muestreo de todos los hilos (tiempo de reloj
+  o de CPU) y de las tareas asyncio, en formato "folded stacks" que
+  entienden flamegraph.pl, speedscope o inferno.
+- LoopWatchdog: detecta callbacks/corrutinas que bloquean el event loop más
+  de CRC_SLOW_CALLBACK_MS y registra la pila donde está bloqueado (p.ej. un
+  requests.post síncrono dentro de _send_telegram).
+
+Solo usa la librería estándar y psutil, así que se puede dejar activo en
+el ejecutable portable.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("wall", "cpu")
+MAX_PROFILE_SECONDS = 60
+MAX_STACK_DEPTH = 64
+# 0 = detector de bloqueos del event loop desactivado
+SLOW_CALLBACK_MS = int(os.getenv("CRC_SLOW_CALLBACK_MS", "0"))
+
+_main_loop: Optional[asyncio.AbstractEventLoop] = None
+_profile_lock = threading.Lock()
+
+
+def register_loop(loop: asyncio.AbstractEventLoop):
+    """Event loop de la API, para muestrear sus tareas"""
+    global _main_loop
+    _main_loop = loop
+
+
+def main_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Event loop registrado con register_loop (None si no hay)"""
+    return _main_loop
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _folded_frames(frame) -> list:
+    """Pila de la raíz a la hoja"""
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(_frame_label(frame))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _clean(name: str) -> str:
+    # ';' separa marcos en el formato folded (el contador va tras el último espacio)
+    return name.replace(";", ":").replace("\n", " ") if name else "?"
+
+
+def _thread_cpu_times() -> Dict[int, float]:
+    """CPU consumida (user + system) por id nativo de hilo"""
+    try:
+        return {t.id: t.user_time + t.system_time for t in psutil.Process().threads()}
+    except (psutil.Error, OSError):
+        return {}
+
+
+def _task_stacks(loop) -> Dict[str, list]:
+    """Pila suspendida de cada tarea asyncio del loop"""
+    stacks = {}
+    try:
+        tasks = asyncio.all_tasks(loop)
+    except RuntimeError:
+        # El conjunto de tareas cambió mientras se copiaba
+        return stacks
+    for task in tasks:
+        frames = []
+        for frame in task.get_stack(limit=MAX_STACK_DEPTH):
+            frames.append(_frame_label(frame))
+        if frames:
+            stacks[task.get_name()] = frames
+    return stacks
+
+
+def sample_profile(
+    seconds: float,
+    interval: float = 0.005,
+    mode: str = "wall",
+    include_tasks: bool = True
+) -> str:
+    """
+    Muestrea las pilas de todos los hilos durante `seconds` segundos.
+    mode="wall" cuenta cada muestra; mode="cpu" pondera cada pila por la CPU
+    (en µs) que consumió su hilo desde la muestra anterior, de modo que los
+    hilos dormidos o bloqueados en E/S no aparecen.
+    Devuelve el perfil en formato folded ("hilo;marco;marco N" por línea).
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Modo no válido: {mode}")
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Ya hay un perfil en curso")
+
+    try:
+        counts = collections.Counter()
+        own_ident = threading.get_ident()
+        previous_cpu = _thread_cpu_times() if mode == "cpu" else {}
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+
+        while time.monotonic() < deadline:
+            threads = {t.ident: t for t in threading.enumerate()}
+            frames = sys._current_frames()
+            cpu = _thread_cpu_times() if mode == "cpu" else {}
+
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                thread = threads.get(ident)
+                weight = 1
+                if mode == "cpu":
+                    native_id = getattr(thread, "native_id", None)
+                    if native_id is None or native_id not in cpu:
+                        continue
+                    weight = int((cpu[native_id] - previous_cpu.get(native_id, cpu[native_id])) * 1_000_000)
+                    if weight <= 0:
+                        continue
+                name = _clean(thread.name if thread else f"thread-{ident}")
+                counts[";".join([name] + [_clean(f) for f in _folded_frames(frame)])] += weight
+
+            if include_tasks and mode == "wall" and _main_loop is not None:
+                for task_name, stack in _task_stacks(_main_loop).items():
+                    counts[";".join(["asyncio", _clean(task_name)] + [_clean(f) for f in stack])] += 1
+
+            previous_cpu = cpu
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class LoopWatchdog:
+    """
+    Detecta bloqueos del event loop: una callback del propio loop marca un
+    latido cada threshold/4 y un hilo vigila que no se retrase. Si se pasa
+    del umbral se registra la pila actual del hilo del loop, que es
+    justamente el código que lo está bloqueando.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold_ms: int = SLOW_CALLBACK_MS):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        self.stalled_since: Optional[float] = None
+        self.running = False
+        self.stalls = 0
+
+    def _beat(self):
+        now = time.monotonic()
+        self.loop_thread_id = threading.get_ident()
+        if self.stalled_since is not None:
+            logger.warning(f"Event loop desbloqueado tras {(now - self.stalled_since + self.threshold) * 1000:.0f} ms")
+            self.stalled_since = None
+        self.last_beat = now
+        if self.running:
+            self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.interval)
+            lag = time.monotonic() - self.last_beat - self.interval
+            if lag < self.threshold or self.stalled_since is not None or self.loop_thread_id is None:
+                continue
+            self.stalled_since = time.monotonic()
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame, limit=15)) if frame else "(pila no disponible)\n"
+            logger.warning(f"Event loop bloqueado más de {self.threshold * 1000:.0f} ms en:\n{stack}")
+
+    def start(self):
+        self.running = True
+        self.loop.call_soon_threadsafe(self._beat)
+        threading.Thread(target=self._watch, daemon=True, name="loop-watchdog").start()
+
+    def stop(self):
+        self.running = False
+
+
+def start_loop_watchdog(loop: asyncio.AbstractEventLoop, threshold_ms: int = SLOW_CALLBACK_MS) -> Optional[LoopWatchdog]:
+    """Arranca el detector si CRC_SLOW_CALLBACK_MS > 0"""
+    if threshold_ms <= 0:
+        return None
+    watchdog = LoopWatchdog(loop, threshold_ms)
+    watchdog.start()
+    logger.info(f"Detector de bloqueos del event loop activo (> {threshold_ms} ms)")
+    return watchdog
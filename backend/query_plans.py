@@ -0,0 +1,170 @@
+"""
+Auditoría de planes de consulta para las consultas calientes.
+
+Cada consulta registrada con @hot_query se pasa por EXPLAIN QUERY PLAN y
+se marca como regresión si SQLite acaba recorriendo una tabla completa
+(SCAN <tabla> sin índice).
+
+Uso:
+    python query_plans.py            # contra network_monitor.db
+    python query_plans.py --memory   # contra un esquema nuevo en memoria
+Devuelve código de salida 1 si alguna consulta regresa a un table scan.
+"""
+import datetime
+import re
+import sys
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, func, select
+
+from database import Base, engine, Device, Alert, Sensor, MetricHistory, migrate_indexes
+from metrics_query import build_raw_query, build_bucket_query, build_batch_query
+from exports import build_export_query
+
+# Nombre -> función que construye la consulta (recibe el nombre del dialecto)
+HOT_QUERIES: Dict[str, Callable] = {}
+
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def hot_query(name: str):
+    """Registra una consulta caliente para la auditoría"""
+    def decorator(builder: Callable):
+        HOT_QUERIES[name] = builder
+        return builder
+    return decorator
+
+
+def _since():
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=24)
+
+
+@hot_query("metrics_device_metric_range")
+def _metrics_device_metric_range(dialect_name):
+    return build_raw_query(1, _since(), "ping_latency")
+
+
+@hot_query("metrics_device_range")
+def _metrics_device_range(dialect_name):
+    return build_raw_query(1, _since())
+
+
+@hot_query("metrics_device_buckets")
+def _metrics_device_buckets(dialect_name):
+    return build_bucket_query(1, _since(), 300, dialect_name, "ping_latency")
+
+
+@hot_query("metrics_summary")
+def _metrics_summary(dialect_name):
+    return select(
+        MetricHistory.metric_name,
+        func.avg(MetricHistory.value),
+        func.min(MetricHistory.value),
+        func.max(MetricHistory.value),
+        func.count(MetricHistory.id)
+    ).where(
+        MetricHistory.device_id == 1,
+        MetricHistory.timestamp >= _since()
+    ).group_by(MetricHistory.metric_name)
+
+
+@hot_query("metrics_batch")
+def _metrics_batch(dialect_name):
+    return build_batch_query([1, 2, 3], "ping_latency", _since(), 300, dialect_name)
+
+
+@hot_query("metrics_export_range")
+def _metrics_export_range(dialect_name):
+    return build_export_query("metrics", since=_since())
+
+
+@hot_query("alerts_recent")
+def _alerts_recent(dialect_name):
+    return select(Alert).order_by(Alert.timestamp.desc()).limit(50)
+
+
+@hot_query("alerts_by_device")
+def _alerts_by_device(dialect_name):
+    return select(Alert).where(Alert.device_id == 1).order_by(Alert.timestamp.desc()).limit(50)
+
+
+@hot_query("device_by_mac")
+def _device_by_mac(dialect_name):
+    return select(Device).where(Device.mac == "aa:bb:cc:dd:ee:ff")
+
+
+@hot_query("devices_online_count")
+def _devices_online_count(dialect_name):
+    return select(func.count(Device.id)).where(Device.status == "Online")
+
+
+@hot_query("sensors_by_device")
+def _sensors_by_device(dialect_name):
+    return select(Sensor).where(Sensor.device_id == 1, Sensor.enabled == True)
+
+
+def _driver_params(compiled) -> tuple:
+    """Parámetros posicionales aptos para el driver sqlite3"""
+    params = []
+    for key in compiled.positiontup:
+        value = compiled.params[key]
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat(" ")
+        params.append(value)
+    return tuple(params)
+
+
+def explain(bind, stmt) -> List[str]:
+    """Devuelve las líneas 'detail' de EXPLAIN QUERY PLAN"""
+    compiled = stmt.compile(dialect=bind.dialect, compile_kwargs={"render_postcompile": True})
+    with bind.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", _driver_params(compiled)).all()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans(bind=engine) -> Dict[str, List[str]]:
+    """
+    Ejecuta EXPLAIN QUERY PLAN sobre todas las consultas registradas.
+    Devuelve {nombre: [tablas recorridas completas]} solo para las que regresan.
+    """
+    if bind.dialect.name != "sqlite":
+        return {}
+
+    regressions = {}
+    for name, builder in HOT_QUERIES.items():
+        scans = []
+        for detail in explain(bind, builder(bind.dialect.name)):
+            match = _FULL_SCAN.match(detail.strip())
+            if match:
+                scans.append(match.group(1))
+        if scans:
+            regressions[name] = scans
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    bind = engine
+    if "--memory" in argv:
+        bind = create_engine("sqlite://")
+        Base.metadata.create_all(bind=bind)
+    else:
+        Base.metadata.create_all(bind=bind)
+    migrate_indexes(bind)
+
+    regressions = check_query_plans(bind)
+    for name, builder in HOT_QUERIES.items():
+        status = "TABLE SCAN" if name in regressions else "OK"
+        print(f"[{status}] {name}")
+        if "-v" in argv or name in regressions:
+            for detail in explain(bind, builder(bind.dialect.name)):
+                print(f"    {detail}")
+
+    if regressions:
+        print(f"\n{len(regressions)} consulta(s) recorren tablas completas.")
+        return 1
+    print("\nTodas las consultas calientes usan índices.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,7 +4,12 @@ Cada sensor es responsable de recolectar métricas específicas.
 """
 import logging
 import asyncio
+import contextvars
 import datetime
+import ipaddress
+import os
+import socket
+import time
 from typing import Dict, Any, List
 from abc import ABC, abstractmethod
 import subprocess
@@ -155,84 +160,253 @@ class PortScanSensor(BaseSensor):
             return {"open_ports_count": 0, "scanned_ports_count": 0}
 
 
+# ============================================
+# CLIENTE HTTP COMPARTIDO
+# ============================================
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("CRC_HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("CRC_HTTP_MAX_KEEPALIVE", "100"))
+# Mayor que el intervalo del colector (60 s) para que cada comprobación reutilice la conexión
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("CRC_HTTP_KEEPALIVE_SECONDS", "90"))
+HTTP2_ENABLED = os.getenv("CRC_HTTP2", "1") == "1"
+# Esperar turno en el pool no cuenta como fallo del dispositivo
+HTTP_POOL_TIMEOUT = 60.0
+
+# Tiempos de la petición en curso; el backend de red anota aquí la resolución DNS
+_http_timings: contextvars.ContextVar = contextvars.ContextVar("http_timings", default=None)
+_http_client = None
+_http_client_loop = None
+
+
+class _TimedResolver:
+    """
+    Backend de red de httpcore que resuelve el nombre aparte para medir el
+    DNS (httpcore lo incluye en connect_tcp). El TLS sigue usando el nombre
+    original (SNI y certificado). Como hace httpcore, prueba las direcciones
+    resueltas en orden hasta que una conecta.
+
+    Se instala sustituyendo el atributo privado `_network_backend` del pool
+    de httpcore (get_http_client): si una versión futura lo cambia, el
+    sensor sigue funcionando, solo que sin http_dns_ms.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        import httpcore
+
+        try:
+            ipaddress.ip_address(host)
+            # IP literal: nada que resolver (ni hilo del executor para getaddrinfo)
+            return await self.backend.connect_tcp(
+                host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+            )
+        except ValueError:
+            pass
+        started = time.perf_counter()
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise httpcore.ConnectError(f"DNS {host}: {e}") from e
+        timings = _http_timings.get()
+        if timings is not None:
+            timings["dns"] = (time.perf_counter() - started) * 1000
+
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        for i, address in enumerate(addresses):
+            try:
+                return await self.backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if i == len(addresses) - 1:
+                    raise
+        raise httpcore.ConnectError(f"DNS {host}: sin direcciones")
+
+    async def connect_unix_socket(self, *args, **kwargs):
+        return await self.backend.connect_unix_socket(*args, **kwargs)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+def get_http_client():
+    """
+    Cliente HTTP asíncrono compartido por todos los sensores HTTP: pool de
+    conexiones keep-alive por host y HTTP/2 si está instalado h2.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client_loop is not loop:
+        import httpx
+
+        try:
+            import h2  # noqa: F401
+            http2 = HTTP2_ENABLED
+        except ImportError:
+            http2 = False
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            verify=False,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+            )
+        )
+        pool = getattr(transport, "_pool", None)
+        if pool is not None and hasattr(pool, "_network_backend"):
+            pool._network_backend = _TimedResolver(pool._network_backend)
+        _http_client = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(10.0, pool=HTTP_POOL_TIMEOUT))
+        _http_client_loop = loop
+    return _http_client
+
+
 class HTTPSensor(BaseSensor):
-    """Sensor de disponibilidad HTTP/HTTPS"""
+    """
+    Sensor de disponibilidad HTTP/HTTPS. Configuración:
+    - url (http://<ip>), method (GET), timeout (10 s)
+    - expected_status: código o lista de códigos válidos (200)
+    - expected_body: texto que debe aparecer en la respuesta
+    Desglosa el tiempo en DNS, conexión TCP, TLS y primer byte (TTFB); con
+    la conexión reutilizada del pool solo hay TTFB.
+    """
     
     async def collect(self) -> Dict[str, float]:
         """Verifica disponibilidad (Non-blocking)"""
+        import httpx
+
+        url = self.config.get('url', f'http://{self.device_ip}')
+        expected_status = self.config.get('expected_status', 200)
+        if not isinstance(expected_status, (list, tuple)):
+            expected_status = [expected_status]
+        expected_status = {int(code) for code in expected_status}
+        expected_body = self.config.get('expected_body')
+
+        marks = {}
+
+        async def trace(event: str, info: Dict):
+            marks[event.split(".", 1)[1]] = time.perf_counter()
+
+        timings = {}
+        token = _http_timings.set(timings)
+        start = time.perf_counter()
         try:
-            import requests
-            import time
-            loop = asyncio.get_event_loop()
-            
-            url = self.config.get('url', f'http://{self.device_ip}')
-            
-            def check_http():
-                start = time.time()
-                try:
-                    resp = requests.get(url, timeout=10, verify=False)
-                    elapsed = (time.time() - start) * 1000
-                    return elapsed, resp.status_code, 1 if resp.status_code == 200 else 0
-                except:
-                    return 0, 0, 0
-            
-            elapsed, status, available = await loop.run_in_executor(None, check_http)
-            
-            self.status = "OK" if status == 200 else "WARNING"
-            return {
-                "http_response_time": elapsed,
-                "http_status_code": status,
-                "http_available": available
-            }
-            
+            response = await get_http_client().request(
+                self.config.get('method', 'GET').upper(),
+                url,
+                # Solo conexión/lectura: la espera en el pool conserva su límite
+                timeout=httpx.Timeout(float(self.config.get('timeout', 10)), pool=HTTP_POOL_TIMEOUT),
+                extensions={"trace": trace}
+            )
+            elapsed = (time.perf_counter() - start) * 1000
         except Exception as e:
-            logger.error(f"Error en HTTPSensor para {self.device_ip}: {e}")
+            # Los timeouts de httpx no traen mensaje
+            logger.error(f"Error en HTTPSensor para {self.device_ip}: {e or type(e).__name__}")
             self.status = "ERROR"
             return {
                 "http_response_time": 0,
                 "http_status_code": 0,
                 "http_available": 0
             }
+        finally:
+            _http_timings.reset(token)
+
+        def span(started: str, completed: str) -> float:
+            if started in marks and completed in marks:
+                return (marks[completed] - marks[started]) * 1000
+            return 0.0
+
+        dns = timings.get("dns", 0.0)
+        send = next((key for key in marks if key.endswith("send_request_headers.started")), None)
+        received = next((key for key in marks if key.endswith("receive_response_headers.complete")), None)
+        available = response.status_code in expected_status
+        if available and expected_body:
+            available = expected_body in response.text
+
+        self.status = "OK" if available else "WARNING"
+        return {
+            "http_response_time": elapsed,
+            "http_status_code": response.status_code,
+            "http_available": 1 if available else 0,
+            "http_dns_ms": dns,
+            "http_connect_ms": max(span("connect_tcp.started", "connect_tcp.complete") - dns, 0.0),
+            "http_tls_ms": span("start_tls.started", "start_tls.complete"),
+            "http_ttfb_ms": span(send, received) if send and received else 0.0,
+            "http_connection_reused": 0 if "connect_tcp.started" in marks else 1
+        }
 
 
 class BandwidthSensor(BaseSensor):
-    """Sensor de ancho de banda (System-wide)"""
+    """
+    Sensor de ancho de banda del equipo que ejecuta el backend. Lee del
+    muestreo continuo de bandwidth_monitor (media, p95 y máximo de la última
+    ventana). Configuración:
+    - interface: una NIC concreta (por defecto, la suma de todas)
+    - per_interface: además, las métricas de cada NIC con sufijo ':<nic>'
+    """
     
     async def collect(self) -> Dict[str, float]:
-        """Recolecta estadísticas de ancho de banda (Non-blocking call to psutil)"""
+        """Agregados de la ventana; vacío mientras se acumulan las primeras muestras"""
         try:
-            import psutil
-            import time
-            loop = asyncio.get_event_loop()
-            
-            # psutil is fast but let's wrap just in case
-            net_io = await loop.run_in_executor(None, psutil.net_io_counters)
+            from bandwidth_monitor import get_monitor
             
-            if hasattr(self, '_last_bytes_sent'):
-                bytes_sent_diff = net_io.bytes_sent - self._last_bytes_sent
-                bytes_recv_diff = net_io.bytes_recv - self._last_bytes_recv
-                time_diff = (datetime.datetime.now() - self._last_measurement).total_seconds()
-                
-                upload_mbps = (bytes_sent_diff * 8) / (time_diff * 1_000_000) if time_diff > 0 else 0
-                download_mbps = (bytes_recv_diff * 8) / (time_diff * 1_000_000) if time_diff > 0 else 0
-            else:
-                upload_mbps = 0
-                download_mbps = 0
+            monitor = get_monitor()
+            interface = self.config.get('interface')
+            if interface and monitor.interface_names() and interface not in monitor.interface_names():
+                logger.error(f"BandwidthSensor: interfaz desconocida {interface}")
+                self.status = "ERROR"
+                return {}
             
-            self._last_bytes_sent = net_io.bytes_sent
-            self._last_bytes_recv = net_io.bytes_recv
-            self._last_measurement = datetime.datetime.now()
+            metrics = monitor.stats(interface)
+            if self.config.get('per_interface'):
+                for nic in monitor.interface_names():
+                    for name, value in monitor.stats(nic).items():
+                        metrics[f"{name}:{nic}"] = value
             
             self.status = "OK"
-            return {
-                "bandwidth_upload": upload_mbps,
-                "bandwidth_download": download_mbps
-            }
+            return metrics
             
         except Exception as e:
             logger.error(f"Error en BandwidthSensor: {e}")
             self.status = "ERROR"
-            return {"bandwidth_upload": 0, "bandwidth_download": 0}
+            return {}
+
+
+class SNMPSensor(BaseSensor):
+    """
+    Sensor SNMP v2c. Configuración:
+    - community (public), port (161)
+    - oid_sets: conjuntos predefinidos, de entre cpu, memory, temperature e interfaces
+    - oids: {métrica: OID} escalares adicionales
+    Todas las OIDs del agente se piden en una sola petición GETBULK.
+    """
+    
+    async def collect(self) -> Dict[str, float]:
+        try:
+            from snmp_worker import agent_for, collect_oid_sets, DEFAULT_OID_SETS
+            
+            agent = agent_for(
+                self.device_ip,
+                self.config.get('community', 'public'),
+                int(self.config.get('port', 161))
+            )
+            metrics = await collect_oid_sets(
+                agent,
+                self.config.get('oid_sets') or DEFAULT_OID_SETS,
+                self.config.get('oids')
+            )
+            metrics["snmp_available"] = 1
+            self.status = "OK"
+            return metrics
+            
+        except Exception as e:
+            logger.error(f"Error en SNMPSensor para {self.device_ip}: {e}")
+            self.status = "ERROR"
+            return {"snmp_available": 0}
 
 
 # Factory para crear sensores
@@ -240,7 +414,8 @@ SENSOR_TYPES = {
     'PING': PingSensor,
     'PORT': PortScanSensor,
     'HTTP': HTTPSensor,
-    'BANDWIDTH': BandwidthSensor
+    'BANDWIDTH': BandwidthSensor,
+    'SNMP': SNMPSensor
 }
 
 def create_sensor(sensor_type: str, device_ip: str, config: Dict = None) -> BaseSensor:
@@ -21,9 +21,10 @@ import time
 import datetime
 import psutil
 import socket
-from fastapi import FastAPI, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect, Query, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func, and_
 from winotify import Notification
 import logging
@@ -41,17 +42,39 @@ mimetypes.add_type('image/svg+xml', '.svg')
 
 # Importar modelos de base de datos
 from database import (
-    SessionLocal, init_db, Device, Alert, Config, Sensor, 
-    MetricHistory, AlertRule, PortScan, DeviceGroup
+    SessionLocal, ReadSessionLocal, init_db, Device, Alert, Config, Sensor, 
+    MetricHistory, AlertRule, PortScan, DeviceGroup, NotificationDeadLetter
 )
 from scanner import scan_network_arp, resolve_hostname, get_vendor_from_mac
+from inventory import InventoryReconciler, guess_device_type
+from liveness import LivenessTable
 from websocket_manager import manager as ws_manager
 from metrics_worker import MetricsCollector, auto_create_ping_sensors
-from alerts import AlertManager, AlertLevel, AlertChannel, AlertCondition
-from snmp_worker import SNMPWorker
+from alerts import (
+    AlertManager, AlertLevel, AlertChannel, AlertCondition,
+    Alert as AlertEvent, AlertRule as RuleConfig
+)
+from snmp_worker import SNMPWorker, detect_gateway
+from event_receiver import EventReceiver
+from bandwidth_monitor import stop_monitor as stop_bandwidth_monitor
+from metrics_query import MAX_POINTS, BATCH_AGGREGATIONS, resolve_step
+from async_database import get_async_db
+import async_repository as repo
+from exports import EXPORT_DATASETS, EXPORT_FORMATS, stream_export, parquet_available
+from migrations import start_online_migrations, MIGRATION_STATUS
+from storage import start_partition_maintenance, stop_partition_maintenance
+from instrumentation import (
+    SCAN_DURATION, SCAN_DEVICES_FOUND, instrument_sessions, watch_websockets, watch_metric_windows, render_metrics
+)
+from profiling import PROFILE_MODES, MAX_PROFILE_SECONDS, sample_profile, register_loop, start_loop_watchdog
 
-# Global SNMP Worker
+# Global SNMP Worker (opcional: CRC_SNMP_ENABLED=1)
 snmp_worker = None
+SNMP_ENABLED = os.getenv("CRC_SNMP_ENABLED", "0") == "1"
+SNMP_COMMUNITY = os.getenv("CRC_SNMP_COMMUNITY", "public")
+# Receptor de traps SNMP y syslog (opcional: CRC_EVENT_RECEIVER=1)
+event_receiver = None
+EVENT_RECEIVER_ENABLED = os.getenv("CRC_EVENT_RECEIVER", "0") == "1"
 
 # Setup Logging
 logging.basicConfig(
@@ -66,6 +89,8 @@ logger = logging.getLogger(__name__)
 
 # Global cache for mDNS discovered names
 MDNS_NAME_CACHE = {}
+# Última señal de cada dispositivo (ARP, mDNS, ping, TCP) para decidir quién está Offline
+liveness = LivenessTable()
 
 # Metrics collector instance
 metrics_collector = None
@@ -107,6 +132,7 @@ class MDNSListener:
                     ip = socket.inet_ntoa(addr)
                     clean_name = name.split('.')[0]
                     MDNS_NAME_CACHE[ip] = clean_name
+                    liveness.heard_ip(ip, "passive")
                     logger.info(f"mDNS Discovery: {ip} is {clean_name}")
         except:
             pass
@@ -132,7 +158,7 @@ def is_admin():
         return False
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
 import sys
 import os
 
@@ -171,6 +197,10 @@ if os.path.exists(static_dir):
 else:
     logger.warning(f"Static directory not found at {static_dir}. Frontend will not be served.")
 
+# Instrumentación (/metrics)
+instrument_sessions(SessionLocal)
+watch_websockets(ws_manager)
+
 # DB Dependency
 def get_db():
     db = SessionLocal()
@@ -179,22 +209,14 @@ def get_db():
     finally:
         db.close()
 
-def guess_device_type(vendor, hostname):
-    v = vendor.lower()
-    h = (hostname or "").lower()
-    
-    if any(k in v or k in h for k in ["apple", "iphone", "ipad", "android", "samsung", "huawei", "xiaomi", "mobile", "phone"]):
-        return "Mobile/Tablet"
-    if any(k in v or k in h for k in ["cisco", "tplink", "tp-link", "dlink", "d-link", "huawei", "router", "gateway", "mikrotik"]):
-        return "Router/Network"
-    if any(k in v or k in h for k in ["hp", "canon", "epson", "brother", "printer", "lexmark"]):
-        return "Printer"
-    if any(k in v or k in h for k in ["raspberry", "esp32", "espressif", "iot", "arduino", "nest", "google home", "alexa"]):
-        return "IoT/Device"
-    if any(k in v or k in h for k in ["vmware", "virtualbox", "microsoft", "windows", "linux", "desktop", "laptop", "pc"]):
-        return "PC/Server"
-    
-    return "Unknown"
+# Solo lectura: en SQLite usa el pool de conexiones read-only y no hace
+# cola detrás del escritor
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 def send_notification(title, msg):
     try:
@@ -247,169 +269,29 @@ def get_local_network():
 # Background Scanner (mejorado con broadcasting WebSocket)
 def background_scanner():
     logger.info("Background scanner started.")
+    reconciler = InventoryReconciler(
+        resolve_hostname=resolve_hostname,
+        get_vendor=get_vendor_from_mac,
+        notify=send_notification,
+        alert_manager=alert_manager,
+        ws_manager=ws_manager,
+        hostname_cache=MDNS_NAME_CACHE,
+        liveness=liveness
+    )
+    # Una sola vez: la puerta de enlace no cambia con cada escaneo
+    gateway_ip = detect_gateway()
     while True:
         db = SessionLocal()
         try:
             net_range = get_local_network()
-            found_devices = scan_network_arp(net_range)
-            
-            now = datetime.datetime.utcnow()
-            found_macs = [d['mac'] for d in found_devices]
-
-            for d in found_devices:
-                device = db.query(Device).filter(Device.mac == d['mac']).first()
-                if not device:
-                    hostname = resolve_hostname(d['ip'])
-                    vendor = get_vendor_from_mac(d['mac'])
-                    device_type = guess_device_type(vendor, hostname)
-                    new_dev = Device(
-                        mac=d['mac'],
-                        ip=d['ip'],
-                        hostname=hostname,
-                        vendor=vendor,
-                        device_type=device_type,
-                        status="Online",
-                        first_seen=now,
-                        last_seen=now
-                    )
-                    db.add(new_dev)
-                    db.commit()
-                    db.refresh(new_dev)
-                    
-                    alert_msg = f"Nuevo dispositivo detectado: {hostname or 'Desconocido'} ({d['ip']})"
-                    new_alert = Alert(
-                        device_id=new_dev.id, 
-                        type="NEW_DEVICE",
-                        condition="new_device",
-                        level="INFO",
-                        message=alert_msg,
-                        device_name=hostname or 'Desconocido',
-                        device_ip=d['ip']
-                    )
-                    db.add(new_alert)
-                    db.commit()
-                    
-                    send_notification("Nuevo Dispositivo", alert_msg)
-                    
-                    # Disparar alerta con AlertManager
-                    if alert_manager:
-                        device_dict = {
-                            'id': new_dev.id,
-                            'ip': d['ip'],
-                            'hostname': hostname,
-                            'alias': new_dev.alias,
-                            'status': 'Online',
-                            'is_authorized': new_dev.is_authorized
-                        }
-                        alert_manager.process_device_event('new', device_dict)
-                    
-                    # Broadcast via WebSocket
-                    asyncio.run(ws_manager.broadcast_device_update({
-                        "id": new_dev.id,
-                        "mac": new_dev.mac,
-                        "ip": new_dev.ip,
-                        "hostname": new_dev.hostname,
-                        "status": "Online",
-                        "vendor": new_dev.vendor
-                    }))
-                    asyncio.run(ws_manager.broadcast_alert({
-                        "id": new_alert.id,
-                        "type": "NEW_DEVICE",
-                        "level": "INFO",
-                        "message": alert_msg
-                    }))
-                    
-                else:
-                    if device.status == "Offline":
-                        alert_msg = f"Dispositivo ha vuelto: {device.hostname or device.ip}"
-                        new_alert = Alert(
-                            device_id=device.id,
-                            type="REAPPEARED",
-                            condition="device_online",
-                            level="INFO",
-                            message=alert_msg,
-                            device_name=device.hostname or device.ip,
-                            device_ip=d['ip']
-                        )
-                        db.add(new_alert)
-                        send_notification("Dispositivo en Red", alert_msg)
-                        
-                        # Disparar alerta con AlertManager
-                        if alert_manager:
-                            device_dict = {
-                                'id': device.id,
-                                'ip': d['ip'],
-                                'hostname': device.hostname,
-                                'alias': device.alias,
-                                'status': 'Online',
-                                'is_authorized': device.is_authorized
-                            }
-                            alert_manager.process_device_event('online', device_dict)
-                    
-                    if not device.hostname or device.hostname == "Unknown" or device.hostname == "":
-                         m_name = MDNS_NAME_CACHE.get(d['ip'])
-                         if m_name:
-                             device.hostname = m_name
-                         else:
-                             device.hostname = resolve_hostname(d['ip'])
-                    
-                    if not device.vendor or device.vendor == "Unknown Vendor":
-                         device.vendor = get_vendor_from_mac(d['mac'])
-                         device.device_type = guess_device_type(device.vendor, device.hostname)
-
-                    if device.hostname == "Unknown" and device.vendor != "Unknown Vendor":
-                        device.hostname = f"Dispositivo {device.vendor}"
-
-                    device.status = "Online"
-                    device.ip = d['ip']
-                    device.last_seen = now
-                db.commit()
-
-            # Mark Offline
-            threshold = now - datetime.timedelta(minutes=5)
-            offline_devices = db.query(Device).filter(
-                Device.status == "Online",
-                ~Device.mac.in_(found_macs),
-                Device.last_seen < threshold
-            ).all()
-
-            for dev in offline_devices:
-                dev.status = "Offline"
-                alert_msg = f"Dispositivo desconectado: {dev.hostname or dev.ip}"
-                new_alert = Alert(
-                    device_id=dev.id,
-                    type="OFFLINE",
-                    condition="device_offline",
-                    level="WARNING",
-                    message=alert_msg,
-                    device_name=dev.hostname or dev.ip,
-                    device_ip=dev.ip
-                )
-                db.add(new_alert)
-                send_notification("Dispositivo Offline", alert_msg)
-                
-                # Disparar alerta con AlertManager
-                if alert_manager:
-                    device_dict = {
-                        'id': dev.id,
-                        'ip': dev.ip,
-                        'hostname': dev.hostname,
-                        'alias': dev.alias,
-                        'status': 'Offline',
-                        'is_authorized': dev.is_authorized
-                    }
-                    alert_manager.process_device_event('offline', device_dict)
-            
-            db.commit()
-            
-            # Broadcast status update
-            total = db.query(Device).count()
-            online = db.query(Device).filter(Device.status == "Online").count()
-            asyncio.run(ws_manager.broadcast_status({
-                "total": total,
-                "online": online
-            }))
-            
+            with SCAN_DURATION.labels("arp").time():
+                found_devices = scan_network_arp(net_range)
+            SCAN_DEVICES_FOUND.set(len(found_devices))
+            with SCAN_DURATION.labels("reconcile").time():
+                reconciler.reconcile(db, found_devices)
+            # Dependencia de red: la caída del router suprime las alertas del resto
+            if gateway_ip and alert_manager and alert_manager.gateway_device_id is None:
+                alert_manager.gateway_device_id = liveness.ip_index.get(gateway_ip)
         except Exception as e:
             logger.error(f"Error in background scan: {e}")
         finally:
@@ -419,9 +301,16 @@ def background_scanner():
 
 @app.on_event("startup")
 async def startup_event():
-    global metrics_collector, alert_manager, snmp_worker
+    global metrics_collector, alert_manager, snmp_worker, event_receiver
+    # Perfilado: tareas del loop de la API y detector de bloqueos (CRC_SLOW_CALLBACK_MS)
+    register_loop(asyncio.get_running_loop())
+    start_loop_watchdog(asyncio.get_running_loop())
     print("\n[STARTUP] 1. Initializing Database...")
     init_db()
+    # Migraciones sobre tablas grandes: en segundo plano, sin bloquear la API
+    start_online_migrations()
+    # Particiones mensuales de metrics_history de los próximos meses (PostgreSQL)
+    start_partition_maintenance()
     print("[STARTUP] 1. DONE")
     
     # Cargar configuración desde BD
@@ -450,33 +339,44 @@ async def startup_event():
     # Auto-crear sensores de ping en background
     # (Lo ejecutamos en un hilo aparte para que no bloquee el inicio de la API)
     print("[STARTUP] 4. Auto Ping Sensors...")
-    threading.Thread(target=auto_create_ping_sensors, daemon=True).start()
+    threading.Thread(target=auto_create_ping_sensors, daemon=True, name="auto-ping-sensors").start()
     
     # Initialize Alert Manager
     print("[STARTUP] 5. Alert Manager...")
     db = SessionLocal()
     alert_manager = AlertManager(db, ALERT_CONFIG)
     alert_manager.load_rules()
+    alert_manager.load_device_state()
+    watch_metric_windows(alert_manager.windows)
     logger.info("✅ Alert Manager initialized")
     print("[STARTUP] 5. DONE")
     
     # Start scanning thread
     print("[STARTUP] 6. Scanner...")
-    thread = threading.Thread(target=background_scanner, daemon=True)
+    thread = threading.Thread(target=background_scanner, daemon=True, name="scanner")
     thread.start()
     
     # Start metrics collector
     print("[STARTUP] 7. Metrics...")
-    metrics_collector = MetricsCollector()
+    metrics_collector = MetricsCollector(on_metric=alert_manager.process_metric, liveness=liveness)
     asyncio.create_task(metrics_collector.start())
     
-    # Init SNMP Worker (DISABLED BY USER REQUEST)
-    # try:
-    #     print("[STARTUP] 8. SNMP Worker (Auto-Detecting Gateway)...")
-    #     snmp_worker = SNMPWorker(ip="auto", community="public")
-    #     asyncio.create_task(snmp_worker.start())
-    # except Exception as e:
-    #      logger.error(f"Failed to start SNMP Worker: {e}")
+    # Init SNMP Worker (desactivado por defecto; CRC_SNMP_ENABLED=1 lo activa)
+    if SNMP_ENABLED:
+        try:
+            print("[STARTUP] 8. SNMP Worker (Auto-Detecting Gateway)...")
+            snmp_worker = SNMPWorker(
+                ip="auto", community=SNMP_COMMUNITY, on_interfaces=metrics_collector.submit_metrics
+            )
+            asyncio.create_task(snmp_worker.start())
+        except Exception as e:
+            logger.error(f"Failed to start SNMP Worker: {e}")
+
+    # Traps SNMP y syslog de los equipos de red
+    if EVENT_RECEIVER_ENABLED:
+        print("[STARTUP] 9. Event Receiver (SNMP traps / syslog)...")
+        event_receiver = EventReceiver(alert_manager=alert_manager, ws_manager=ws_manager, liveness=liveness)
+        await event_receiver.start()
 
     logger.info("🚀 Control Red Casa Pro iniciado correctamente")
     print("[STARTUP] COMPLETED!\n")
@@ -485,19 +385,25 @@ async def startup_event():
 def shutdown_event():
     if metrics_collector:
         metrics_collector.stop()
+    if alert_manager:
+        alert_manager.close()
     if snmp_worker:
         snmp_worker.stop()
+    if event_receiver:
+        event_receiver.stop()
+    stop_bandwidth_monitor()
+    stop_partition_maintenance()
 
 # ============================================
 # ENDPOINTS BÁSICOS (Existentes)
 # ============================================
 
 @app.get("/devices")
-def get_devices(db: Session = Depends(get_db)):
+async def get_devices(db: AsyncSession = Depends(get_async_db)):
+    devices = await repo.list_devices(db)
     # Debug print
-    count = db.query(Device).count()
-    print(f"\n[API DEBUG] Sending {count} devices to frontend")
-    return db.query(Device).all()
+    print(f"\n[API DEBUG] Sending {len(devices)} devices to frontend")
+    return devices
 
     return {"status": "ok", "message": "Backend is reachable via port 8001"}
 
@@ -510,7 +416,7 @@ class DashboardLayout(BaseModel):
     visible_widgets: Optional[List[str]] = None
 
 @app.get("/config/dashboard")
-def get_dashboard_layout(db: Session = Depends(get_db)):
+def get_dashboard_layout(db: Session = Depends(get_read_db)):
     """Recupera el layout del dashboard guardado"""
     config = db.query(Config).filter(Config.key == "dashboard_layout").first()
     if config and config.value:
@@ -537,22 +443,50 @@ def save_dashboard_layout(config: DashboardLayout, db: Session = Depends(get_db)
     db.commit()
     return {"status": "success"}
 
+@app.get("/status/migrations")
+def get_migration_status():
+    """Versión del esquema y progreso de migraciones en curso"""
+    return MIGRATION_STATUS
+
+@app.get("/metrics")
+def get_self_metrics(request: Request):
+    """
+    Métricas internas del monitor (Prometheus / OpenMetrics). Síncrono: al
+    caducar la caché los recuentos de inventario consultan la base de
+    datos, así que se ejecuta en el threadpool y no en el loop.
+    """
+    body, content_type = render_metrics(request.headers.get("accept", ""))
+    return Response(content=body, media_type=content_type)
+
+@app.get("/admin/profile")
+def get_profile(
+    seconds: float = Query(10, gt=0, le=MAX_PROFILE_SECONDS, description="Duración del muestreo"),
+    mode: str = Query("wall", description="wall o cpu"),
+    interval_ms: int = Query(5, ge=1, le=1000, description="Intervalo entre muestras"),
+    tasks: bool = Query(True, description="Incluir las tareas asyncio (solo wall)")
+):
+    """Perfil por muestreo de todos los hilos en formato folded (flamegraph / speedscope)"""
+    if mode not in PROFILE_MODES:
+        return {"error": f"Modo no válido. Opciones: {', '.join(PROFILE_MODES)}"}
+    try:
+        folded = sample_profile(seconds, interval_ms / 1000, mode, tasks)
+    except RuntimeError as e:
+        return {"error": str(e)}
+
+    filename = f"profile-{mode}-{datetime.datetime.now():%Y%m%d-%H%M%S}.folded"
+    return Response(
+        content=folded,
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/alerts")
-def get_alerts(db: Session = Depends(get_db), limit: int = 50):
-    return db.query(Alert).order_by(Alert.timestamp.desc()).limit(limit).all()
+async def get_alerts(db: AsyncSession = Depends(get_async_db), limit: int = 50):
+    return await repo.recent_alerts(db, limit)
 
 @app.get("/status")
-def get_status(db: Session = Depends(get_db)):
-    total = db.query(Device).count()
-    online = db.query(Device).filter(Device.status == "Online").count()
-    new_today = db.query(Device).filter(
-        Device.first_seen >= datetime.datetime.utcnow().replace(hour=0, minute=0, second=0)
-    ).count()
-    return {
-        "total": total,
-        "online": online,
-        "new_today": new_today
-    }
+async def get_status(db: AsyncSession = Depends(get_async_db)):
+    return await repo.status_counts(db)
 
 class AliasUpdate(BaseModel):
     alias: str
@@ -599,56 +533,64 @@ def reidentify_unknown_devices(db: Session = Depends(get_db)):
 # ============================================
 
 @app.get("/metrics/device/{device_id}")
-def get_device_metrics(
+async def get_device_metrics(
     device_id: int,
     metric_name: Optional[str] = None,
     hours: int = Query(24, description="Horas de histórico"),
-    db: Session = Depends(get_db)
+    points: Optional[int] = Query(None, ge=2, le=MAX_POINTS, description="Puntos máximos por métrica (ancho del gráfico)"),
+    step: Optional[int] = Query(None, ge=1, description="Tamaño del cubo en segundos"),
+    mode: str = Query("bucket", description="bucket (min/avg/max/last) o lttb"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Obtiene métricas históricas de un dispositivo"""
-    since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-    
-    query = db.query(MetricHistory).filter(
-        MetricHistory.device_id == device_id,
-        MetricHistory.timestamp >= since
-    )
+    now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(hours=hours)
     
-    if metric_name:
-        query = query.filter(MetricHistory.metric_name == metric_name)
+    # Reducción de puntos en el servidor si el cliente lo pide
+    if points or step:
+        bucket_step = resolve_step(since, now, points, step)
+        if mode == "lttb":
+            target = points or max(3, int((now - since).total_seconds() // bucket_step))
+            data = await repo.lttb_device_metrics(db, device_id, since, target, metric_name)
+        else:
+            mode = "bucket"
+            data = await repo.bucketed_device_metrics(db, device_id, since, bucket_step, metric_name)
+        
+        return {
+            "device_id": device_id,
+            "metric_name": metric_name,
+            "hours": hours,
+            "mode": mode,
+            "step": bucket_step,
+            "count": len(data),
+            "data": data
+        }
     
-    metrics = query.order_by(MetricHistory.timestamp.asc()).all()
+    data = await repo.raw_device_metrics(db, device_id, since, metric_name)
     
     return {
         "device_id": device_id,
         "metric_name": metric_name,
         "hours": hours,
-        "count": len(metrics),
-        "data": [
-            {
-                "timestamp": m.timestamp.isoformat(),
-                "metric_name": m.metric_name,
-                "value": m.value,
-                "unit": m.unit
-            } for m in metrics
-        ]
+        "count": len(data),
+        "data": data
     }
 
+@app.get("/devices/{device_id}/liveness")
+def get_device_liveness(device_id: int):
+    """Última señal por fuente (ARP, mDNS, ping, TCP) y hasta cuándo se considera vivo"""
+    snapshot = liveness.snapshot(device_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return {"device_id": device_id, **snapshot}
+
 @app.get("/metrics/summary/{device_id}")
-def get_metrics_summary(device_id: int, db: Session = Depends(get_db)):
+async def get_metrics_summary(device_id: int, db: AsyncSession = Depends(get_async_db)):
     """Resumen de métricas de un dispositivo (últimas 24h)"""
     since = datetime.datetime.utcnow() - datetime.timedelta(hours=24)
     
     # Obtener estadísticas agregadas
-    result = db.query(
-        MetricHistory.metric_name,
-        func.avg(MetricHistory.value).label('avg_value'),
-        func.min(MetricHistory.value).label('min_value'),
-        func.max(MetricHistory.value).label('max_value'),
-        func.count(MetricHistory.id).label('count')
-    ).filter(
-        MetricHistory.device_id == device_id,
-        MetricHistory.timestamp >= since
-    ).group_by(MetricHistory.metric_name).all()
+    result = await repo.metrics_summary(db, device_id, since)
     
     return {
         "device_id": device_id,
@@ -664,6 +606,68 @@ def get_metrics_summary(device_id: int, db: Session = Depends(get_db)):
         ]
     }
 
+@app.get("/metrics/batch")
+async def get_batch_metrics(
+    metric_name: str,
+    device_ids: Optional[List[int]] = Query(None, description="IDs de dispositivos"),
+    group_id: Optional[int] = None,
+    hours: int = Query(1, description="Horas de histórico"),
+    points: int = Query(300, ge=2, le=MAX_POINTS, description="Puntos máximos por dispositivo"),
+    step: Optional[int] = Query(None, ge=1, description="Tamaño del cubo en segundos"),
+    agg: str = Query("avg", description="avg, min o max"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Una métrica para varios dispositivos (o un grupo) en formato columnar"""
+    ids = list(device_ids or [])
+    if group_id is not None:
+        members = await repo.group_device_ids(db, group_id)
+        ids.extend(m for m in members if m not in ids)
+    
+    now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(hours=hours)
+    bucket_step = resolve_step(since, now, points, step)
+    
+    result = await repo.batch_device_metrics(db, ids, metric_name, since, bucket_step, agg)
+    return {
+        "metric_name": metric_name,
+        "group_id": group_id,
+        "hours": hours,
+        "step": bucket_step,
+        "agg": agg if agg in BATCH_AGGREGATIONS else "avg",
+        "device_ids": ids,
+        **result
+    }
+
+# ============================================
+# EXPORTACIÓN DE HISTÓRICO
+# ============================================
+
+@app.get("/export/{dataset}")
+def export_history(
+    dataset: str,
+    format: str = Query("csv", description="csv, ndjson o parquet"),
+    hours: Optional[int] = Query(None, description="Horas de histórico (vacío = todo)"),
+    device_id: Optional[int] = None
+):
+    """Exporta métricas, alertas o escaneos de puertos en streaming"""
+    if dataset not in EXPORT_DATASETS:
+        return {"error": f"Dataset desconocido: {dataset}"}
+    if format not in EXPORT_FORMATS:
+        return {"error": f"Formato no soportado: {format}"}
+    if format == "parquet" and not parquet_available():
+        return {"error": "La exportación Parquet requiere pyarrow"}
+    
+    since = None
+    if hours:
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    
+    filename = f"{dataset}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(
+        stream_export(dataset, format, since=since, device_id=device_id),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ============================================
 # NUEVOS ENDPOINTS - SENSORES
 # ============================================
@@ -677,7 +681,7 @@ class SensorCreate(BaseModel):
     enabled: bool = True
 
 @app.get("/sensors")
-def get_sensors(device_id: Optional[int] = None, db: Session = Depends(get_db)):
+def get_sensors(device_id: Optional[int] = None, db: Session = Depends(get_read_db)):
     """Lista todos los sensores o por dispositivo"""
     query = db.query(Sensor)
     if device_id:
@@ -732,7 +736,7 @@ class GroupCreate(BaseModel):
     color: str = "#3b82f6"
 
 @app.get("/groups")
-def get_groups(db: Session = Depends(get_db)):
+def get_groups(db: Session = Depends(get_read_db)):
     """Lista todos los grupos"""
     return db.query(DeviceGroup).all()
 
@@ -752,6 +756,7 @@ def create_group(group: GroupCreate, db: Session = Depends(get_db)):
 class DeviceUpdate(BaseModel):
     tags: Optional[str] = None
     group_id: Optional[int] = None
+    parent_id: Optional[int] = None  # 0 = sin equipo aguas arriba
     is_authorized: Optional[bool] = None
     notes: Optional[str] = None
 
@@ -766,6 +771,10 @@ def update_device(device_id: int, update: DeviceUpdate, db: Session = Depends(ge
         device.tags = update.tags
     if update.group_id is not None:
         device.group_id = update.group_id
+    if update.parent_id is not None:
+        if update.parent_id == device_id:
+            return {"error": "A device cannot be its own parent"}
+        device.parent_id = update.parent_id or None
     if update.is_authorized is not None:
         device.is_authorized = update.is_authorized
     if update.notes is not None:
@@ -847,7 +856,7 @@ def scan_ports_endpoint(request: PortScanRequest, db: Session = Depends(get_db))
         return {"status": "error", "message": str(e)}
 
 @app.get("/scan/ports/{device_id}")
-def get_port_scan_history(device_id: int, db: Session = Depends(get_db)):
+def get_port_scan_history(device_id: int, db: Session = Depends(get_read_db)):
     """
     Obtiene el historial de escaneos de puertos de un dispositivo
     """
@@ -888,7 +897,7 @@ class TelegramConfig(BaseModel):
     notify_device_online: bool = False
 
 @app.get("/config/telegram")
-def get_telegram_config(db: Session = Depends(get_db)):
+def get_telegram_config(db: Session = Depends(get_read_db)):
     tg_token = db.query(Config).filter(Config.key == "telegram_bot_token").first()
     tg_chat_id = db.query(Config).filter(Config.key == "telegram_chat_id").first()
     tg_enabled = db.query(Config).filter(Config.key == "telegram_enabled").first()
@@ -960,6 +969,143 @@ def test_telegram_notification(config: TelegramConfig):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.get("/notifications/status")
+def get_notification_status(db: Session = Depends(get_read_db)):
+    """Colas de envío por canal y notificaciones fallidas pendientes"""
+    pending = alert_manager.dispatcher.pending() if alert_manager else {}
+    dead_letters = dict(
+        db.query(NotificationDeadLetter.channel, func.count(NotificationDeadLetter.id))
+        .filter(NotificationDeadLetter.retried_at.is_(None))
+        .group_by(NotificationDeadLetter.channel).all()
+    )
+    lifecycle = {
+        "open": alert_manager.lifecycle.open_count(),
+        "pending_escalations": alert_manager.lifecycle.pending_escalations()
+    } if alert_manager else {}
+    return {"channels": pending, "dead_letters": dead_letters, "alerts": lifecycle}
+
+@app.get("/notifications/dead-letters")
+def get_dead_letters(limit: int = 50, channel: Optional[str] = None, db: Session = Depends(get_read_db)):
+    query = db.query(NotificationDeadLetter).filter(NotificationDeadLetter.retried_at.is_(None))
+    if channel:
+        query = query.filter(NotificationDeadLetter.channel == channel)
+    return [
+        {
+            "id": d.id,
+            "channel": d.channel,
+            "message": (d.payload or {}).get("message"),
+            "error": d.error,
+            "attempts": d.attempts,
+            "created_at": d.created_at.isoformat() if d.created_at else None
+        }
+        for d in query.order_by(NotificationDeadLetter.created_at.desc()).limit(limit).all()
+    ]
+
+@app.post("/notifications/dead-letters/{dead_letter_id}/retry")
+def retry_dead_letter(dead_letter_id: int, db: Session = Depends(get_db)):
+    dead_letter = db.query(NotificationDeadLetter).filter(NotificationDeadLetter.id == dead_letter_id).first()
+    if not dead_letter:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    if not alert_manager:
+        return {"error": "Alert Manager not running"}
+    try:
+        alert = AlertEvent.from_dict(dead_letter.payload)
+    except (KeyError, ValueError, TypeError) as e:
+        return {"error": f"Payload no válido: {e}"}
+    if not alert_manager.dispatcher.submit(dead_letter.channel, alert):
+        return {"error": "Cola de envío llena"}
+    dead_letter.retried_at = datetime.datetime.utcnow()
+    db.commit()
+    return {"status": "queued"}
+
+# ============================================
+# REGLAS DE ALERTA
+# ============================================
+
+class AlertRuleRequest(BaseModel):
+    name: str
+    condition: str  # device_offline, high_latency, ...
+    level: str = "warning"
+    channels: List[str] = ["in_app"]
+    enabled: bool = True
+    device_id: Optional[int] = None  # None = regla global
+    threshold: Optional[float] = None
+    operator: str = ">"
+    aggregation: Optional[str] = None  # avg, min, max, sum, count, p50, p95, p99...
+    time_window: Optional[int] = None  # Minutos
+    metric_name: Optional[str] = None  # ping_latency, http_response_time...
+    throttle_minutes: int = 5
+    escalate_after_minutes: Optional[int] = None
+    description: Optional[str] = None
+
+def _rule_columns(data: AlertRuleRequest) -> dict:
+    """Valida la petición y devuelve los campos de alert_rules"""
+    try:
+        rule = RuleConfig(
+            name=data.name,
+            condition=AlertCondition(data.condition.lower()),
+            level=AlertLevel(data.level.lower()),
+            channels=[AlertChannel(ch.lower()) for ch in data.channels],
+            enabled=data.enabled,
+            device_id=data.device_id,
+            threshold=data.threshold,
+            throttle_minutes=data.throttle_minutes,
+            escalate_after_minutes=data.escalate_after_minutes,
+            operator=data.operator,
+            aggregation=data.aggregation.lower() if data.aggregation else None,
+            time_window=data.time_window,
+            metric_name=data.metric_name
+        )
+        rule.validate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    columns = rule.to_columns()
+    columns["description"] = data.description
+    return columns
+
+def _reload_rules():
+    if alert_manager:
+        alert_manager.load_rules()
+
+@app.get("/alert-rules")
+def get_alert_rules(db: Session = Depends(get_read_db)):
+    result = []
+    for row in db.query(AlertRule).order_by(AlertRule.id).all():
+        try:
+            result.append(RuleConfig.from_model(row).to_dict())
+        except ValueError as e:
+            result.append({"id": row.id, "name": row.name, "error": str(e)})
+    return result
+
+@app.post("/alert-rules")
+def create_alert_rule(data: AlertRuleRequest, db: Session = Depends(get_db)):
+    row = AlertRule(**_rule_columns(data))
+    db.add(row)
+    db.commit()
+    _reload_rules()
+    return {"status": "success", "id": row.id}
+
+@app.put("/alert-rules/{rule_id}")
+def update_alert_rule(rule_id: int, data: AlertRuleRequest, db: Session = Depends(get_db)):
+    row = db.query(AlertRule).filter(AlertRule.id == rule_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    for column, value in _rule_columns(data).items():
+        setattr(row, column, value)
+    db.commit()
+    _reload_rules()
+    return {"status": "success"}
+
+@app.delete("/alert-rules/{rule_id}")
+def delete_alert_rule(rule_id: int, db: Session = Depends(get_db)):
+    row = db.query(AlertRule).filter(AlertRule.id == rule_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    db.delete(row)
+    db.commit()
+    _reload_rules()
+    return {"status": "success"}
+
 @app.post("/alerts/{alert_id}/acknowledge")
 def acknowledge_alert(alert_id: int, user: str = "admin", db: Session = Depends(get_db)):
     alert = db.query(Alert).filter(Alert.id == alert_id).first()
@@ -970,6 +1116,9 @@ def acknowledge_alert(alert_id: int, user: str = "admin", db: Session = Depends(
     alert.acknowledged_by = user
     alert.acknowledged_at = datetime.datetime.utcnow()
     db.commit()
+    if alert_manager and alert.resolved_at is None:
+        # Deja de escalar la alerta abierta equivalente de AlertManager
+        alert_manager.acknowledge_open(alert.device_id, alert.condition, user)
     return {"status": "success"}
 
 @app.get("/api/router/stats")
@@ -1040,7 +1189,7 @@ async def serve_react_app(full_path: str):
 
 if __name__ == "__main__":
     # 1. Start API Server in separate thread
-    api_thread = threading.Thread(target=run_uvicorn, daemon=True)
+    api_thread = threading.Thread(target=run_uvicorn, daemon=True, name="uvicorn")
     api_thread.start()
 
     # 2. Open Browser immediately
@@ -1049,7 +1198,7 @@ if __name__ == "__main__":
         time.sleep(2)
         open_dashboard()
     
-    threading.Thread(target=delayed_open, daemon=True).start()
+    threading.Thread(target=delayed_open, daemon=True, name="open-browser").start()
 
     # 3. Create and run System Tray Icon (Blocking in Main Thread)
     try:
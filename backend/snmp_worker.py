@@ -1,138 +1,701 @@
+"""
+Sondeo SNMP asíncrono.
+
+- Un único SnmpEngine por proceso (get_engine), compartido por todos los
+  agentes: crear un motor por consulta cuesta más que la propia consulta.
+- SnmpAgent pide todas las OID escalares en un GET multi-varbind y recorre
+  tablas con GETBULK, varias columnas a la vez.
+- InterfaceTable descubre las interfaces (IF-MIB) una vez y calcula sus
+  tasas con los contadores de 64 bits, teniendo en cuenta que dan la vuelta.
+- detect_gateway() se resuelve una sola vez: /proc/net/route en Linux,
+  `route print` en Windows y `netstat -rn` en macOS.
+- collect_oid_sets() sirve al sensor SNMP: todas las OIDs de un agente
+  (CPU, memoria, temperatura, interfaces...) en un solo GETBULK.
+- SnmpPoller sondea muchos agentes en paralelo (como mucho
+  CRC_SNMP_CONCURRENCY a la vez); SNMPWorker es el caso particular del
+  router (/api/router/stats).
+"""
 import asyncio
-import time
-import subprocess
+import logging
+import os
 import re
-from pysnmp.hlapi.asyncio import *
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pysnmp.hlapi.asyncio import (
+    CommunityData, ContextData, ObjectIdentity, ObjectType, SnmpEngine, UdpTransportTarget
+)
+from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchInstance, NoSuchObject
+
+try:
+    # pysnmp >= 6.2
+    from pysnmp.hlapi.asyncio import get_cmd, bulk_cmd
+except ImportError:
+    from pysnmp.hlapi.asyncio import getCmd as get_cmd, bulkCmd as bulk_cmd
+
+logger = logging.getLogger(__name__)
+
+SNMP_CONCURRENCY = int(os.getenv("CRC_SNMP_CONCURRENCY", "16"))
+SNMP_TIMEOUT = float(os.getenv("CRC_SNMP_TIMEOUT", "1"))
+SNMP_RETRIES = int(os.getenv("CRC_SNMP_RETRIES", "1"))
+# Varbinds por PDU: por debajo del límite de tamaño de la mayoría de agentes
+MAX_VARBINDS = 32
+BULK_REPETITIONS = 25
+
+# OIDs del router (RFC1213 + UCD-SNMP, habitual en routers con Linux)
+ROUTER_OIDS = {
+    "uptime": "1.3.6.1.2.1.1.3.0",
+    "cpu_load": "1.3.6.1.4.1.2021.10.1.3.1",
+    "mem_total": "1.3.6.1.4.1.2021.4.5.0",
+    "mem_avail": "1.3.6.1.4.1.2021.4.6.0"
+}
+
+# IF-MIB: columnas de ifTable e ifXTable (contadores de 64 bits)
+IF_DESCR = "1.3.6.1.2.1.2.2.1.2"
+IF_IN_OCTETS = "1.3.6.1.2.1.2.2.1.10"
+IF_OUT_OCTETS = "1.3.6.1.2.1.2.2.1.16"
+IF_NAME = "1.3.6.1.2.1.31.1.1.1.1"
+IF_HC_IN_OCTETS = "1.3.6.1.2.1.31.1.1.1.6"
+IF_HC_OUT_OCTETS = "1.3.6.1.2.1.31.1.1.1.10"
+# El mapa índice -> nombre se rehace cada hora o al ver un índice nuevo
+INTERFACE_REDISCOVER_SECONDS = 3600
+
+WAN_INTERFACE = os.getenv("CRC_SNMP_WAN_INTERFACE", "")
+SNMP_STORE_SECONDS = float(os.getenv("CRC_SNMP_STORE_SECONDS", "60"))
+
+_engine: Optional[SnmpEngine] = None
+_gateway: Optional[str] = None
+_gateway_detected = False
+
+_IPV4 = re.compile(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
+
+
+class SnmpError(Exception):
+    """Fallo de transporte (timeout, agente inalcanzable) o error de la PDU"""
+
+
+def get_engine() -> SnmpEngine:
+    """Motor SNMP compartido por todas las consultas"""
+    global _engine
+    if _engine is None:
+        _engine = SnmpEngine()
+    return _engine
+
+
+# ============================================
+# PUERTA DE ENLACE
+# ============================================
+
+def _gateway_from_proc(path: str = "/proc/net/route") -> Optional[str]:
+    """Ruta por defecto de la tabla de rutas del kernel (Linux)"""
+    with open(path) as f:
+        next(f)  # Cabecera
+        for line in f:
+            fields = line.split()
+            # Iface Destination Gateway Flags ...; RTF_UP | RTF_GATEWAY
+            if len(fields) > 3 and fields[1] == "00000000" and int(fields[3], 16) & 0x3 == 0x3:
+                return socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
+    return None
+
+
+def _gateway_from_route_print() -> Optional[str]:
+    """Windows: 'route print': Destino Máscara PuertaEnlace Interfaz Métrica"""
+    output = subprocess.check_output(["route", "print", "-4", "0.0.0.0"], timeout=5).decode(errors="ignore")
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[0] == "0.0.0.0" and parts[1] == "0.0.0.0" and _IPV4.match(parts[2]):
+            return parts[2]
+    return None
+
+
+def _gateway_from_netstat() -> Optional[str]:
+    """macOS / BSD: 'netstat -rn' -> 'default <gateway> ...'"""
+    output = subprocess.check_output(["netstat", "-rn", "-f", "inet"], timeout=5).decode(errors="ignore")
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0] == "default" and _IPV4.match(parts[1]):
+            return parts[1]
+    return None
+
+
+def detect_gateway(refresh: bool = False) -> Optional[str]:
+    """IP de la puerta de enlace por defecto; se detecta una vez y se cachea"""
+    global _gateway, _gateway_detected
+    if _gateway_detected and not refresh:
+        return _gateway
+
+    if sys.platform.startswith("linux"):
+        detectors = (_gateway_from_proc,)
+    elif sys.platform == "win32":
+        detectors = (_gateway_from_route_print,)
+    else:
+        detectors = (_gateway_from_netstat,)
+
+    gateway = None
+    for detector in detectors:
+        try:
+            gateway = detector()
+        except Exception as e:
+            logger.warning(f"Detección de puerta de enlace ({detector.__name__}) fallida: {e}")
+        if gateway:
+            break
+
+    _gateway, _gateway_detected = gateway, True
+    if gateway:
+        logger.info(f"Puerta de enlace detectada: {gateway}")
+    return gateway
 
-class SNMPWorker:
-    def __init__(self, ip="auto", community="public", interval=5):
+
+# ============================================
+# AGENTES
+# ============================================
+
+def _value(value) -> Any:
+    """Valor SNMP a Python: int para contadores/enteros, str para el resto, None si no existe"""
+    if isinstance(value, (NoSuchObject, NoSuchInstance, EndOfMibView)):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value.prettyPrint()
+
+
+def _previous_oid(oid: str) -> str:
+    """OID cuyo GETNEXT es `oid`: la del padre para las instancias .0"""
+    arcs = oid.strip(".").split(".")
+    if arcs[-1] == "0":
+        return ".".join(arcs[:-1])
+    arcs[-1] = str(int(arcs[-1]) - 1)
+    return ".".join(arcs)
+
+
+def _split_bulk(var_binds, non_repeaters: int = 0) -> tuple:
+    """
+    (non-repeaters, repetidas en orden de filas) de una respuesta GETBULK.
+    pysnmp < 6.2 la devuelve como tabla de filas, cada una con los
+    non-repeaters delante; las versiones nuevas, plana.
+    """
+    if var_binds and isinstance(var_binds[0], (list, tuple)):
+        head = list(var_binds[0][:non_repeaters])
+        return head, [vb for row in var_binds for vb in row[non_repeaters:]]
+    var_binds = list(var_binds)
+    return var_binds[:non_repeaters], var_binds[non_repeaters:]
+
+
+class SnmpAgent:
+    """Un agente SNMP v2c con su transporte cacheado"""
+
+    def __init__(
+        self,
+        ip: str,
+        community: str = "public",
+        port: int = 161,
+        timeout: float = SNMP_TIMEOUT,
+        retries: int = SNMP_RETRIES
+    ):
         self.ip = ip
-        self.community = community
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.auth = CommunityData(community, mpModel=1)  # v2c
+        self._target = None
+
+    async def target(self):
+        if self._target is None:
+            create = getattr(UdpTransportTarget, "create", None)
+            if create is not None:
+                # pysnmp >= 6.2 resuelve la dirección de forma asíncrona
+                self._target = await create((self.ip, self.port), timeout=self.timeout, retries=self.retries)
+            else:
+                self._target = UdpTransportTarget((self.ip, self.port), timeout=self.timeout, retries=self.retries)
+        return self._target
+
+    @staticmethod
+    def _check(error_indication, error_status, error_index, var_binds):
+        if error_indication:
+            raise SnmpError(str(error_indication))
+        if error_status:
+            raise SnmpError(f"{error_status.prettyPrint()} (varbind {error_index})")
+
+    async def get(self, oids: Dict[str, str]) -> Dict[str, Any]:
+        """{nombre: OID} -> {nombre: valor} en un GET multi-varbind por cada MAX_VARBINDS OIDs"""
+        names = list(oids)
+        values = {}
+        target = await self.target()
+        for start in range(0, len(names), MAX_VARBINDS):
+            chunk = names[start:start + MAX_VARBINDS]
+            result = await get_cmd(
+                get_engine(), self.auth, target, ContextData(),
+                *[ObjectType(ObjectIdentity(oids[name])) for name in chunk]
+            )
+            self._check(*result)
+            for name, (_, value) in zip(chunk, result[3]):
+                values[name] = _value(value)
+        return values
+
+    async def walk(self, *roots: str, max_repetitions: int = BULK_REPETITIONS) -> Dict[str, Dict[str, Any]]:
+        """
+        Recorre varias columnas/subárboles a la vez con GETBULK.
+        Devuelve {raíz: {sufijo del índice: valor}}.
+        """
+        roots = [root.strip(".") for root in roots]
+        tables: Dict[str, Dict[str, Any]] = {root: {} for root in roots}
+        await self._walk(tables, {root: root for root in roots}, max_repetitions)
+        return tables
+
+    async def bulk(
+        self,
+        scalars: Dict[str, str],
+        columns: Iterable[str] = (),
+        max_repetitions: int = BULK_REPETITIONS
+    ) -> tuple:
+        """
+        Escalares y columnas de tabla en una sola petición GETBULK: los
+        escalares van como non-repeaters (GETNEXT de la OID anterior) y las
+        columnas como repeaters. Solo las tablas con más de max_repetitions
+        filas necesitan más peticiones.
+        Devuelve ({nombre: valor}, {raíz: {índice: valor}}).
+        """
+        names = list(scalars)
+        roots = [root.strip(".") for root in columns]
+        tables: Dict[str, Dict[str, Any]] = {root: {} for root in roots}
+        if not roots or len(names) + len(roots) > MAX_VARBINDS:
+            values = await self.get(scalars) if names else {}
+            if roots:
+                await self._walk(tables, {root: root for root in roots}, max_repetitions)
+            return values, tables
+
+        target = await self.target()
+        result = await bulk_cmd(
+            get_engine(), self.auth, target, ContextData(),
+            len(names), max_repetitions,
+            *[ObjectType(ObjectIdentity(_previous_oid(scalars[name]))) for name in names],
+            *[ObjectType(ObjectIdentity(root)) for root in roots]
+        )
+        self._check(*result)
+        head, repeated = _split_bulk(result[3], len(names))
+
+        values = {}
+        missing = {}
+        for position, name in enumerate(names):
+            wanted = scalars[name].strip(".")
+            if position < len(head) and str(head[position][0]) == wanted:
+                values[name] = _value(head[position][1])
+            else:
+                # GETNEXT no cayó en la OID pedida (p.ej. instancia .0 inexistente)
+                missing[name] = wanted
+        if missing:
+            values.update(await self.get(missing))
+
+        cursors = {root: root for root in roots}
+        self._absorb(repeated, roots, tables, cursors)
+        if cursors:
+            await self._walk(tables, cursors, max_repetitions)
+        return values, tables
+
+    async def _walk(self, tables: Dict[str, Dict[str, Any]], cursors: Dict[str, str], max_repetitions: int):
+        target = await self.target()
+        while cursors:
+            active = list(cursors)
+            result = await bulk_cmd(
+                get_engine(), self.auth, target, ContextData(),
+                0, max_repetitions,
+                *[ObjectType(ObjectIdentity(cursors[root])) for root in active]
+            )
+            self._check(*result)
+            if not self._absorb(_split_bulk(result[3])[1], active, tables, cursors):
+                break
+
+    @staticmethod
+    def _absorb(var_binds: List, active: List[str], tables: Dict, cursors: Dict) -> bool:
+        """
+        Reparte las varbinds repetidas de una respuesta GETBULK entre sus
+        columnas y avanza los cursores. False si la respuesta no trae ni una fila.
+        """
+        finished = set()
+        # Respuesta por filas: una varbind por columna pedida en cada repetición
+        for position, (oid, value) in enumerate(var_binds):
+            root = active[position % len(active)]
+            if root in finished:
+                continue
+            oid = str(oid)
+            if isinstance(value, EndOfMibView) or not oid.startswith(root + "."):
+                finished.add(root)
+                continue
+            tables[root][oid[len(root) + 1:]] = _value(value)
+            cursors[root] = oid
+        for root in finished:
+            cursors.pop(root, None)
+        return len(var_binds) >= len(active)
+
+
+# ============================================
+# INTERFACES
+# ============================================
+
+def counter_delta(previous: int, current: int, bits: int = 64) -> Optional[int]:
+    """
+    Incremento de un contador SNMP que da la vuelta al llegar a 2^bits.
+    None si el salto es de más de media vuelta: el agente se reinició y el
+    contador volvió a empezar.
+    """
+    if current >= previous:
+        return current - previous
+    delta = current + (1 << bits) - previous
+    if delta > (1 << (bits - 1)):
+        return None
+    return delta
+
+
+class InterfaceTable:
+    """
+    Interfaces de un agente (IF-MIB). Se descubren una vez recorriendo
+    ifName/ifDescr y cada sondeo pide los contadores ifHCInOctets /
+    ifHCOutOctets de todas en un único GETBULK; si el agente no tiene
+    ifXTable se usan los contadores de 32 bits de ifTable.
+    """
+
+    def __init__(self, agent: SnmpAgent, rediscover_seconds: float = INTERFACE_REDISCOVER_SECONDS):
+        self.agent = agent
+        self.rediscover_seconds = rediscover_seconds
+        self.names: Dict[str, str] = {}  # ifIndex -> nombre
+        self.high_capacity = True
+        self.discovered_at = 0.0
+        self._previous: Dict[str, tuple] = {}  # ifIndex -> (entrada, salida, instante)
+
+    async def discover(self):
+        tables = await self.agent.walk(IF_NAME, IF_DESCR)
+        names = {index: name for index, name in tables[IF_DESCR].items() if name}
+        # ifName (eth0, ge-0/0/1) es más corto y estable que ifDescr
+        names.update((index, name) for index, name in tables[IF_NAME].items() if name)
+        self.names = {index: str(name) for index, name in names.items()}
+        self.discovered_at = time.monotonic()
+        logger.info(f"SNMP {self.agent.ip}: {len(self.names)} interfaces")
+
+    def needs_discovery(self) -> bool:
+        return not self.names or time.monotonic() - self.discovered_at > self.rediscover_seconds
+
+    def columns(self) -> tuple:
+        """Columnas de contadores (entrada, salida) que hay que pedir"""
+        if self.high_capacity:
+            return IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS
+        return IF_IN_OCTETS, IF_OUT_OCTETS
+
+    def max_repetitions(self) -> int:
+        # Una fila por interfaz: todas caben en la misma respuesta
+        return max(len(self.names) + 1, BULK_REPETITIONS)
+
+    async def poll(self) -> Dict[str, Dict[str, float]]:
+        """{interfaz: {"in_bps": ..., "out_bps": ...}} desde el sondeo anterior"""
+        if self.needs_discovery():
+            await self.discover()
+        high_capacity = self.high_capacity
+        rates = self.rates(await self.agent.walk(*self.columns(), max_repetitions=self.max_repetitions()))
+        if high_capacity and not self.high_capacity:
+            rates = self.rates(await self.agent.walk(*self.columns(), max_repetitions=self.max_repetitions()))
+        return rates
+
+    def rates(self, tables: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        """Tasas a partir de las columnas de contadores leídas (walk o bulk)"""
+        in_column, out_column = self.columns()
+        in_table, out_table = tables.get(in_column) or {}, tables.get(out_column) or {}
+        if self.high_capacity and not in_table:
+            # Sin ifXTable (agentes antiguos): contadores de 32 bits desde el próximo sondeo
+            self.high_capacity = False
+            self._previous.clear()
+            return {}
+        bits = 64 if self.high_capacity else 32
+
+        now = time.monotonic()
+        rates = {}
+        for index, in_octets in in_table.items():
+            out_octets = out_table.get(index)
+            if in_octets is None or out_octets is None:
+                continue
+            previous = self._previous.get(index)
+            self._previous[index] = (in_octets, out_octets, now)
+            if previous is None or now <= previous[2]:
+                continue
+            delta_in = counter_delta(previous[0], in_octets, bits)
+            delta_out = counter_delta(previous[1], out_octets, bits)
+            if delta_in is None or delta_out is None:
+                continue
+            name = self.names.get(index)
+            if name is None:
+                # Interfaz nueva (VLAN, túnel): se renombra en el próximo sondeo
+                self.discovered_at = 0.0
+                name = f"if{index}"
+            elapsed = now - previous[2]
+            rates[name] = {"in_bps": delta_in * 8 / elapsed, "out_bps": delta_out * 8 / elapsed}
+        return rates
+
+
+def interface_metrics(rates: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """Tasas por interfaz como métricas (Mbps): bandwidth_in:<interfaz>, bandwidth_out:<interfaz>"""
+    metrics = {}
+    for name, rate in rates.items():
+        metrics[f"bandwidth_in:{name}"] = round(rate["in_bps"] / 1_000_000, 3)
+        metrics[f"bandwidth_out:{name}"] = round(rate["out_bps"] / 1_000_000, 3)
+    return metrics
+
+
+# ============================================
+# SENSOR SNMP
+# ============================================
+
+# Conjuntos de OIDs del sensor SNMP (UCD-SNMP, como los de ROUTER_OIDS).
+# "scalars" van como non-repeaters del GETBULK y "columns" como repeaters.
+OID_SETS = {
+    "cpu": {"scalars": {"cpu_idle": "1.3.6.1.4.1.2021.11.11.0", "load_1m": "1.3.6.1.4.1.2021.10.1.3.1"}},
+    "memory": {"scalars": {"mem_total": "1.3.6.1.4.1.2021.4.5.0", "mem_avail": "1.3.6.1.4.1.2021.4.6.0"}},
+    # lmTempSensorsValue, en milésimas de grado
+    "temperature": {"columns": ("1.3.6.1.4.1.2021.13.16.2.1.3",)},
+    # Contadores de InterfaceTable
+    "interfaces": {}
+}
+DEFAULT_OID_SETS = ("cpu", "memory")
+
+# Agentes y tablas de interfaces por (ip, puerto, comunidad): los sensores se
+# crean en cada recolección, pero el transporte y los contadores previos no
+_agents: Dict[tuple, SnmpAgent] = {}
+_interface_tables: Dict[tuple, InterfaceTable] = {}
+
+
+def agent_for(ip: str, community: str = "public", port: int = 161) -> SnmpAgent:
+    key = (ip, port, community)
+    agent = _agents.get(key)
+    if agent is None:
+        agent = _agents[key] = SnmpAgent(ip, community, port)
+    return agent
+
+
+def interface_table(agent: SnmpAgent) -> InterfaceTable:
+    key = (agent.ip, agent.port, agent.auth.communityName)
+    table = _interface_tables.get(key)
+    if table is None:
+        table = _interface_tables[key] = InterfaceTable(agent)
+    return table
+
+
+async def collect_oid_sets(
+    agent: SnmpAgent,
+    oid_sets: Iterable[str] = DEFAULT_OID_SETS,
+    oids: Optional[Dict[str, str]] = None
+) -> Dict[str, float]:
+    """
+    Lee los conjuntos de OIDs indicados y las OIDs adicionales ({métrica: OID})
+    con un único GETBULK y devuelve las métricas: cpu_usage, load_1m,
+    memory_usage, temperature (la mayor), bandwidth_in/out:<interfaz> y las
+    adicionales que sean numéricas.
+    """
+    oid_sets = list(oid_sets)
+    scalars: Dict[str, str] = {}
+    columns: List[str] = []
+    for name in oid_sets:
+        if name not in OID_SETS:
+            raise ValueError(f"Conjunto de OIDs desconocido: {name}")
+        scalars.update(OID_SETS[name].get("scalars", {}))
+        columns.extend(OID_SETS[name].get("columns", ()))
+    extra = dict(oids or {})
+    scalars.update(extra)
+
+    interfaces = None
+    max_repetitions = BULK_REPETITIONS
+    if "interfaces" in oid_sets:
+        interfaces = interface_table(agent)
+        if interfaces.needs_discovery():
+            await interfaces.discover()
+        columns.extend(interfaces.columns())
+        max_repetitions = interfaces.max_repetitions()
+
+    values, tables = await agent.bulk(scalars, columns, max_repetitions)
+
+    metrics: Dict[str, float] = {}
+    if values.get("cpu_idle") is not None:
+        metrics["cpu_usage"] = max(100 - values["cpu_idle"], 0)
+    if values.get("load_1m") is not None:
+        try:
+            metrics["load_1m"] = float(values["load_1m"])
+        except ValueError:
+            pass
+    total, avail = values.get("mem_total"), values.get("mem_avail")
+    if total and avail is not None:
+        metrics["memory_usage"] = round((total - avail) / total * 100, 1)
+    if "temperature" in oid_sets:
+        temperatures = [value for value in tables[OID_SETS["temperature"]["columns"][0]].values()
+                        if isinstance(value, int) and value > 0]
+        if temperatures:
+            metrics["temperature"] = max(temperatures) / 1000
+    if interfaces is not None:
+        metrics.update(interface_metrics(interfaces.rates(tables)))
+    for name in extra:
+        try:
+            metrics[name] = float(values.get(name))
+        except (TypeError, ValueError):
+            pass
+    return metrics
+
+
+# ============================================
+# SONDEO
+# ============================================
+
+class SnmpPoller:
+    """
+    Sondea periódicamente un conjunto de agentes, cada uno con sus OIDs, en
+    paralelo. on_result(agente, valores) recibe cada respuesta.
+    """
+
+    def __init__(
+        self,
+        interval: float = 60,
+        concurrency: int = SNMP_CONCURRENCY,
+        on_result: Optional[Callable[[SnmpAgent, Dict[str, Any]], None]] = None
+    ):
         self.interval = interval
+        self.concurrency = concurrency
+        self.on_result = on_result
         self.running = False
+        self.agents: Dict[str, tuple] = {}  # ip -> (agente, {nombre: OID})
+        self.results: Dict[str, Dict] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def add_agent(self, agent: SnmpAgent, oids: Dict[str, str]):
+        self.agents[agent.ip] = (agent, dict(oids))
+
+    def remove_agent(self, ip: str):
+        self.agents.pop(ip, None)
+        self.results.pop(ip, None)
+
+    async def poll_agent(self, agent: SnmpAgent, oids: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                values = await agent.get(oids)
+            except Exception as e:
+                logger.warning(f"SNMP {agent.ip}: {e}")
+                self.results[agent.ip] = {"error": str(e), "updated": time.time()}
+                return None
+        self.results[agent.ip] = {"values": values, "updated": time.time()}
+        if self.on_result:
+            self.on_result(agent, values)
+        return values
+
+    async def poll(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Una ronda sobre todos los agentes"""
+        agents = list(self.agents.values())
+        results = await asyncio.gather(*(self.poll_agent(agent, oids) for agent, oids in agents))
+        return {agent.ip: values for (agent, _), values in zip(agents, results)}
+
+    async def start(self):
+        self.running = True
+        while self.running:
+            started = time.monotonic()
+            await self.poll()
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def stop(self):
+        self.running = False
+
+
+class SNMPWorker(SnmpPoller):
+    """
+    Estadísticas del router (puerta de enlace) para /api/router/stats.
+    on_interfaces(ip, métricas) recibe cada SNMP_STORE_SECONDS la media de
+    las tasas por interfaz para guardarlas; se llama desde el loop, así que
+    no debe esperar a la base de datos (MetricsCollector.submit_metrics).
+    """
+
+    def __init__(
+        self,
+        ip="auto",
+        community="public",
+        interval=5,
+        wan_interface: str = WAN_INTERFACE,
+        on_interfaces: Optional[Callable[[str, Dict[str, float]], None]] = None,
+        store_seconds: float = SNMP_STORE_SECONDS
+    ):
+        super().__init__(interval=interval, on_result=self._update)
+        if ip == "auto":
+            ip = detect_gateway() or "192.168.1.1"
+        self.ip = ip
+        self.community = community
         self.metrics = {
             "uptime": 0,
             "traffic_in": 0,
             "traffic_out": 0,
             "cpu_load": 0,
             "ram_usage": 0,
+            "interfaces": {},
             "last_updated": 0,
-            "ip_used": "Pending"
+            "ip_used": ip
         }
-        self._prev_traffic = {"in": 0, "out": 0, "time": 0}
+        agent = SnmpAgent(ip, community)
+        self.add_agent(agent, ROUTER_OIDS)
+        self.interfaces = InterfaceTable(agent)
+        self.wan_interface = wan_interface
+        self.on_interfaces = on_interfaces
+        self.store_seconds = store_seconds
+        self._pending: Dict[str, List[float]] = {}  # métrica -> [suma, muestras]
+        self._stored_at = time.monotonic()
 
-    def detect_gateway(self):
-        try:
-            # Try Windows route command
-            output = subprocess.check_output("route print 0.0.0.0", shell=True).decode()
-            for line in output.split("\n"):
-                if "0.0.0.0" in line and "0.0.0.0" in line:
-                    parts = line.split()
-                    for part in parts:
-                        # Simple regex for IP
-                        if re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$", part):
-                             if part != "0.0.0.0" and not part.startswith("127"):
-                                 print(f"[SNMP] Detected Gateway: {part}")
-                                 return part
-        except Exception as e:
-            print(f"[SNMP] Gateway detection failed: {e}")
-        
-        return "192.168.1.1" # Fallback
+    def _update(self, agent: SnmpAgent, values: Dict[str, Any]):
+        if values.get("uptime") is not None:
+            self.metrics["uptime"] = values["uptime"] / 100  # timeticks to seconds
 
-    async def get_oid(self, oid_str):
-        target_ip = self.ip
-        if target_ip == "auto" or target_ip == "192.168.1.1": # Force detect if default
-             target_ip = self.detect_gateway()
-             self.ip = target_ip # Cache it
-             self.metrics["ip_used"] = target_ip
+        if values.get("cpu_load") is not None:
+            try:
+                self.metrics["cpu_load"] = float(values["cpu_load"])
+            except ValueError:
+                pass
 
-        try:
-            errorIndication, errorStatus, errorIndex, varBinds = await getCmd(
-                SnmpEngine(),
-                CommunityData(self.community, mpModel=1), # v2c
-                UdpTransportTarget((target_ip, 161), timeout=1, retries=1),
-                ContextData(),
-                ObjectType(ObjectIdentity(oid_str))
-            )
+        total, avail = values.get("mem_total"), values.get("mem_avail")
+        if total and avail is not None:
+            self.metrics["ram_usage"] = round((total - avail) / total * 100, 1)
 
-            if errorIndication:
-                print(f"SNMP Error: {errorIndication}")
-                return None
-            elif errorStatus:
-                print(f"SNMP Error Status: {errorStatus}")
-                return None
-            else:
-                for varBind in varBinds:
-                    return varBind[1]
+        self.metrics["last_updated"] = time.time()
+
+    def _update_interfaces(self, rates: Dict[str, Dict[str, float]]):
+        self.metrics["interfaces"] = {
+            name: {key: round(value, 2) for key, value in rate.items()} for name, rate in rates.items()
+        }
+        # Tráfico del router: la interfaz WAN configurada o, si no, la de más tráfico
+        wan = rates.get(self.wan_interface) if self.wan_interface else None
+        if wan is None and rates:
+            wan = max(rates.values(), key=lambda rate: rate["in_bps"] + rate["out_bps"])
+        if wan is not None:
+            self.metrics["traffic_in"] = round(wan["in_bps"], 2)
+            self.metrics["traffic_out"] = round(wan["out_bps"], 2)
+
+        if self.on_interfaces is None:
+            return
+        for name, value in interface_metrics(rates).items():
+            pending = self._pending.setdefault(name, [0.0, 0])
+            pending[0] += value
+            pending[1] += 1
+        if time.monotonic() - self._stored_at < self.store_seconds or not self._pending:
+            return
+        averages = {name: round(total / count, 3) for name, (total, count) in self._pending.items()}
+        self._pending.clear()
+        self._stored_at = time.monotonic()
+        try:
+            self.on_interfaces(self.ip, averages)
         except Exception as e:
-            print(f"SNMP Exception {oid_str}: {e}")
-            return None
+            logger.error(f"Error guardando métricas de interfaces de {self.ip}: {e}")
 
     async def poll(self):
-        # OIDs Standard (RFC1213)
-        # sysUpTime: .1.3.6.1.2.1.1.3.0
-        # ifInOctets (Wan usually index 2 or 5? Asus often uses vlan or eth0): .1.3.6.1.2.1.2.2.1.10.X
-        # ifOutOctets: .1.3.6.1.2.1.2.2.1.16.X
-        
-        # NOTE: Finding the correct interface index (IF-MIB) is tricky without walking.
-        # For Asus RT-AC65P, WAN is often eth0 (index 2?).
-        # We will try to fetch multiple and see which one has traffic, or default to a common one.
-        
-        # Let's try index 2 (often eth0/WAN on residential routers)
-        if_index = 2 
-        
-        uptime_val = await self.get_oid('1.3.6.1.2.1.1.3.0')
-        in_bytes = await self.get_oid(f'1.3.6.1.2.1.2.2.1.10.{if_index}')
-        out_bytes = await self.get_oid(f'1.3.6.1.2.1.2.2.1.16.{if_index}')
-        
-        # ASUS Specific for CPU/RAM (Might vary, usually Linux MIB .1.3.6.1.4.1.2021...)
-        # CPU 1 min load: .1.3.6.1.4.1.2021.10.1.3.1
-        # Mem Total: .1.3.6.1.4.1.2021.4.5.0
-        # Mem Avail: .1.3.6.1.4.1.2021.4.6.0
-        
-        load_1min = await self.get_oid('1.3.6.1.4.1.2021.10.1.3.1')
-        mem_total = await self.get_oid('1.3.6.1.4.1.2021.4.5.0')
-        mem_avail = await self.get_oid('1.3.6.1.4.1.2021.4.6.0')
-
-        now = time.time()
-        
-        # Calculate rates
-        if in_bytes and out_bytes:
-            current_in = int(in_bytes)
-            current_out = int(out_bytes)
-            
-            if self._prev_traffic["time"] > 0:
-                dt = now - self._prev_traffic["time"]
-                if dt > 0:
-                    speed_in = (current_in - self._prev_traffic["in"]) * 8 / dt # bits per second
-                    speed_out = (current_out - self._prev_traffic["out"]) * 8 / dt
-                    
-                    self.metrics["traffic_in"] = max(0, round(speed_in, 2))
-                    self.metrics["traffic_out"] = max(0, round(speed_out, 2))
-
-            self._prev_traffic = {"in": current_in, "out": current_out, "time": now}
-
-        if uptime_val:
-            self.metrics["uptime"] = int(uptime_val) / 100 # timeticks to seconds
-            
-        if load_1min:
-             self.metrics["cpu_load"] = float(load_1min)
-             
-        if mem_total and mem_avail:
-            total = int(mem_total)
-            avail = int(mem_avail)
-            used = total - avail
-            percent = (used / total) * 100 if total > 0 else 0
-            self.metrics["ram_usage"] = round(percent, 1)
-
-        self.metrics["last_updated"] = now
+        await super().poll()
+        try:
+            self._update_interfaces(await self.interfaces.poll())
+        except Exception as e:
+            logger.warning(f"SNMP {self.ip} (interfaces): {e}")
+        return self.metrics
 
     async def start(self):
-        self.running = True
-        print(f"Iniciando SNMP Worker para {self.ip}...")
-        while self.running:
-            await self.poll()
-            await asyncio.sleep(self.interval)
-
-    def stop(self):
-        self.running = False
+        logger.info(f"Iniciando SNMP Worker para {self.ip}...")
+        await super().start()
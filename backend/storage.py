@@ -0,0 +1,204 @@
+"""
+Optimizaciones específicas de cada motor de base de datos.
+
+El resto del backend usa SQLAlchemy de forma neutra; aquí vive lo que
+depende del dialecto: particionado de metrics_history en PostgreSQL
+(hypertable de TimescaleDB si la extensión está disponible, o
+particionado nativo por mes) y el mantenimiento periódico de cada motor.
+"""
+import datetime
+import logging
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Meses de particiones creadas por adelantado (particionado nativo)
+PARTITION_MONTHS_AHEAD = 2
+# Cada cuánto se crean las particiones de los próximos meses (0 = solo al arrancar)
+PARTITION_CHECK_SECONDS = float(os.getenv("CRC_PARTITION_CHECK_SECONDS", "21600"))
+
+_METRICS_COLUMNS = "id, device_id, sensor_id, metric_name, value, unit, timestamp"
+
+_METRICS_COLUMNS_DDL = """
+    id SERIAL NOT NULL,
+    device_id INTEGER REFERENCES devices (id),
+    sensor_id INTEGER REFERENCES sensors (id),
+    metric_name VARCHAR,
+    value FLOAT,
+    unit VARCHAR,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (id, timestamp)
+"""
+
+
+def timescale_available(conn) -> bool:
+    """True si el servidor PostgreSQL tiene TimescaleDB instalable"""
+    return conn.execute(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'"
+    )).first() is not None
+
+
+def is_partitioned(conn, table: str) -> bool:
+    """True si la tabla ya es hypertable o tabla particionada"""
+    partitioned = conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :t"
+    ), {"t": table}).first()
+    if partitioned:
+        return True
+
+    has_timescale = conn.execute(text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+    )).first()
+    if has_timescale:
+        return conn.execute(text(
+            "SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = :t"
+        ), {"t": table}).first() is not None
+    return False
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _next_month(day: datetime.date) -> datetime.date:
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def create_metric_partitions(
+    conn,
+    table: str,
+    start: datetime.date,
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+    prefix: str = "metrics_history"
+):
+    """
+    Crea particiones mensuales desde `start` hasta `months_ahead` meses tras hoy.
+    Se nombran con `prefix` para que no cambien al renombrar la tabla padre.
+    """
+    month = _month_start(start)
+    end = _month_start(datetime.date.today())
+    for _ in range(months_ahead):
+        end = _next_month(end)
+
+    while month <= end:
+        upper = _next_month(month)
+        _create_month_partition(conn, table, prefix, month, upper)
+        month = upper
+
+
+def _create_month_partition(conn, table: str, prefix: str, month: datetime.date, upper: datetime.date):
+    """
+    Crea la partición [month, upper). PostgreSQL rechaza CREATE TABLE ...
+    PARTITION OF si la partición DEFAULT ya tiene filas de ese rango (las
+    que llegaron antes de que existiera), así que en ese caso se separa la
+    DEFAULT, se crea la partición, se mueven esas filas y se vuelve a
+    adjuntar, todo en la transacción de `conn`.
+    """
+    name = f"{prefix}_{month:%Y%m}"
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None:
+        return
+
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+    default = f"{prefix}_default"
+    in_range = f"timestamp >= '{month.isoformat()}' AND timestamp < '{upper.isoformat()}'"
+    stray = conn.execute(text("SELECT to_regclass(:n)"), {"n": default}).scalar() is not None and \
+        conn.execute(text(f"SELECT 1 FROM {default} WHERE {in_range} LIMIT 1")).first() is not None
+    if not stray:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+        return
+
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+    moved = conn.execute(text(
+        f"INSERT INTO {name} ({_METRICS_COLUMNS}) "
+        f"SELECT {_METRICS_COLUMNS} FROM {default} WHERE {in_range}"
+    )).rowcount
+    conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logger.info(f"{name}: {moved} filas movidas desde {default}")
+
+
+def create_partitioned_metrics(conn, new_name: str, source: str = "metrics_history"):
+    """
+    Crea `new_name` con la estructura de metrics_history preparada para
+    series temporales: hypertable si hay TimescaleDB, si no particionado
+    nativo por rango mensual de timestamp. Se usa como create_new de
+    migrations.copy_and_swap.
+    """
+    if timescale_available(conn):
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+        conn.execute(text(f"CREATE TABLE {new_name} ({_METRICS_COLUMNS_DDL})"))
+        conn.execute(text(
+            f"SELECT create_hypertable('{new_name}', 'timestamp', "
+            f"chunk_time_interval => INTERVAL '1 day')"
+        ))
+        logger.info(f"{new_name}: hypertable de TimescaleDB")
+        return
+
+    conn.execute(text(f"CREATE TABLE {new_name} ({_METRICS_COLUMNS_DDL}) PARTITION BY RANGE (timestamp)"))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {source}_default PARTITION OF {new_name} DEFAULT"))
+
+    oldest = conn.execute(text(f"SELECT min(timestamp) FROM {source}")).scalar()
+    start = oldest.date() if oldest else datetime.date.today()
+    create_metric_partitions(conn, new_name, start, prefix=source)
+    logger.info(f"{new_name}: particionado nativo mensual")
+
+
+def maintain(bind):
+    """Mantenimiento al arrancar según el motor"""
+    if bind.dialect.name == "sqlite":
+        with bind.connect() as conn:
+            conn.exec_driver_sql("PRAGMA optimize")
+        return
+
+    if bind.dialect.name == "postgresql":
+        maintain_partitions(bind)
+
+
+def maintain_partitions(bind):
+    """Particiones de los próximos meses (solo particionado nativo de PostgreSQL)"""
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.begin() as conn:
+        native = conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = 'metrics_history'"
+        )).first()
+        if native:
+            create_metric_partitions(conn, "metrics_history", datetime.date.today())
+
+
+_partition_stop = threading.Event()
+
+
+def start_partition_maintenance(bind=None) -> Optional[threading.Thread]:
+    """
+    Hilo que cada PARTITION_CHECK_SECONDS crea las particiones de los
+    próximos meses; sin él, un servidor que no se reinicia acabaría
+    escribiendo todo en la partición DEFAULT.
+    """
+    if bind is None:
+        from database import engine as bind
+    if bind.dialect.name != "postgresql" or PARTITION_CHECK_SECONDS <= 0:
+        return None
+
+    def worker():
+        while not _partition_stop.wait(PARTITION_CHECK_SECONDS):
+            try:
+                maintain_partitions(bind)
+            except Exception as e:
+                logger.error(f"Error creando particiones de metrics_history: {e}")
+
+    _partition_stop.clear()
+    thread = threading.Thread(target=worker, daemon=True, name="metric-partitions")
+    thread.start()
+    return thread
+
+
+def stop_partition_maintenance():
+    _partition_stop.set()
@@ -3,9 +3,12 @@ Sistema de WebSockets para comunicación en tiempo real con el frontend.
 """
 import json
 import logging
+import time
 from typing import List
 from fastapi import WebSocket, WebSocketDisconnect
 
+from instrumentation import BROADCAST
+
 logger = logging.getLogger(__name__)
 
 class ConnectionManager:
@@ -32,6 +35,7 @@ class ConnectionManager:
     
     async def broadcast(self, message: dict):
         """Envía un mensaje a todas las conexiones activas"""
+        started = time.perf_counter()
         disconnected = []
         for connection in self.active_connections:
             try:
@@ -43,6 +47,7 @@ class ConnectionManager:
         # Limpiar conexiones rotas
         for conn in disconnected:
             self.disconnect(conn)
+        BROADCAST.labels(message.get("type", "unknown")).observe(time.perf_counter() - started)
     
     async def broadcast_device_update(self, device_data: dict):
         """Broadcast actualización de dispositivo"""